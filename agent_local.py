@@ -1,7 +1,15 @@
 # agent_local.py - Hỗ trợ chế độ Chat vs Hỏi Tài liệu
 import asyncio
-from ollama_client import OllamaClient, ChatMessage
+import os
+from ollama_client import OllamaClient
+from openrouter_client import OpenRouterClient
+from llm_router import LLMRouter
+from llm_types import ChatMessage, LLMStreamError
+from llm_cache import cache_key, get_response_cache
+from retrieval_cache import normalize_query
 from database import db_manager
+from llm_scheduler import PRIORITY_CHAT, PRIORITY_DOC
+from prompt_builder import PromptBuilder
 
 try:
     from duckduckgo_search import DDGS
@@ -11,22 +19,113 @@ except ImportError:
 
 class LocalConstructionAgent:
     def __init__(self):
-        self.llm_client = OllamaClient()
+        self.local_llm = OllamaClient()
+        providers = [self.local_llm]
+        # Đẩy bớt sang OpenRouter khi Ollama quá tải / lỗi: phải bật rõ ràng (LLM_OFFLOAD=1 + OPENROUTER_API_KEY)
+        # vì prompt chứa nội dung tài liệu nội bộ và sẽ được gửi tới model miễn phí của bên thứ ba
+        if os.getenv('OPENROUTER_API_KEY') and os.getenv('LLM_OFFLOAD', '0') == '1':
+            providers.append(OpenRouterClient())
+        # Ollama có từ 2 request đang chạy/chờ trở lên mới đẩy ra ngoài
+        self.llm_client = LLMRouter(providers, max_queue={"ollama": 2})
         self.db = db_manager
-        
-    def _format_history(self, chat_history):
-        if not chat_history: return ""
-        text = ""
-        for msg in chat_history[-4:]: 
-            role = "Người dùng" if msg['role'] == 'user' else "Trợ lý"
-            content = msg['content'][:500]
-            text += f"- {role}: {content}\n"
-        return text
+        # Ngân sách token cho prompt (chừa phần còn lại của num_ctx cho câu trả lời)
+        self.prompt_builder = PromptBuilder(budget=3000, passage_max_tokens=600, message_max_tokens=300)
+        self.search_top_k = 5
+        self.neighbor_window = 1  # ghép chunk liền kề để đoạn trích không bị cắt giữa chừng
+        self.doc_temperature = 0  # hỏi tài liệu: trả lời tất định -> dùng được cache câu trả lời
+        self.last_prompt_usage = None
+        self.response_cache = get_response_cache()  # cache kết quả phân tích ảnh (LLM_CACHE=0 để tắt)
+        # System prompt cố định theo mode: giữ nguyên từng byte giữa các lượt để Ollama dùng lại KV cache
+        self.system_prompts = {
+            "chat": "Bạn là trợ lý AI thân thiện. Hãy trò chuyện với người dùng bằng tiếng Việt.",
+            "doc": ("Bạn là trợ lý xây dựng. Trả lời bằng tiếng Việt, dựa vào THÔNG TIN THAM KHẢO "
+                    "đi kèm câu hỏi; nếu thông tin không đủ thì nói rõ."),
+        }
 
     async def process_query(self, user_query: str, workspace_id: str = "main", image_data: str = None, chat_history: list = [], mode: str = "auto"):
         """
         mode: 'auto', 'doc' (Hỏi tài liệu), 'chat' (Tán gẫu)
         """
+        vision_key = self._vision_key(user_query, image_data)
+        cached = self._vision_cached(vision_key)
+        if cached is not None:
+            return cached, []
+        # Tìm kiếm (embedding, Milvus, Postgres, web) là code đồng bộ -> chạy ở thread riêng,
+        # không chặn event loop dùng chung đang stream câu trả lời cho người dùng khác
+        messages, sources, options = await asyncio.to_thread(self._prepare, user_query, workspace_id, image_data, chat_history, mode)
+        res = await self.llm_client.chat_completion(messages, **options)
+        if vision_key and res.model != "error":
+            self.response_cache.set(vision_key, res.model, res.content, res.tokens_used)
+        return res.content, sources
+
+    async def process_query_stream(self, user_query: str, workspace_id: str = "main", image_data: str = None, chat_history: list = [], mode: str = "auto"):
+        """
+        Như process_query nhưng trả về (async generator các đoạn text, sources):
+        tìm kiếm xong trước, câu trả lời được stream dần
+        """
+        vision_key = self._vision_key(user_query, image_data)
+        cached = self._vision_cached(vision_key)
+        if cached is not None:
+            return self._single(cached), []
+        messages, sources, options = await asyncio.to_thread(self._prepare, user_query, workspace_id, image_data, chat_history, mode)
+        stream = self.llm_client.chat_completion_stream(messages, raise_errors=bool(vision_key), **options)
+        if vision_key:
+            stream = self._store_vision(stream, vision_key)
+        return stream, sources
+
+    def _llm_options(self, workspace_id, image_data, mode):
+        """
+        Tham số gọi LLM theo mode. Hỏi tài liệu: temperature 0 (trả lời bám tài liệu, tất định) nên cache được,
+        phạm vi cache = dấu vân tay tài liệu của workspace (đổi tài liệu -> câu trả lời cũ không còn được dùng).
+        Tán gẫu / phân tích ảnh: giữ temperature mặc định, không cache ở client LLM.
+        """
+        options = {"priority": self._priority(mode, image_data)}
+        if mode == "chat" or image_data:
+            return options
+        scope = self.db.workspace_cache_scope(workspace_id)
+        options.update(temperature=self.doc_temperature, use_cache=scope is not None, cache_scope=scope)
+        return options
+
+    def _vision_key(self, user_query, image_data):
+        """
+        Phân tích ảnh chỉ phụ thuộc (ảnh, câu hỏi) -> cache theo hash ảnh + câu hỏi đã chuẩn hóa,
+        không theo lịch sử/tài liệu như cache của client LLM
+        """
+        if not image_data or self.response_cache is None:
+            return None
+        return cache_key("vision", "", [ChatMessage("user", normalize_query(user_query), image_data)], {})
+
+    def _vision_cached(self, vision_key):
+        if not vision_key:
+            return None
+        hit = self.response_cache.get(vision_key)
+        if hit:
+            print("♻️ Dùng lại kết quả phân tích ảnh đã cache")
+            return hit["content"]
+        return None
+
+    async def _single(self, text):
+        yield text
+
+    async def _store_vision(self, stream, vision_key):
+        """Stream tiếp cho người dùng, đủ câu trả lời (không lỗi) thì lưu cache"""
+        parts = []
+        try:
+            async for delta in stream:
+                parts.append(delta)
+                yield delta
+        except LLMStreamError as e:
+            yield str(e)
+            return
+        if parts:
+            self.response_cache.set(vision_key, "vision", "".join(parts))
+
+    def _priority(self, mode, image_data):
+        # Tán gẫu trả lời ngắn -> đi trước câu hỏi tài liệu / phân tích ảnh (prompt dài, sinh lâu)
+        return PRIORITY_CHAT if mode == "chat" and not image_data else PRIORITY_DOC
+
+    def _prepare(self, user_query, workspace_id, image_data, chat_history, mode):
+        """Lập kế hoạch + tìm kiếm + dựng prompt. Trả về (messages, sources, tham số gọi LLM)"""
         plan = []
         
         # 1. Xác định kế hoạch dựa trên MODE
@@ -49,53 +148,56 @@ class LocalConstructionAgent:
             elif any(x in q for x in ['giá', 'mới nhất', 'google']) and HAS_DDG: plan.append("search_web")
             else: plan.append("search_db")
 
-        context_info = ""
-        sources = []
+        passages = []
+        notes = ""
         
         # 2. Thực thi tìm kiếm
         if "search_db" in plan:
             print("📂 Tìm DB...")
-            results, _ = self.db.rag_search(user_query, workspace_id, top_k=3)
+            results, _ = self.db.rag_search(user_query, workspace_id, top_k=self.search_top_k,
+                                            neighbor_window=self.neighbor_window)
             if results:
-                context_info += "\n=== TÀI LIỆU NỘI BỘ ===\n"
                 for res in results:
-                    snip = res.get('content', '')[:200].replace('\n', ' ')
-                    context_info += f"- [{res.get('file_name')}]: {snip}...\n"
-                    sources.append({"source": res.get('file_name'), "content": snip, "type": "Local DB"})
+                    passages.append({"source": res.get('file_name'), "content": res.get('content', ''), "type": "Local DB",
+                                     "hit_span": res.get('hit_span')})
             else:
                 if mode == "doc": 
-                    context_info += "\n(Không tìm thấy thông tin nào trong tài liệu của bạn)\n"
+                    notes = "\n(Không tìm thấy thông tin nào trong tài liệu của bạn)\n"
         
         if "search_web" in plan and HAS_DDG:
             try:
                 with DDGS() as ddgs:
                     web_res = list(ddgs.text(user_query, max_results=2))
                     for w in web_res:
-                        context_info += f"- [Web]: {w['body']}\n"
-                        sources.append({"source": "Web", "content": w['body'][:100], "type": "Web"})
+                        passages.append({"source": "Web", "content": w['body'], "type": "Web"})
             except: pass
 
-        # 3. Tổng hợp Prompt
-        hist = self._format_history(chat_history)
+        # 3. Tổng hợp Prompt: [system cố định] + [lịch sử nhiều lượt] + [tài liệu + câu hỏi mới]
+        # Phần thay đổi mỗi lượt nằm cuối cùng -> phần đầu giống hệt lượt trước
+        system_prompt = self.system_prompts["chat" if mode == "chat" else "doc"]
+        # Tán gẫu không có tài liệu -> dành phần lớn ngân sách cho lịch sử (cố định theo mode, không theo lượt)
+        built = self.prompt_builder.build(system_prompt, user_query, passages, chat_history,
+                                          history_share=0.8 if mode == "chat" else None)
+        self.last_prompt_usage = built["usage"]
+        print(f"🧮 Prompt tokens: {built['usage']}")
         
-        if mode == "chat" and not context_info:
-            # Prompt cho chế độ tán gẫu
-            prompt = f"""Bạn là trợ lý AI thân thiện. Hãy trò chuyện với người dùng.
-            Lịch sử:
-            {hist}
-            Câu hỏi: {user_query}"""
+        context_info = notes
+        sources = []
+        if built["passages"]:
+            context_info += "\n=== TÀI LIỆU NỘI BỘ ===\n"
+            for p in built["passages"]:
+                context_info += f"- [{p['source']}]: {p['content']}\n"
+                sources.append({"source": p['source'], "content": p['content'][:200], "type": p['type']})
+        
+        if context_info:
+            prompt = f"THÔNG TIN THAM KHẢO:\n{context_info}\nCÂU HỎI: {user_query}"
         else:
-            # Prompt cho chế độ hỏi tài liệu
-            prompt = f"""Bạn là trợ lý xây dựng. Dựa vào thông tin sau để trả lời.
-            LỊCH SỬ:
-            {hist}
-            THÔNG TIN THAM KHẢO:
-            {context_info}
-            CÂU HỎI: {user_query}
-            TRẢ LỜI (Tiếng Việt):"""
+            prompt = user_query
         
-        msg = ChatMessage(role="user", content=prompt, image_data=image_data)
-        res = await self.llm_client.chat_completion([msg])
-        return res.content, sources
+        messages = [ChatMessage(role="system", content=system_prompt)]
+        # Tin nhắn cũ gửi đúng như đã lưu (không kèm ảnh, không kèm tài liệu của lượt đó)
+        messages += [ChatMessage(role=m['role'], content=m['content']) for m in built["history"]]
+        messages.append(ChatMessage(role="user", content=prompt, image_data=image_data))
+        return messages, sources, self._llm_options(workspace_id, image_data, mode)
 
 agent_system = LocalConstructionAgent()
\ No newline at end of file
@@ -1,6 +1,5 @@
 # app_local_pro.py - Thêm lựa chọn Mode Chat
 import streamlit as st
-import asyncio
 import base64
 import os
 import tempfile
@@ -14,6 +13,8 @@ except ImportError:
     st.error("❌ Lỗi: Thiếu file 'agent_local.py'.")
     st.stop()
 
+from async_runtime import background_loop
+from image_pipeline import image_pipeline
 from database import db_manager
 from document_processor import DocumentProcessor
 from workspace_manager import WorkspaceManager
@@ -37,6 +38,8 @@ def init_systems():
         ws_ui = WorkspaceUI(ws_mgr)
         chat_mgr = ChatSessionManager(db_manager)
         ws_mgr.migrate_existing_documents_to_main()
+        # Nạp sẵn model Ollama + giữ nóng trong giờ làm việc (chạy nền, không chặn khởi động)
+        background_loop.submit(agent_system.local_llm.keep_warm())
         return doc_proc, ws_mgr, ws_ui, chat_mgr
     except Exception as e:
         st.error(f"Lỗi khởi tạo: {e}")
@@ -51,21 +54,18 @@ if 'current_workspace' not in st.session_state: st.session_state.current_workspa
 if 'chat_mode' not in st.session_state: st.session_state.chat_mode = "doc" 
 
 # --- HÀM XỬ LÝ ---
-def handle_local_chat(prompt, workspace, image_data=None, mode="doc"):
-    """Chạy Agent Local với Mode"""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    
+def handle_local_chat_stream(prompt, workspace, image_data=None, mode="doc"):
+    """Chạy Agent Local với Mode, trả về (generator các đoạn text, sources) cho st.write_stream"""
     # Lấy lịch sử
     history = []
     if 'messages' in st.session_state:
-        history = st.session_state.messages[:-1][-5:]
-        
-    response, sources = loop.run_until_complete(
-        agent_system.process_query(prompt, workspace, image_data, chat_history=history, mode=mode)
+        history = st.session_state.messages[:-1]  # cả hội thoại: PromptBuilder cắt theo khối để phần đầu ổn định
+    
+    # Chạy trên event loop nền dùng chung -> giữ kết nối HTTP tới Ollama giữa các tin nhắn
+    stream, sources = background_loop.run(
+        agent_system.process_query_stream(prompt, workspace, image_data, chat_history=history, mode=mode)
     )
-    loop.close()
-    return response, sources
+    return background_loop.iterate(stream), sources
 
 def process_upload(uploaded_file, project_name):
     with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{uploaded_file.name}") as tmp:
@@ -136,7 +136,13 @@ def main():
             image_b64 = None
             if uploaded_img:
                 st.image(uploaded_img, width=200)
-                try: image_b64 = base64.b64encode(uploaded_img.getvalue()).decode('utf-8')
+                try:
+                    # Thu nhỏ + nén lại trước khi gửi (ảnh đã xử lý được cache theo hash)
+                    image_info = image_pipeline.prepare(uploaded_img.getvalue())
+                    image_b64 = image_info["b64"]
+                    if image_info["bytes_out"] < image_info["bytes_in"]:
+                        st.caption(f"🗜️ {image_info['bytes_in'] // 1024} KB → {image_info['bytes_out'] // 1024} KB "
+                                   f"({image_info['width']}x{image_info['height']})")
                 except: pass
 
         # Chat History
@@ -163,33 +169,45 @@ def main():
         if st.session_state.messages and st.session_state.messages[-1]["role"] == "user":
             last_msg = st.session_state.messages[-1]
             with st.chat_message("assistant"):
-                with st.spinner("Ollama đang suy nghĩ..."):
-                    try:
-                        res, src = handle_local_chat(
+                try:
+                    with st.spinner("Đang tìm thông tin..."):
+                        stream, src = handle_local_chat_stream(
                             last_msg["content"], 
                             st.session_state.current_workspace, 
                             last_msg.get("image_data"),
                             mode=st.session_state.chat_mode
                         )
-                        st.markdown(res)
-                        if src:
-                            with st.expander("🔍 Nguồn tham khảo"):
-                                for s in src:
-                                    st.markdown(f"- **{s['type']}**: {s['source']}")
-                        
-                        st.session_state.messages.append({
-                            "role": "assistant", "content": res, "sources": src
-                        })
-                    except Exception as e:
-                        st.error(f"Lỗi: {e}")
+                    # Hiện từng token ngay khi Ollama sinh ra, trả về toàn bộ text khi xong
+                    res = st.write_stream(stream)
+                    if src:
+                        with st.expander("🔍 Nguồn tham khảo"):
+                            for s in src:
+                                st.markdown(f"- **{s['type']}**: {s['source']}")
+                    
+                    st.session_state.messages.append({
+                        "role": "assistant", "content": res, "sources": src
+                    })
+                except Exception as e:
+                    st.error(f"Lỗi: {e}")
 
     # --- TAB 2: TÀI LIỆU ---
     with tab2:
         st.header("Danh sách tài liệu")
+        # Kết quả xoá lần trước (lưu qua st.rerun, nếu không sẽ bị mất trước khi kịp hiện)
+        flash = st.session_state.pop("doc_flash", None)
+        if flash: getattr(st, flash[0])(flash[1])
         if st.button("🔄 Làm mới"): st.rerun()
         try:
             docs = db_manager.get_documents_from_db(st.session_state.current_workspace, 50)
             if docs:
+                # Xoá hàng loạt: chọn nhiều tài liệu rồi xoá 1 lần
+                selected = st.multiselect("Chọn tài liệu cần xóa", [d['id'] for d in docs],
+                                          format_func=lambda i: next(d['file_name'] for d in docs if d['id'] == i))
+                if selected and st.button(f"🗑️ Xóa {len(selected)} tài liệu đã chọn"):
+                    deleted = db_manager.delete_documents(selected)
+                    if deleted is None: st.session_state.doc_flash = ("error", "Lỗi khi xóa tài liệu")
+                    else: st.session_state.doc_flash = ("success", f"Đã xóa {deleted} tài liệu")
+                    st.rerun()
                 for d in docs:
                     with st.expander(f"📄 {d['file_name']} ({d['status']})"):
                         if st.button("Xóa", key=f"del_{d['id']}"):
@@ -201,6 +219,10 @@ def main():
     # --- TAB 3: TRẠNG THÁI ---
     with tab3:
         st.json(db_manager.health_check())
+        if agent_system.local_llm.response_cache:
+            st.json({"llm_cache": agent_system.local_llm.response_cache.stats()})
+        st.json({"llm_scheduler": agent_system.local_llm.scheduler.stats()})
+        st.json({"llm_router": agent_system.llm_client.stats()})
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
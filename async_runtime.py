@@ -0,0 +1,105 @@
+# async_runtime.py - Event loop chạy nền dùng chung cho các lời gọi LLM (httpx async)
+import asyncio
+import threading
+
+import httpx
+
+
+class BackgroundLoop:
+    """
+    1 event loop sống suốt tiến trình trên 1 luồng riêng.
+    Streamlit chạy code đồng bộ -> gửi coroutine sang loop này thay vì tạo loop mới mỗi tin nhắn,
+    nhờ vậy httpx.AsyncClient (gắn với loop) giữ được kết nối keep-alive giữa các lượt chat.
+    """
+
+    def __init__(self, name: str = "llm_loop"):
+        self.name = name
+        self.loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return self.loop
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self.loop.run_forever, name=self.name, daemon=True)
+            self._thread.start()
+            return self.loop
+
+    def run(self, coro, timeout=None):
+        """Chạy coroutine trên loop nền, chờ kết quả (gọi từ code đồng bộ)"""
+        loop = self.start()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+    def submit(self, coro):
+        """Chạy coroutine trên loop nền, không chờ (trả về concurrent.futures.Future)"""
+        return asyncio.run_coroutine_threadsafe(coro, self.start())
+
+    def iterate(self, agen, timeout=None):
+        """Biến async generator thành generator đồng bộ (vd cho st.write_stream)"""
+        async def next_item():
+            return await agen.__anext__()
+        try:
+            while True:
+                try:
+                    yield self.run(next_item(), timeout)
+                except StopAsyncIteration:
+                    break
+        finally:
+            self.run(agen.aclose())
+
+    def stop(self):
+        with self._lock:
+            if self.loop and self.loop.is_running():
+                self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread = None
+
+
+class LoopBoundClient:
+    """
+    httpx.AsyncClient dùng lại giữa các request (pool + keep-alive) cho các client LLM.
+    AsyncClient gắn với event loop tạo ra nó -> gọi từ loop khác thì đóng client cũ rồi tạo client mới.
+    """
+
+    def __init__(self, timeout: httpx.Timeout, limits: httpx.Limits, transport=None):
+        self.timeout = timeout
+        self.limits = limits
+        self.transport = transport  # vd httpx.MockTransport khi test
+        self.client = None
+        self._loop = None
+
+    def get(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self.client is None or self._loop is not loop:
+            self._retire(loop)
+            self.client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits, transport=self.transport)
+            self._loop = loop
+        return self.client
+
+    def _retire(self, loop):
+        """Đóng client cũ trên loop của nó (nếu loop đó còn chạy), không thì đóng trên loop hiện tại"""
+        old, old_loop = self.client, self._loop
+        self.client, self._loop = None, None
+        if old is None:
+            return
+        if old_loop is not None and old_loop.is_running():
+            asyncio.run_coroutine_threadsafe(old.aclose(), old_loop)
+        else:
+            loop.create_task(self._close_quietly(old))
+
+    @staticmethod
+    async def _close_quietly(client):
+        try:
+            await client.aclose()
+        except Exception as e:
+            print(f"⚠️ Lỗi đóng HTTP client cũ: {e}")
+
+    async def aclose(self):
+        if self.client:
+            await self.client.aclose()
+            self.client, self._loop = None, None
+
+
+# Khởi tạo instance global
+background_loop = BackgroundLoop()
@@ -0,0 +1,221 @@
+# benchmark_retrieval.py - Đo chất lượng & tốc độ tìm kiếm (recall@k, MRR, latency từng bước)
+"""
+Chạy rag_search trên corpus cục bộ với vector store nội bộ + keyword trong RAM
+(không cần PostgreSQL/Milvus), so sánh nhiều cấu hình.
+
+    python benchmark_retrieval.py --corpus data/tcvn --questions data/questions.json -k 5
+    python benchmark_retrieval.py ... --compare bench_results/20260101_120000.json
+
+File câu hỏi (JSON list):
+    [{"question": "TCVN 5574 lớp bê tông bảo vệ tối thiểu?",
+      "expected_chunks": ["TCVN 5574-2018.pdf#41"],        # id chunk = "<tên file>#<chunk_index>"
+      "expected_text": ["chiều dày lớp bê tông bảo vệ"]}]   # hoặc: chunk chứa đoạn text này
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Dùng vector store nội bộ trong thư mục tạm -> không đụng dữ liệu thật
+BENCH_DIR = tempfile.mkdtemp(prefix="rag_bench_")
+os.environ["VECTOR_BACKEND"] = "local"
+os.environ["LOCAL_VECTOR_DIR"] = BENCH_DIR
+
+import database
+from document_processor import DocumentProcessor
+from smart_naming import smart_namer
+
+STAGES = ["embed", "vector", "keyword", "rerank", "total"]
+CONFIGS = {
+    "hybrid_rerank": {"legs": {"Vector", "Keyword"}, "rerank": True},
+    "hybrid": {"legs": {"Vector", "Keyword"}, "rerank": False},
+    "vector": {"legs": {"Vector"}, "rerank": False},
+    "keyword": {"legs": {"Keyword"}, "rerank": False},
+}
+
+
+class BenchDatabaseManager(database.DatabaseManager):
+    """DatabaseManager chạy hoàn toàn trong RAM: documents/chunks giả lập PostgreSQL"""
+
+    WORKSPACE = "bench"
+
+    def __init__(self):
+        self.documents = {}
+        self.chunks = []
+        self.document_codes = []  # (document_id, code, base_code) như bảng document_codes
+        self.legs = {"Vector", "Keyword"}
+        super().__init__()
+
+    def _init_models(self):
+        # Dùng lại model đã tải bởi db_manager toàn cục
+        self.embedder = database.db_manager.embedder
+        self.reranker = database.db_manager.reranker
+        self._bench_reranker = self.reranker
+
+    def connect_postgres(self):
+        return True
+
+    def load_corpus(self, corpus_dir, batch_size=64):
+        processor = DocumentProcessor()
+        for path in sorted(Path(corpus_dir).rglob("*")):
+            if not path.is_file(): continue
+            text = processor.extract_text_from_file(str(path))
+            if not text or "[Lỗi" in text: continue
+            self.documents[path.name] = {"id": path.name, "file_name": path.name, "workspace": self.WORKSPACE}
+            # Cùng nguồn trích mã như save_document_codes (tên file + đầu văn bản)
+            for code, base in smart_namer.extract_document_codes(f"{path.name}\n{text[:3000]}"):
+                self.document_codes.append((path.name, code, base))
+            for i, content in enumerate(processor.split_text_into_chunks(text)):
+                self.chunks.append({"id": f"{path.name}#{i}", "document_id": path.name,
+                                    "chunk_index": i, "content": content[:6000]})
+        for start in range(0, len(self.chunks), batch_size):
+            rows = self.chunks[start:start + batch_size]
+            vectors = self.embedder.encode([r["content"] for r in rows])
+            self.local_vector_store.insert(self.WORKSPACE, rows, vectors)
+        print(f"📚 Corpus: {len(self.documents)} tài liệu, {len(self.chunks)} chunks, {len(self.document_codes)} mã tài liệu")
+
+    def configure(self, config):
+        self.legs = config["legs"]
+        self.reranker = self._bench_reranker if config["rerank"] else None
+        # Mỗi cấu hình đo từ cache rỗng
+        self.query_embedding_cache.clear()
+        self.rerank_score_cache.clear()
+
+    def _get_document_info(self, doc_ids):
+        return {d: self.documents[d] for d in doc_ids if d in self.documents}
+
+    def _documents_for_codes(self, query, workspace):
+        # Giống truy vấn trên document_codes: khớp đúng mã trước, không có thì khớp mã gốc
+        codes = smart_namer.extract_document_codes(query)
+        if not codes: return None
+        for column, values in ((1, {c for c, _ in codes}), (2, {b for _, b in codes})):
+            doc_ids = sorted({row[0] for row in self.document_codes if row[column] in values})
+            if doc_ids:
+                return doc_ids
+        return None
+
+    def _vector_search(self, query, workspace, limit, timings=None, document_ids=None):
+        if "Vector" not in self.legs: return []
+        return super()._vector_search(query, workspace, limit, timings, document_ids)
+
+    def _keyword_search(self, query, workspace, limit, timings=None, document_ids=None):
+        # Tương đương "content ILIKE %query%"
+        if "Keyword" not in self.legs: return []
+        started = time.perf_counter()
+        q = query.lower()
+        rows = [c for c in self.chunks if q in c["content"].lower()
+                and (document_ids is None or c["document_id"] in document_ids)][:limit]
+        if timings is not None: timings["keyword"] = time.perf_counter() - started
+        return [dict(c, file_name=c["document_id"], score=0.5, source="Keyword") for c in rows]
+
+
+def _relevance(result, item):
+    """Trả về tập 'đáp án' mà kết quả này khớp"""
+    found = set()
+    if result["id"] in item.get("expected_chunks", []):
+        found.add(result["id"])
+    content = (result.get("content") or "").lower()
+    for text in item.get("expected_text", []):
+        if text.lower() in content:
+            found.add(text)
+    return found
+
+
+def evaluate(db, questions, k, warmup=True):
+    per_question = []
+    if warmup and questions:
+        db.rag_search(questions[0]["question"], db.WORKSPACE, top_k=k, use_cache=False)
+    for item in questions:
+        expected = set(item.get("expected_chunks", [])) | set(item.get("expected_text", []))
+        timings = {}
+        results, _ = db.rag_search(item["question"], db.WORKSPACE, top_k=k, use_cache=False, timings=timings)
+        found, first_rank = set(), None
+        for rank, result in enumerate(results[:k], 1):
+            hit = _relevance(result, item)
+            if hit and first_rank is None: first_rank = rank
+            found |= hit
+        per_question.append({
+            "question": item["question"],
+            "recall": len(found) / len(expected) if expected else 0.0,
+            "rr": 1.0 / first_rank if first_rank else 0.0,
+            "results": [r["id"] for r in results],
+            "timings_ms": {s: round(timings[s] * 1000, 2) for s in STAGES if s in timings},
+        })
+
+    summary = {f"recall@{k}": round(float(np.mean([q["recall"] for q in per_question])), 4),
+               "mrr": round(float(np.mean([q["rr"] for q in per_question])), 4),
+               "latency_ms": {}}
+    for stage in STAGES:
+        values = [q["timings_ms"][stage] for q in per_question if stage in q["timings_ms"]]
+        if values:
+            summary["latency_ms"][stage] = {p: round(float(np.percentile(values, int(p[1:]))), 2)
+                                            for p in ("p50", "p95", "p99")}
+    return summary, per_question
+
+
+def print_report(report, k, baseline=None):
+    print(f"\n{'config':15} {'recall@' + str(k):>9} {'mrr':>7}  " + "  ".join(f"{s + ' p50/p95/p99':>24}" for s in STAGES))
+    for name, summary in report.items():
+        cells = []
+        for stage in STAGES:
+            lat = summary["latency_ms"].get(stage)
+            cells.append(f"{lat['p50']:>7}/{lat['p95']:>7}/{lat['p99']:>7}" if lat else f"{'-':>23}")
+        line = f"{name:15} {summary[f'recall@{k}']:>9} {summary['mrr']:>7}  " + "  ".join(f"{c:>24}" for c in cells)
+        if baseline and name in baseline:
+            old = baseline[name]
+            line += (f"   Δrecall={summary[f'recall@{k}'] - old.get(f'recall@{k}', 0):+.4f}"
+                     f" Δmrr={summary['mrr'] - old.get('mrr', 0):+.4f}"
+                     f" Δp50={summary['latency_ms']['total']['p50'] - old['latency_ms']['total']['p50']:+.2f}ms")
+        print(line)
+
+
+def run(args):
+    with open(args.questions, encoding="utf-8") as f:
+        questions = json.load(f)
+
+    db = BenchDatabaseManager()
+    db.load_corpus(args.corpus)
+
+    report, details = {}, {}
+    for name in args.configs.split(","):
+        db.configure(CONFIGS[name])
+        report[name], details[name] = evaluate(db, questions, args.k)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["summary"]
+    print_report(report, args.k, baseline)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d_%H%M%S")
+    out_path = os.path.join(args.output_dir, f"{stamp}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({"k": args.k, "corpus": args.corpus, "questions": args.questions,
+                   "chunks": len(db.chunks), "summary": report, "per_question": details},
+                  f, indent=2, ensure_ascii=False)
+    print(f"\n💾 Đã ghi kết quả: {out_path}")
+
+
+def main():
+    try:
+        parser = argparse.ArgumentParser(description="Benchmark tìm kiếm RAG")
+        parser.add_argument("--corpus", required=True, help="Thư mục tài liệu (pdf/docx/txt)")
+        parser.add_argument("--questions", required=True, help="File JSON câu hỏi có gán nhãn")
+        parser.add_argument("-k", type=int, default=5)
+        parser.add_argument("--configs", default=",".join(CONFIGS), help="Danh sách cấu hình, cách nhau dấu phẩy")
+        parser.add_argument("--output-dir", default="bench_results")
+        parser.add_argument("--compare", help="File kết quả lần chạy trước để so sánh")
+        run(parser.parse_args())
+    finally:
+        # Vector store tạm chỉ dùng cho lần chạy này
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
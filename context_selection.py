@@ -0,0 +1,104 @@
+# context_selection.py - Lọc trùng gần giống + MMR để ngữ cảnh đưa vào LLM đa dạng hơn
+import re
+import zlib
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None  # Không có tiktoken (hoặc không tải được BPE) -> ước lượng
+
+
+def count_tokens(text: str) -> int:
+    """Đếm token (tiktoken cl100k_base, nếu không có thì ước lượng ~4 ký tự/token)"""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cắt text còn tối đa max_tokens token (cùng cách đếm với count_tokens)"""
+    if not text or max_tokens <= 0:
+        return ""
+    if _ENCODING is not None:
+        tokens = _ENCODING.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else _ENCODING.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def _tail_tokens(text: str, max_tokens: int) -> str:
+    """max_tokens token cuối của text"""
+    if not text or max_tokens <= 0:
+        return ""
+    if _ENCODING is not None:
+        tokens = _ENCODING.encode(text, disallowed_special=())
+        # Cắt giữa 1 ký tự nhiều byte (tiếng Việt có dấu) -> bỏ ký tự hỏng ở đầu
+        return text if len(tokens) <= max_tokens else _ENCODING.decode(tokens[-max_tokens:]).lstrip("\ufffd")
+    return text[-max_tokens * 4:]
+
+
+def truncate_around(text: str, span: Optional[Tuple[int, int]], max_tokens: int) -> str:
+    """
+    Cắt text còn tối đa max_tokens token nhưng giữ đoạn span=(đầu, cuối) (vị trí ký tự, vd. chunk trúng
+    tìm kiếm trong đoạn đã ghép chunk liền kề): giữ đoạn trúng trước, phần còn lại chia đều cho ngữ cảnh
+    hai bên (bên nào ngắn thì nhường cho bên kia). Không có span -> cắt từ đầu như truncate_tokens.
+    """
+    if not span:
+        return truncate_tokens(text, max_tokens)
+    start, end = span
+    before, hit, after = text[:start], truncate_tokens(text[start:end], max_tokens), text[end:]
+    room = max_tokens - count_tokens(hit)
+    if room <= 0:
+        return hit
+    before_tokens, after_tokens = count_tokens(before), count_tokens(after)
+    keep_before = min(before_tokens, max(room // 2, room - after_tokens))
+    keep_after = min(after_tokens, room - keep_before)
+    result = _tail_tokens(before, keep_before) + hit + truncate_tokens(after, keep_after)
+    # Ghép lại có thể lệch 1-2 token ở chỗ nối
+    return result if count_tokens(result) <= max_tokens else truncate_tokens(result, max_tokens)
+
+
+def shingles(text: str, n: int = 5) -> Set[int]:
+    """Tập hash các cụm n từ liên tiếp (đã chuẩn hoá) của đoạn văn"""
+    words = re.findall(r"\w+", (text or "").lower())
+    if len(words) < n:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))} if words else set()
+    return {zlib.crc32(" ".join(words[i:i + n]).encode("utf-8")) for i in range(len(words) - n + 1)}
+
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def select_diverse(items: List[Dict[str, Any]], top_k: int, lambda_mult: float = 0.7,
+                   dup_threshold: float = 0.8) -> List[Dict[str, Any]]:
+    """
+    items: đã sắp theo độ liên quan giảm dần (sau re-rank).
+    - Bỏ các đoạn gần trùng (Jaccard shingle >= dup_threshold) với đoạn đã chọn
+    - Chọn theo MMR: lambda * liên_quan - (1 - lambda) * giống_nhất_với_đã_chọn
+    """
+    if len(items) <= 1:
+        return items[:top_k]
+    # Độ liên quan theo thứ hạng (điểm Vector/Keyword/Re-rank không cùng thang đo)
+    relevance = [1.0 - i / len(items) for i in range(len(items))]
+    signatures = [shingles(item.get("content")) for item in items]
+
+    selected: List[int] = []
+    remaining = list(range(len(items)))
+    while remaining and len(selected) < top_k:
+        best, best_score, best_sim = None, None, 0.0
+        for i in remaining:
+            sim = max((jaccard(signatures[i], signatures[j]) for j in selected), default=0.0)
+            score = lambda_mult * relevance[i] - (1 - lambda_mult) * sim
+            if best_score is None or score > best_score:
+                best, best_score, best_sim = i, score, sim
+        remaining.remove(best)
+        if best_sim >= dup_threshold:
+            continue  # gần trùng với đoạn đã chọn -> bỏ
+        selected.append(best)
+    return [items[i] for i in selected]
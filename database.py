@@ -3,6 +3,9 @@ import os
 import time
 import hashlib
 import uuid
+import threading
+import json
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from typing import List, Dict, Any, Optional
 
 # Import thư viện
@@ -29,6 +32,13 @@ try:
 except ImportError:
     HAS_RERANKER = False
 
+from retrieval_cache import LRUCache, normalize_query
+from milvus_index import MilvusIndexManager, MilvusMaintenance, collection_schema
+from local_vector_store import LocalVectorStore
+from context_selection import select_diverse, count_tokens, truncate_tokens
+from elasticsearch_store import ElasticKeywordIndex, InMemoryKeywordIndex
+from smart_naming import smart_namer
+
 class DatabaseManager:
     def __init__(self):
         print("🔄 Khởi tạo Database Manager...")
@@ -40,21 +50,81 @@ class DatabaseManager:
         self.milvus_port = "19530"
         self.collection_name = "document_embeddings_vn_v1" 
         self.milvus_collection = None
+        # Loại index + nprobe/ef được chọn theo số vector (xem milvus_index.py)
+        self.index_manager = MilvusIndexManager(metric_type="COSINE", target_recall=0.95)
+        self.milvus_index = None
+        # Build lại index chạy nền vào collection shadow rồi đổi alias; trong lúc build mọi ghi/xoá
+        # được áp cho cả shadow (xoá còn được phát lại trước khi đổi, phòng bản chép đè lên)
+        self._milvus_write_lock = threading.Lock()
+        self._milvus_shadow = None
+        self._shadow_deletes = []
+        self._index_rebuild = None
+        # Xoá không flush ngay: flush trễ + compaction định kỳ chạy nền
+        self.milvus_maintenance = MilvusMaintenance(lambda: self.milvus_collection, flush_delay=5.0,
+                                                    compact_interval=3600.0, compact_min_deletes=1000)
+        # Báo cáo lần đối soát Postgres <-> vector store gần nhất (xem reconciler.py)
+        self.last_reconcile = None
+        
+        # Backend vector: 'milvus' | 'local' (vector store nội bộ, không cần Milvus) | 'auto' (Milvus lỗi -> local)
+        self.vector_backend = os.getenv("VECTOR_BACKEND", "milvus")
+        self.local_vector_dir = os.getenv("LOCAL_VECTOR_DIR", "vector_store")
+        self.local_vector_store = None
+        
+        # Backend keyword: 'postgres' (ILIKE) | 'elasticsearch' (BM25) | 'memory' (BM25 giả lập trong RAM)
+        self.keyword_backend = os.getenv("KEYWORD_BACKEND", "postgres")
+        self.elasticsearch_url = os.getenv("ELASTICSEARCH_URL", "http://localhost:9200")
+        self.keyword_index = None
         
         self.embedder = None
         self.reranker = None
+        self.embedding_model_name = 'keepitreal/vietnamese-sbert'
         self.embedding_dimension = 768 
         
+        # Cache vector câu hỏi: khoá = (model, câu hỏi đã chuẩn hoá)
+        self.query_embedding_cache = LRUCache(max_size=2048, ttl=24 * 3600)
+        # Cache kết quả rag_search: khoá kèm "thế hệ" workspace, mọi thao tác ghi sẽ tăng thế hệ
+        self.result_cache = LRUCache(max_size=512)
+        # document_id của từng workspace (lọc ngay trong Milvus), khoá kèm thế hệ workspace
+        self.workspace_docs_cache = LRUCache(max_size=128)
+        # Dấu vân tay tài liệu của workspace (phạm vi cache câu trả lời LLM, lưu qua các lần khởi động)
+        self.workspace_scope_cache = LRUCache(max_size=128, ttl=60)
+        self.workspace_generations = {}
+        self._generation_lock = threading.Lock()
+        
+        # Chạy song song 2 nhánh tìm kiếm (Vector + Keyword), mỗi nhánh có deadline riêng (giây)
+        self.search_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag_leg")
+        self.leg_timeouts = {"Vector": 5.0, "Keyword": 5.0}
+        
+        # Re-rank có giới hạn: số ứng viên, độ dài passage (token), ngân sách thời gian (giây)
+        self.rerank_max_candidates = 20
+        self.rerank_max_tokens = 256
+        self.rerank_budget = 1.5
+        self.rerank_score_cache = LRUCache(max_size=20000)
+        self.rerank_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        # Chỉ 1 job re-rank tại 1 thời điểm: request mới chờ slot trong phần ngân sách còn lại,
+        # hết ngân sách mà job cũ (kể cả đã quá hạn) chưa xong thì bỏ qua re-rank thay vì xếp hàng vô hạn
+        self._rerank_slot = threading.BoundedSemaphore(1)
+        self.rerank_skipped = 0
+        
+        # Lọc đoạn gần trùng (nhiều TCVN lặp lại điều khoản) + chọn theo MMR cho đa dạng
+        self.diversify = True
+        self.mmr_lambda = 0.7
+        self.dup_threshold = 0.8
+        # Mở rộng ±N chunk liền kề của mỗi kết quả (0 = tắt), giới hạn theo token
+        self.neighbor_window = 0
+        self.neighbor_token_budget = 2000
+        
         self._init_models()
         self.connect_postgres()
         self.connect_milvus()
+        self.connect_keyword_index()
     
     def _init_models(self):
         try:
             print("🧠 Đang tải Model Embedding...")
-            self.embedder = SentenceTransformer('keepitreal/vietnamese-sbert')
+            self.embedder = SentenceTransformer(self.embedding_model_name)
             if HAS_RERANKER:
-                self.reranker = Ranker(model_name="ms-marco-MiniLM-L-12-v2", cache_dir="opt")
+                self.reranker = Ranker(model_name="ms-marco-MiniLM-L-12-v2", cache_dir="opt", max_length=self.rerank_max_tokens)
             return True
         except Exception as e:
             print(f"❌ Lỗi tải model: {e}")
@@ -66,6 +136,14 @@ class DatabaseManager:
             return self.postgres_pool.getconn()
         except: return None
 
+    def _require_connection(self):
+        """Như _safe_get_connection nhưng báo lỗi khi không có kết nối (vd. pool cạn vì các nhánh quá hạn còn chạy),
+        để nhánh tìm kiếm bị tính là thiếu thay vì trả về [] như không có kết quả"""
+        conn = self._safe_get_connection()
+        if not conn:
+            raise RuntimeError("Không lấy được kết nối PostgreSQL")
+        return conn
+
     def _safe_put_connection(self, conn):
         if self.postgres_pool and conn:
             try:
@@ -166,7 +244,23 @@ class DatabaseManager:
                     except:
                         conn.rollback() # Rollback nếu lỗi để tiếp tục
 
-                    # 7. Thêm workspace mặc định
+                    # 7. Index cho tra chunk liền kề theo (document_id, chunk_index)
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_chunks_document_chunk ON chunks(document_id, chunk_index)")
+
+                    # 8. Bảng mã tài liệu (TCVN/QCVN/Nghị định...) để tra trực tiếp theo mã
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS document_codes (
+                            document_id VARCHAR(100),
+                            code VARCHAR(100),
+                            base_code VARCHAR(100),
+                            workspace VARCHAR(100) DEFAULT 'main',
+                            PRIMARY KEY (document_id, code)
+                        )
+                    """)
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_document_codes_code ON document_codes(workspace, code)")
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_document_codes_base ON document_codes(workspace, base_code)")
+
+                    # 9. Thêm workspace mặc định
                     cur.execute("INSERT INTO workspaces (id, name, icon) VALUES ('main', 'Chính', '📁') ON CONFLICT (id) DO NOTHING")
                     
                     conn.commit()
@@ -177,28 +271,149 @@ class DatabaseManager:
             return False
 
     def connect_milvus(self):
+        if self.vector_backend == "local":
+            return self._use_local_vector_store()
         try:
             connections.connect("default", host=self.milvus_host, port=self.milvus_port)
             if not utility.has_collection(self.collection_name):
-                fields = [
-                    FieldSchema(name="id", dtype=DataType.VARCHAR, max_length=100, is_primary=True),
-                    FieldSchema(name="document_id", dtype=DataType.VARCHAR, max_length=100),
-                    FieldSchema(name="chunk_index", dtype=DataType.INT64),
-                    FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=self.embedding_dimension),
-                    FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=6000)
-                ]
-                schema = CollectionSchema(fields, "Vietnamese Embeddings")
-                self.milvus_collection = Collection(self.collection_name, schema)
-                index_params = {"metric_type": "COSINE", "index_type": "IVF_FLAT", "params": {"nlist": 128}}
-                self.milvus_collection.create_index("embedding", index_params)
+                self.milvus_collection = Collection(self.collection_name, collection_schema(self.embedding_dimension))
+                self.milvus_index = self.index_manager.choose_index(0)
+                self.milvus_collection.create_index("embedding", self.milvus_index)
+                self.milvus_collection.load()
             else:
                 self.milvus_collection = Collection(self.collection_name)
-            self.milvus_collection.load()
+                self.milvus_collection.load()
+                self.tune_milvus_index()
             return True
         except Exception as e:
             print(f"❌ Lỗi Milvus: {e}")
+            if self.vector_backend == "auto":
+                return self._use_local_vector_store()
             return False
 
+    def _use_local_vector_store(self):
+        self.local_vector_store = LocalVectorStore(self.local_vector_dir, dim=self.embedding_dimension, n_lists=256)
+        print(f"📦 Dùng vector store nội bộ: {self.local_vector_dir}/ ({self.local_vector_store.count()} vectors)")
+        return True
+
+    def connect_keyword_index(self):
+        if self.keyword_backend == "postgres": return False
+        index = InMemoryKeywordIndex() if self.keyword_backend == "memory" else ElasticKeywordIndex(self.elasticsearch_url)
+        try:
+            if index.connect():
+                self.keyword_index = index
+                print(f"🔎 Nhánh Keyword: {self.keyword_backend}")
+                # Index rỗng (mới bật backend / 'memory' sau restart) -> nạp lại chunk đã có trong PostgreSQL
+                if index.count() == 0:
+                    self.reindex_keyword_index()
+                return True
+        except Exception as e:
+            print(f"❌ Lỗi Elasticsearch: {e}")
+        print("⚠️ Nhánh Keyword quay về PostgreSQL ILIKE")
+        return False
+
+    def flush_keyword_index(self):
+        """Đẩy nốt các chunk đang chờ bulk-index (gọi khi xử lý xong 1 tài liệu)"""
+        if not self.keyword_index: return
+        try:
+            self.invalidate_workspace(*self.keyword_index.flush())
+        except Exception as e:
+            print(f"⚠️ Lỗi bulk index Elasticsearch: {e}")
+
+    def reindex_keyword_index(self, batch_size=1000):
+        """Nạp toàn bộ chunk từ PostgreSQL vào keyword index (phân trang theo chunk_id). Trả về số chunk"""
+        if not self.keyword_index: return 0
+        last, total, workspaces = "", 0, set()
+        while True:
+            conn = self._safe_get_connection()
+            if not conn: break
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT chunk_id, document_id, workspace, chunk_index, content FROM chunks
+                        WHERE chunk_id > %s ORDER BY chunk_id LIMIT %s
+                    """, (last, batch_size))
+                    rows = cur.fetchall()
+            finally:
+                self._safe_put_connection(conn)
+            if not rows: break
+            for row in rows:
+                self.keyword_index.add(dict(row))
+                workspaces.add(row['workspace'])
+            total += len(rows)
+            last = rows[-1]['chunk_id']
+        self.keyword_index.flush()
+        self.invalidate_workspace(*workspaces)
+        if total: print(f"🔎 Đã index lại {total} chunk vào nhánh Keyword")
+        return total
+
+    def _has_vector_backend(self):
+        return self.embedder is not None and (self.milvus_collection is not None or self.local_vector_store is not None)
+
+    def tune_milvus_index(self, force=False):
+        """
+        Loại/tham số index không còn hợp với số vector hiện có -> build lại ở luồng nền (không chặn upload/khởi động).
+        Trả về index đang phục vụ (index mới chỉ có hiệu lực khi build xong)
+        """
+        if not self.milvus_collection: return None
+        try:
+            self.milvus_collection.flush()
+            self.milvus_index = self.index_manager.current_index(self.milvus_collection)
+            wanted = self.index_manager.choose_index(self.milvus_collection.num_entities)
+        except Exception as e:
+            print(f"⚠️ Lỗi tune index Milvus: {e}")
+            return self.milvus_index
+        if force or self.index_manager.needs_rebuild(self.milvus_index, wanted):
+            self._start_index_rebuild(wanted)
+        return self.milvus_index
+
+    def _start_index_rebuild(self, wanted):
+        with self._milvus_write_lock:
+            if self._index_rebuild and self._index_rebuild.is_alive(): return
+            self._index_rebuild = threading.Thread(target=self._rebuild_milvus_index, args=(wanted,),
+                                                   name="milvus_index_rebuild", daemon=True)
+            self._index_rebuild.start()
+
+    def _rebuild_milvus_index(self, wanted):
+        """Chép sang shadow + build index trên shadow, search vẫn chạy trên collection cũ; xong thì đổi alias"""
+        old = self.milvus_collection
+        print(f"🔧 Build lại index Milvus (nền): {self.milvus_index and self.milvus_index['index_type']} -> "
+              f"{wanted['index_type']} {wanted['params']}")
+        try:
+            shadow = self.index_manager.create_shadow(old)
+            with self._milvus_write_lock:
+                self._milvus_shadow, self._shadow_deletes = shadow, []
+            self.index_manager.build_shadow(old, wanted, shadow)
+            with self._milvus_write_lock:
+                # Bản chép có thể đã đưa lại entity bị xoá giữa chừng -> phát lại các lệnh xoá
+                for expr in self._shadow_deletes:
+                    shadow.delete(expr)
+                shadow.flush()
+                # Search trong tiến trình chuyển sang shadow trước, rồi mới đổi alias + xoá collection cũ
+                self.milvus_collection, self.milvus_index = shadow, wanted
+                self._milvus_shadow, self._shadow_deletes = None, []
+                self.milvus_collection = self.index_manager.swap_alias(self.collection_name, old, shadow)
+            print(f"✅ Index Milvus mới: {wanted['index_type']} {wanted['params']}")
+        except Exception as e:
+            print(f"⚠️ Lỗi build lại index Milvus: {e}")
+            with self._milvus_write_lock:
+                shadow, self._milvus_shadow, self._shadow_deletes = self._milvus_shadow, None, []
+            if shadow is not None:
+                try: utility.drop_collection(self.index_manager.physical_name(shadow))
+                except Exception: pass
+
+    def maybe_tune_milvus_index(self):
+        """Gọi sau mỗi lô ingest: số vector vượt ngưỡng của loại index hiện tại (FLAT -> IVF -> HNSW) thì build lại"""
+        if not self.milvus_collection: return None
+        try:
+            wanted = self.index_manager.choose_index(self.milvus_collection.num_entities)
+        except Exception as e:
+            print(f"⚠️ Lỗi đọc số vector Milvus: {e}")
+            return self.milvus_index
+        if self.index_manager.needs_rebuild(self.milvus_index, wanted):
+            self._start_index_rebuild(wanted)
+        return self.milvus_index
+
     def save_document_record(self, doc_data):
         conn = self._safe_get_connection()
         if not conn: return False
@@ -231,20 +446,56 @@ class DatabaseManager:
                 conn.commit()
         finally:
             self._safe_put_connection(conn)
+            self.invalidate_workspace(chunk_data['workspace'])
+
+        if self.keyword_index:
+            try:
+                self.invalidate_workspace(*self.keyword_index.add(chunk_data))
+            except Exception as e:
+                print(f"⚠️ Lỗi bulk index Elasticsearch: {e}")
 
-        if self.milvus_collection and self.embedder:
+        if self._has_vector_backend():
             try:
-                vector = self.embedder.encode([chunk_data['content']])[0]
-                entity = [
-                    [chunk_data['chunk_id']], [chunk_data['document_id']],
-                    [chunk_data['chunk_index']], [vector.tolist()],
-                    [chunk_data['content'][:6000]]
-                ]
-                self.milvus_collection.insert(entity)
+                self._insert_vectors([chunk_data], self.embedder.encode([chunk_data['content']]))
                 return True
             except: return False
+            finally: self.invalidate_workspace(chunk_data['workspace'])
         return False
 
+    def _insert_vectors(self, chunks, vectors):
+        """Ghi vector của các chunk (dạng chunk_data) vào Milvus hoặc vector store nội bộ"""
+        if self.local_vector_store:
+            by_workspace = {}
+            for chunk, vector in zip(chunks, vectors):
+                by_workspace.setdefault(chunk['workspace'], ([], []))
+                by_workspace[chunk['workspace']][0].append({
+                    "id": chunk['chunk_id'], "document_id": chunk['document_id'],
+                    "chunk_index": chunk['chunk_index'], "content": chunk['content'][:6000]})
+                by_workspace[chunk['workspace']][1].append(vector)
+            for ws, (rows, vecs) in by_workspace.items():
+                self.local_vector_store.insert(ws, rows, vecs)
+            return
+        data = [
+            [c['chunk_id'] for c in chunks], [c['document_id'] for c in chunks],
+            [c['chunk_index'] for c in chunks], [v.tolist() for v in vectors],
+            [c['content'][:6000] for c in chunks]
+        ]
+        with self._milvus_write_lock:
+            self.milvus_collection.insert(data)
+            if self._milvus_shadow is not None:
+                self._milvus_shadow.upsert(data)
+
+    def milvus_delete(self, expr):
+        """Xoá entity Milvus theo biểu thức (áp cả shadow nếu đang build lại index), flush chạy nền"""
+        with self._milvus_write_lock:
+            result = self.milvus_collection.delete(expr)
+            if self._milvus_shadow is not None:
+                self._milvus_shadow.delete(expr)
+                self._shadow_deletes.append(expr)
+        deleted = getattr(result, "delete_count", 0) or 0
+        self.milvus_maintenance.schedule_flush(deleted)
+        return deleted
+
     def update_document_status(self, doc_id, status, msg=""):
         conn = self._safe_get_connection()
         if not conn: return
@@ -255,6 +506,79 @@ class DatabaseManager:
         finally:
             self._safe_put_connection(conn)
 
+    def save_document_codes(self, doc_id, workspace, text):
+        """Trích mã tài liệu (TCVN 5574:2018, QCVN 06:2022/BXD, NĐ 15/2021/NĐ-CP...) và lưu vào bảng tra cứu"""
+        codes = smart_namer.extract_document_codes(text)
+        if not codes: return []
+        conn = self._safe_get_connection()
+        if not conn: return []
+        try:
+            with conn.cursor() as cur:
+                psycopg2.extras.execute_values(cur, """
+                    INSERT INTO document_codes (document_id, code, base_code, workspace) VALUES %s
+                    ON CONFLICT (document_id, code) DO NOTHING
+                """, [(doc_id, code, base, workspace) for code, base in codes])
+                conn.commit()
+            self.invalidate_workspace(workspace)
+            return [code for code, _ in codes]
+        except Exception as e:
+            print(f"⚠️ Lỗi lưu mã tài liệu: {e}")
+            return []
+        finally:
+            self._safe_put_connection(conn)
+
+    def backfill_document_codes(self, batch_size=200):
+        """Trích mã cho tài liệu upload trước khi có bảng document_codes (tên file + vài chunk đầu). Trả về số tài liệu có mã"""
+        last, found = "", 0
+        while True:
+            conn = self._safe_get_connection()
+            if not conn: break
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT d.id, d.workspace, d.file_name,
+                               (SELECT string_agg(h.content, E'\\n' ORDER BY h.chunk_index) FROM (
+                                    SELECT content, chunk_index FROM chunks c WHERE c.document_id = d.id
+                                    ORDER BY chunk_index LIMIT 4) h) AS head
+                        FROM documents d
+                        WHERE d.id > %s AND NOT EXISTS (SELECT 1 FROM document_codes dc WHERE dc.document_id = d.id)
+                        ORDER BY d.id LIMIT %s
+                    """, (last, batch_size))
+                    rows = cur.fetchall()
+            finally:
+                self._safe_put_connection(conn)
+            if not rows: break
+            for row in rows:
+                # Cùng đầu vào như lúc upload: tên file + 3000 ký tự đầu
+                text = f"{row['file_name']}\n{(row['head'] or '')[:3000]}"
+                if self.save_document_codes(row['id'], row['workspace'], text): found += 1
+            last = rows[-1]['id']
+        if found: print(f"🏷️ Đã trích mã cho {found} tài liệu cũ")
+        return found
+
+    def _documents_for_codes(self, query, workspace):
+        """Câu hỏi nêu mã tài liệu -> danh sách document_id tương ứng (None nếu không nêu / không tìm thấy)"""
+        codes = smart_namer.extract_document_codes(query)
+        if not codes: return None
+        conn = self._safe_get_connection()
+        if not conn: return None
+        try:
+            with conn.cursor() as cur:
+                # Khớp đúng mã (kèm năm) trước, không có thì khớp mã gốc (mọi phiên bản)
+                for column, values in (("code", [c for c, _ in codes]), ("base_code", [b for _, b in codes])):
+                    cur.execute(f"SELECT DISTINCT document_id FROM document_codes WHERE workspace = %s AND {column} = ANY(%s)",
+                                (workspace, values))
+                    doc_ids = [row['document_id'] for row in cur.fetchall()]
+                    if doc_ids:
+                        print(f"🎯 Mã tài liệu {values} -> {len(doc_ids)} tài liệu")
+                        return doc_ids
+            return None
+        except Exception as e:
+            print(f"⚠️ Lỗi tra mã tài liệu: {e}")
+            return None
+        finally:
+            self._safe_put_connection(conn)
+
     def get_documents_from_db(self, workspace, limit=50):
         conn = self._safe_get_connection()
         if not conn: return []
@@ -276,91 +600,498 @@ class DatabaseManager:
         finally: self._safe_put_connection(conn)
 
     def delete_document(self, doc_id):
+        return self.delete_documents([doc_id]) is not None
+
+    def delete_documents(self, doc_ids):
+        """Xoá nhiều tài liệu: 1 câu SQL + 1 biểu thức Milvus, flush Milvus để chạy nền. Trả về số tài liệu đã xoá"""
+        doc_ids = list(dict.fromkeys(doc_ids))
+        if not doc_ids: return 0
         conn = self._safe_get_connection()
-        if not conn: return False
+        if not conn: return None
+        workspaces = []
         try:
             with conn.cursor() as cur:
-                cur.execute("DELETE FROM chunks WHERE document_id = %s", (doc_id,))
-                cur.execute("DELETE FROM documents WHERE id = %s", (doc_id,))
+                cur.execute("""
+                    WITH dc AS (DELETE FROM chunks WHERE document_id = ANY(%s)),
+                         dd AS (DELETE FROM document_codes WHERE document_id = ANY(%s))
+                    DELETE FROM documents WHERE id = ANY(%s) RETURNING workspace
+                """, (doc_ids, doc_ids, doc_ids))
+                deleted = cur.fetchall()
                 conn.commit()
+            workspaces = sorted({row['workspace'] for row in deleted})
             if self.milvus_collection:
-                self.milvus_collection.delete(f'document_id == "{doc_id}"')
-                self.milvus_collection.flush()
-            return True
-        except: return False
-        finally: self._safe_put_connection(conn)
+                self.milvus_delete(f"document_id in {json.dumps(doc_ids)}")
+            if self.local_vector_store:
+                self.local_vector_store.delete_documents(doc_ids)
+            if self.keyword_index:
+                self.keyword_index.delete_documents(doc_ids)
+            return len(deleted)
+        except Exception as e:
+            print(f"❌ Lỗi xoá tài liệu: {e}")
+            try: conn.rollback()
+            except: pass
+            return None
+        finally:
+            self._safe_put_connection(conn)
+            self.invalidate_workspace(*workspaces)
 
-    def rag_search(self, query, workspace, top_k=5):
-        candidates = {}
-        print(f"🔍 Đang tìm kiếm: '{query}'...")
+    def delete_workspace_documents(self, workspace):
+        """Dọn toàn bộ tài liệu của 1 workspace (xoá hàng loạt)"""
+        conn = self._safe_get_connection()
+        if not conn: return None
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT id FROM documents WHERE workspace = %s", (workspace,))
+                doc_ids = [row['id'] for row in cur.fetchall()]
+        finally:
+            self._safe_put_connection(conn)
+        return self.delete_documents(doc_ids)
 
-        if self.milvus_collection and self.embedder:
-            try:
-                query_vector = self.embedder.encode([query])
-                res = self.milvus_collection.search(
-                    data=query_vector.tolist(),
-                    anns_field="embedding",
-                    param={"metric_type": "COSINE", "params": {"nprobe": 10}},
-                    limit=top_k * 2,
-                    output_fields=["content", "document_id", "chunk_index"]
-                )
-                if res:
-                    for hits in res:
-                        for hit in hits:
-                            candidates[hit.id] = {
-                                "id": hit.id,
-                                "content": hit.entity.get('content'),
-                                "file_name": self._get_filename(hit.entity.get('document_id')),
-                                "score": hit.score,
-                                "source": "Vector"
-                            }
-            except Exception as e:
-                print(f"⚠️ Lỗi Vector search: {e}")
+    def _encode_queries(self, queries):
+        """Embedding nhiều câu hỏi: lấy từ cache, phần còn thiếu encode 1 lượt"""
+        keys = [(self.embedding_model_name, normalize_query(q)) for q in queries]
+        vectors = [self.query_embedding_cache.get(key) for key in keys]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            encoded = self.embedder.encode([queries[i] for i in missing])
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+                self.query_embedding_cache.set(keys[i], vector)
+        return vectors
+
+    def _encode_query(self, query):
+        """Embedding câu hỏi, dùng lại kết quả cũ nếu câu hỏi đã gặp"""
+        return self._encode_queries([query])[0]
+
+    def _vector_search_many(self, queries, workspace, limit, timings=None, document_ids=None):
+        """Nhánh Vector cho nhiều câu hỏi: 1 lượt search (multi-vector) + 1 query tra tên file.
+        document_ids: chỉ tìm trong các tài liệu này (vd. câu hỏi nêu đích danh mã TCVN)"""
+        if not self._has_vector_backend(): return [[] for _ in queries]
+        started = time.perf_counter()
+        vectors = self._encode_queries(queries)
+        embedded = time.perf_counter()
+        if self.local_vector_store:
+            hits_per_query = self.local_vector_store.search_many(workspace, vectors, limit, document_ids)
+        else:
+            # Collection dùng chung cho mọi workspace: lọc theo workspace TRONG Milvus,
+            # lọc sau khi search thì workspace nhỏ gần như không còn hit nào trong top `limit`
+            if document_ids is None:
+                document_ids = self._workspace_document_ids(workspace)
+            if not document_ids:
+                return [[] for _ in queries]
+            res = self.milvus_collection.search(
+                data=[v.tolist() for v in vectors],
+                anns_field="embedding",
+                param={"metric_type": "COSINE", "params": self.index_manager.search_params(self.milvus_index, top_k=limit)},
+                limit=limit,
+                expr=f"document_id in {json.dumps(list(document_ids))}",
+                output_fields=["content", "document_id", "chunk_index"]
+            )
+            hits_per_query = [[{
+                "id": hit.id,
+                "document_id": hit.entity.get('document_id'),
+                "chunk_index": hit.entity.get('chunk_index'),
+                "content": hit.entity.get('content'),
+                "score": hit.score,
+            } for hit in hits] for hits in res] if res else [[] for _ in queries]
+        docs = self._get_document_info([hit['document_id'] for hits in hits_per_query for hit in hits])
+        if timings is not None:
+            timings["embed"] = embedded - started
+            timings["vector"] = time.perf_counter() - embedded
+        # Chốt chặn: tài liệu vừa chuyển workspace giữa lúc tra cache và search
+        return [[{
+            "id": hit['id'],
+            "document_id": hit['document_id'],
+            "chunk_index": hit['chunk_index'],
+            "content": hit['content'],
+            "file_name": docs[hit['document_id']]['file_name'],
+            "score": hit['score'],
+            "source": "Vector"
+        } for hit in hits
+            if docs.get(hit['document_id'], {}).get('workspace') == workspace]
+            for hits in hits_per_query]
+
+    def _workspace_document_ids(self, workspace):
+        """Danh sách document_id thuộc workspace (cache tới lần ghi kế tiếp vào workspace)"""
+        with self._generation_lock:
+            key = (workspace, self.workspace_generations.get(workspace, 0))
+        doc_ids = self.workspace_docs_cache.get(key)
+        if doc_ids is not None:
+            return doc_ids
+        conn = self._require_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT id FROM documents WHERE workspace = %s", (workspace,))
+                doc_ids = [row['id'] for row in cur.fetchall()]
+        finally:
+            self._safe_put_connection(conn)
+        self.workspace_docs_cache.set(key, doc_ids)
+        return doc_ids
+
+    def _vector_search(self, query, workspace, limit, timings=None, document_ids=None):
+        """Nhánh Vector cho 1 câu hỏi"""
+        return self._vector_search_many([query], workspace, limit, timings, document_ids)[0]
 
+    def _keyword_hits(self, hits_per_query):
+        """Gắn tên file cho kết quả từ keyword index (1 query tra documents)"""
+        docs = self._get_document_info([hit['document_id'] for hits in hits_per_query for hit in hits])
+        return [[dict(hit, file_name=docs.get(hit['document_id'], {}).get('file_name', "Unknown"), source="Keyword")
+                 for hit in hits] for hits in hits_per_query]
+
+    def _keyword_search(self, query, workspace, limit, timings=None, document_ids=None):
+        """Nhánh Keyword: BM25 (Elasticsearch) nếu bật, không thì ILIKE trên PostgreSQL"""
+        started = time.perf_counter()
+        if self.keyword_index:
+            hits = self._keyword_hits([self.keyword_index.search(query, workspace, limit, document_ids)])[0]
+            if timings is not None: timings["keyword"] = time.perf_counter() - started
+            return hits
+        conn = self._require_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT c.chunk_id, c.document_id, c.chunk_index, c.content, d.file_name 
+                    FROM chunks c
+                    JOIN documents d ON c.document_id = d.id
+                    WHERE c.workspace = %s AND c.content ILIKE %s
+                      AND (%s::text[] IS NULL OR c.document_id = ANY(%s::text[]))
+                    LIMIT %s
+                """, (workspace, f"%{query}%", document_ids, document_ids, limit))
+                return [{
+                    "id": row['chunk_id'],
+                    "document_id": row['document_id'],
+                    "chunk_index": row['chunk_index'],
+                    "content": row['content'],
+                    "file_name": row['file_name'],
+                    "score": 0.5,
+                    "source": "Keyword"
+                } for row in cur.fetchall()]
+        finally:
+            self._safe_put_connection(conn)
+            if timings is not None:
+                timings["keyword"] = time.perf_counter() - started
+
+    def _keyword_search_many(self, queries, workspace, limit, timings=None):
+        """Nhánh Keyword cho nhiều câu hỏi trong 1 câu SQL (LATERAL, mỗi câu hỏi tối đa `limit` dòng)"""
+        started = time.perf_counter()
+        if self.keyword_index:
+            hits = self._keyword_hits(self.keyword_index.search_many(queries, workspace, limit))
+            if timings is not None: timings["keyword"] = time.perf_counter() - started
+            return hits
+        results = [[] for _ in queries]
+        conn = self._require_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT q.idx, k.chunk_id, k.document_id, k.chunk_index, k.content, k.file_name
+                    FROM unnest(%s::text[]) WITH ORDINALITY AS q(pattern, idx)
+                    CROSS JOIN LATERAL (
+                        SELECT c.chunk_id, c.document_id, c.chunk_index, c.content, d.file_name
+                        FROM chunks c
+                        JOIN documents d ON c.document_id = d.id
+                        WHERE c.workspace = %s AND c.content ILIKE q.pattern
+                        LIMIT %s
+                    ) k
+                """, ([f"%{q}%" for q in queries], workspace, limit))
+                for row in cur.fetchall():
+                    results[row['idx'] - 1].append({
+                        "id": row['chunk_id'],
+                        "document_id": row['document_id'],
+                        "chunk_index": row['chunk_index'],
+                        "content": row['content'],
+                        "file_name": row['file_name'],
+                        "score": 0.5,
+                        "source": "Keyword"
+                    })
+                return results
+        finally:
+            self._safe_put_connection(conn)
+            if timings is not None:
+                timings["keyword"] = time.perf_counter() - started
+
+    def invalidate_workspace(self, *workspaces):
+        """Tăng thế hệ của workspace -> các kết quả cache cũ không còn được dùng"""
+        with self._generation_lock:
+            for ws in workspaces:
+                if ws:
+                    self.workspace_generations[ws] = self.workspace_generations.get(ws, 0) + 1
+
+    def workspace_cache_scope(self, workspace):
+        """
+        Phạm vi cho cache bền (vd. cache câu trả lời LLM trong SQLite): dựng từ chính bảng documents
+        (số tài liệu + hash id/trạng thái/số chunk) nên khác đi khi tài liệu đổi, kể cả sau khi khởi động lại
+        hoặc do tiến trình khác ghi. Thế hệ trong RAM chỉ dùng để khỏi query lại mỗi lượt.
+        Trả về None nếu không đọc được (khi đó không nên dùng cache).
+        """
+        with self._generation_lock:
+            key = (workspace, self.workspace_generations.get(workspace, 0))
+        scope = self.workspace_scope_cache.get(key)
+        if scope is not None:
+            return scope
         conn = self._safe_get_connection()
+        if not conn: return None
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT COUNT(*) AS n,
+                           md5(COALESCE(string_agg(id || ':' || COALESCE(status, '') || ':' || COALESCE(chunks_created, 0),
+                                                   ',' ORDER BY id), '')) AS digest
+                    FROM documents WHERE workspace = %s
+                """, (workspace,))
+                row = cur.fetchone()
+            scope = f"{workspace}:{row['n']}:{row['digest']}"
+        except Exception as e:
+            print(f"⚠️ Lỗi đọc phạm vi cache workspace: {e}")
+            return None
+        finally:
+            self._safe_put_connection(conn)
+        self.workspace_scope_cache.set(key, scope)
+        return scope
+
+    def _cache_key(self, query, workspace, top_k):
+        # Đọc thế hệ TRƯỚC khi tìm: nếu có ghi xen giữa, khoá này sẽ không bao giờ được phục vụ lại
+        with self._generation_lock:
+            generation = self.workspace_generations.get(workspace, 0)
+        return (normalize_query(query), workspace, top_k, generation)
+
+    def rag_search(self, query, workspace, top_k=5, use_cache=True, timings=None, neighbor_window=None):
+        """
+        timings: dict tuỳ chọn, được điền thời gian từng bước (embed/vector/keyword/rerank/total)
+        neighbor_window: số chunk liền kề mỗi phía ghép thêm vào kết quả (mặc định self.neighbor_window)
+        """
+        started = time.perf_counter()
+        window = self.neighbor_window if neighbor_window is None else neighbor_window
+        key = self._cache_key(query, workspace, top_k)
+        cached = self.result_cache.get(key) if use_cache else None
+        if cached is not None:
+            print(f"⚡ Cache hit: '{query}'")
+            results, extra = [dict(item) for item in cached], []
+        else:
+            results, extra, complete = self._rag_search_uncached(query, workspace, top_k, timings)
+            # Không cache kết quả "tạm" (re-rank bị cắt do hết ngân sách)
+            if results and complete and use_cache:
+                self.result_cache.set(key, [dict(item) for item in results])
+        if window > 0 and results:
+            results = self.expand_neighbors(results, window)
+        if timings is not None: timings["total"] = time.perf_counter() - started
+        return results, extra
+
+    def expand_neighbors(self, results, window=1, token_budget=None):
+        """
+        Ghép ±window chunk liền kề (cùng document_id) vào mỗi kết quả bằng 1 query,
+        gộp các cửa sổ chồng nhau, dừng khi vượt ngân sách token.
+        """
+        token_budget = token_budget or self.neighbor_token_budget
+        groups = []
+        for item in results:
+            doc_id, idx = item.get('document_id'), item.get('chunk_index')
+            if doc_id is None or idx is None:
+                groups.append({"item": item, "doc": None})
+                continue
+            lo, hi = idx - window, idx + window
+            for g in groups:
+                if g["doc"] == doc_id and lo <= g["end"] + 1 and hi >= g["start"] - 1:
+                    g["start"], g["end"] = min(g["start"], lo), max(g["end"], hi)
+                    g["ids"].append(item['id'])
+                    break
+            else:
+                groups.append({"item": item, "doc": doc_id, "start": lo, "end": hi, "ids": [item['id']]})
+
+        keys = [(g["doc"], i) for g in groups if g["doc"] for i in range(max(g["start"], 0), g["end"] + 1)]
+        neighbors = {}
+        conn = self._safe_get_connection() if keys else None
         if conn:
             try:
                 with conn.cursor() as cur:
                     cur.execute("""
-                        SELECT c.chunk_id, c.content, d.file_name 
-                        FROM chunks c
-                        JOIN documents d ON c.document_id = d.id
-                        WHERE c.workspace = %s AND c.content ILIKE %s
-                        LIMIT %s
-                    """, (workspace, f"%{query}%", top_k * 2))
-                    rows = cur.fetchall()
-                    for row in rows:
-                        if row['chunk_id'] not in candidates:
-                            candidates[row['chunk_id']] = {
-                                "id": row['chunk_id'],
-                                "content": row['content'],
-                                "file_name": row['file_name'],
-                                "score": 0.5,
-                                "source": "Keyword"
-                            }
+                        SELECT c.document_id, c.chunk_index, c.content
+                        FROM unnest(%s::text[], %s::int[]) AS w(document_id, chunk_index)
+                        JOIN chunks c ON c.document_id = w.document_id AND c.chunk_index = w.chunk_index
+                    """, ([k[0] for k in keys], [k[1] for k in keys]))
+                    neighbors = {(row['document_id'], row['chunk_index']): row['content'] for row in cur.fetchall()}
             except Exception as e:
-                print(f"⚠️ Lỗi Keyword search: {e}")
+                print(f"⚠️ Lỗi lấy chunk liền kề: {e}")
             finally:
                 self._safe_put_connection(conn)
 
+        expanded, used = [], 0
+        for g in groups:
+            item = dict(g["item"])
+            original = item.get('content') or ""
+            if g["doc"]:
+                indexes = [i for i in range(max(g["start"], 0), g["end"] + 1) if (g["doc"], i) in neighbors]
+                if indexes:
+                    item['content'] = "".join(neighbors[(g["doc"], i)] for i in indexes)
+                    item['chunk_range'] = (indexes[0], indexes[-1])
+                    item['merged_ids'] = g["ids"]
+                    # Vị trí chunk trúng tìm kiếm trong đoạn đã ghép -> PromptBuilder cắt quanh nó, không cắt từ đầu
+                    hit = item.get('chunk_index')
+                    if (g["doc"], hit) in neighbors:
+                        offset = sum(len(neighbors[(g["doc"], i)]) for i in indexes if i < hit)
+                        item['hit_span'] = (offset, offset + len(neighbors[(g["doc"], hit)]))
+            tokens = count_tokens(item['content'])
+            if used + tokens > token_budget:
+                # Không đủ chỗ cho bản mở rộng -> giữ đoạn gốc nếu còn vừa
+                item = dict(g["item"])
+                tokens = count_tokens(original)
+                if used + tokens > token_budget: break
+            expanded.append(item)
+            used += tokens
+        return expanded
+
+    def rag_search_many(self, queries, workspace, top_k=5, use_cache=True):
+        """Tìm nhiều câu hỏi 1 lượt: embed 1 lần, 1 lượt search vector, 1 query keyword, rerank từng câu.
+        Trả về list kết quả theo đúng thứ tự `queries`."""
+        keys = [self._cache_key(q, workspace, top_k) for q in queries]
+        results = [None] * len(queries)
+        if use_cache:
+            for i, key in enumerate(keys):
+                cached = self.result_cache.get(key)
+                if cached is not None:
+                    results[i] = [dict(item) for item in cached]
+        pending = [i for i, r in enumerate(results) if r is None]
+        if not pending: return results
+
+        # Câu hỏi nêu mã tài liệu -> tìm riêng trong tài liệu đó (như rag_search), phần còn lại tìm theo lô
+        batch = []
+        for i in pending:
+            document_ids = self._documents_for_codes(queries[i], workspace)
+            if document_ids is None:
+                batch.append(i)
+                continue
+            found, _, complete = self._search_documents(queries[i], workspace, top_k, document_ids)
+            if found and complete and use_cache:
+                self.result_cache.set(keys[i], [dict(item) for item in found])
+            results[i] = found
+        pending = batch
+        if not pending: return results
+
+        print(f"🔍 Đang tìm kiếm {len(pending)} câu hỏi (batch)...")
+        pending_queries = [queries[i] for i in pending]
+        leg_rows, legs_complete = self._collect_legs({
+            "Vector": self.search_executor.submit(self._vector_search_many, pending_queries, workspace, top_k * 2),
+            "Keyword": self.search_executor.submit(self._keyword_search_many, pending_queries, workspace, top_k * 2),
+        })
+        empty = [[] for _ in pending]
+        for j, i in enumerate(pending):
+            found, _, complete = self._fuse_and_rerank(
+                queries[i], [leg_rows.get("Vector", empty)[j], leg_rows.get("Keyword", empty)[j]], top_k,
+                legs_complete=legs_complete)
+            if found and complete and use_cache:
+                self.result_cache.set(keys[i], [dict(item) for item in found])
+            results[i] = found
+        return results
+
+    def _collect_legs(self, legs):
+        """Chờ các nhánh đã submit, mỗi nhánh có deadline riêng tính từ lúc bắt đầu.
+        Trả về (kết quả theo nhánh, đủ_mọi_nhánh): thiếu nhánh nào (quá hạn/lỗi) thì kết quả không được cache"""
+        start = time.time()
+        collected = {}
+        for name, future in legs.items():
+            remaining = max(0.0, start + self.leg_timeouts.get(name, 5.0) - time.time())
+            try:
+                collected[name] = future.result(timeout=remaining)
+            except FuturesTimeout:
+                print(f"⏱️ Nhánh {name} quá hạn {self.leg_timeouts.get(name)}s, bỏ qua")
+            except Exception as e:
+                print(f"⚠️ Lỗi {name} search: {e}")
+        return collected, len(collected) == len(legs)
+
+    def _rag_search_uncached(self, query, workspace, top_k, timings=None):
+        print(f"🔍 Đang tìm kiếm: '{query}'...")
+
+        # Câu hỏi nêu đích danh mã tài liệu -> chỉ tìm trong tài liệu đó
+        document_ids = self._documents_for_codes(query, workspace)
+        return self._search_documents(query, workspace, top_k, document_ids, timings)
+
+    def _search_documents(self, query, workspace, top_k, document_ids, timings=None):
+        """2 nhánh + re-rank; document_ids: chỉ tìm trong các tài liệu này (None = cả workspace)"""
+        # Chạy 2 nhánh đồng thời -> độ trễ = max(nhánh) thay vì tổng
+        leg_rows, legs_complete = self._collect_legs({
+            "Vector": self.search_executor.submit(self._vector_search, query, workspace, top_k * 2, timings, document_ids),
+            "Keyword": self.search_executor.submit(self._keyword_search, query, workspace, top_k * 2, timings, document_ids),
+        })
+        return self._fuse_and_rerank(query, [leg_rows.get("Vector", []), leg_rows.get("Keyword", [])], top_k, timings,
+                                     legs_complete=legs_complete)
+
+    def _fuse_and_rerank(self, query, leg_results, top_k, timings=None, legs_complete=True):
+        """Gộp kết quả các nhánh (theo thứ tự ưu tiên, bỏ trùng) rồi re-rank.
+        legs_complete=False (có nhánh quá hạn/lỗi) -> kết quả luôn bị đánh dấu chưa đầy đủ"""
+        candidates = {}
+        for rows in leg_results:
+            for item in rows:
+                if item["id"] not in candidates:
+                    candidates[item["id"]] = item
+
         candidate_list = list(candidates.values())
-        if not candidate_list: return [], []
+        if not candidate_list: return [], [], legs_complete
 
         if HAS_RERANKER and self.reranker:
+            rerank_started = time.perf_counter()
             try:
-                passages = [{"id": item["id"], "text": item["content"], "meta": item} for item in candidate_list]
-                rerank_request = RerankRequest(query=query, passages=passages)
-                results = self.reranker.rank(rerank_request)
-                final_results = []
-                for res in results[:top_k]:
-                    meta = res['meta']
-                    meta['similarity_score'] = res['score']
-                    final_results.append(meta)
-                return final_results, []
+                # Cần cả danh sách đã xếp hạng để MMR có chỗ chọn
+                limit = len(candidate_list) if self.diversify else top_k
+                ranked, complete = self._rerank(query, candidate_list, limit)
+                return self._select_context(ranked, top_k), [], complete and legs_complete
             except Exception as e:
                 print(f"⚠️ Lỗi Re-ranking: {e}")
+            finally:
+                if timings is not None: timings["rerank"] = time.perf_counter() - rerank_started
         
-        return candidate_list[:top_k], []
+        return self._select_context(candidate_list, top_k), [], legs_complete
+
+    def _select_context(self, ranked, top_k):
+        if not self.diversify:
+            return ranked[:top_k]
+        return select_diverse(ranked, top_k, self.mmr_lambda, self.dup_threshold)
+
+    def _score_passages(self, query, query_hash, items):
+        """Chạy cross-encoder cho các passage chưa có điểm, ghi vào cache"""
+        passages = [{"id": item["id"], "text": truncate_tokens(item["content"], self.rerank_max_tokens)} for item in items]
+        results = self.reranker.rank(RerankRequest(query=query, passages=passages))
+        scores = {}
+        for res in results:
+            scores[res['id']] = float(res['score'])
+            self.rerank_score_cache.set((query_hash, res['id']), scores[res['id']])
+        return scores
+
+    def _rerank(self, query, candidate_list, top_k):
+        """Re-rank trong ngân sách thời gian. Trả về (kết quả, đã_rerank_đầy_đủ)"""
+        pool = candidate_list[:self.rerank_max_candidates]
+        query_hash = hashlib.sha1(normalize_query(query).encode('utf-8')).hexdigest()
+
+        scores, pending = {}, []
+        for item in pool:
+            score = self.rerank_score_cache.get((query_hash, item["id"]))
+            if score is None: pending.append(item)
+            else: scores[item["id"]] = score
+
+        if pending:
+            started = time.perf_counter()
+            if not self._rerank_slot.acquire(timeout=self.rerank_budget):
+                self.rerank_skipped += 1
+                print(f"⏭️ Re-rank bận quá {self.rerank_budget}s, dùng thứ tự trước re-rank")
+                return candidate_list[:top_k], False
+            try:
+                future = self.rerank_executor.submit(self._score_passages, query, query_hash, pending)
+            except Exception:
+                self._rerank_slot.release()
+                raise
+            future.add_done_callback(lambda _: self._rerank_slot.release())
+            try:
+                # Thời gian chờ slot tính vào ngân sách
+                scores.update(future.result(timeout=max(self.rerank_budget - (time.perf_counter() - started), 0)))
+            except FuturesTimeout:
+                # Chưa chạy thì huỷ; đang chạy thì để chạy nốt (điền cache cho lần hỏi sau), giữ slot tới khi xong
+                future.cancel()
+                print(f"⏱️ Re-rank vượt ngân sách {self.rerank_budget}s, dùng thứ tự trước re-rank")
+                return candidate_list[:top_k], False
+
+        ranked = sorted(pool, key=lambda item: scores[item["id"]], reverse=True)
+        final_results = []
+        for item in ranked[:top_k]:
+            item['similarity_score'] = scores[item["id"]]
+            final_results.append(item)
+        return final_results, True
 
     def _get_filename(self, doc_id):
         conn = self._safe_get_connection()
@@ -373,10 +1104,35 @@ class DatabaseManager:
         finally:
             self._safe_put_connection(conn)
 
+    def _get_document_info(self, doc_ids):
+        """Tra tên file + workspace cho nhiều document_id trong 1 query"""
+        doc_ids = list({d for d in doc_ids if d})
+        if not doc_ids: return {}
+        conn = self._require_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT id, file_name, workspace FROM documents WHERE id = ANY(%s)", (doc_ids,))
+                return {row['id']: dict(row) for row in cur.fetchall()}
+        finally:
+            self._safe_put_connection(conn)
+
     def health_check(self):
         conn = self._safe_get_connection()
         pg_ok = conn is not None
         if conn: self._safe_put_connection(conn)
-        return {"postgres": pg_ok, "milvus": self.milvus_collection is not None}
+        return {
+            "postgres": pg_ok,
+            "milvus": self.milvus_collection is not None,
+            "local_vector_store": self.local_vector_store.count() if self.local_vector_store else None,
+            "keyword_backend": self.keyword_backend if self.keyword_index else "postgres",
+            "elasticsearch": self.keyword_index.ping() if self.keyword_index else False,
+            "milvus_maintenance": self.milvus_maintenance.stats(),
+            "milvus_index_rebuilding": bool(self._index_rebuild and self._index_rebuild.is_alive()),
+            "last_reconcile": self.last_reconcile,
+            "query_embedding_cache": self.query_embedding_cache.stats(),
+            "result_cache": self.result_cache.stats(),
+            "rerank_score_cache": self.rerank_score_cache.stats(),
+            "rerank_skipped": self.rerank_skipped,
+        }
 
 db_manager = DatabaseManager()
\ No newline at end of file
@@ -138,6 +138,8 @@ class DocumentProcessor:
                     "id": doc_id, "file_name": file_name, "file_size": file_size,
                     "project_name": project_name, "workspace": workspace, "status": "processing"
                 })
+                # Mã tài liệu nằm ở tên file / trang bìa -> không quét cả văn bản (tránh mã được trích dẫn)
+                self.db_manager.save_document_codes(doc_id, workspace, f"{file_name}\n{text_content[:3000]}")
                 
                 chunks = self.split_text_into_chunks(text_content)
                 saved = 0
@@ -148,6 +150,8 @@ class DocumentProcessor:
                         'workspace': workspace, 'project_name': project_name
                     }
                     if self.db_manager.save_chunk_record(data): saved += 1
+                self.db_manager.flush_keyword_index()
+                self.db_manager.maybe_tune_milvus_index()
                 
                 self.db_manager.update_document_status(doc_id, "completed", f"Đã lưu {saved} đoạn")
                 
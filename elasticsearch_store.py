@@ -0,0 +1,245 @@
+# elasticsearch_store.py - Nhánh tìm Keyword bằng BM25 (Elasticsearch hoặc bản giả lập trong RAM)
+"""
+Index được nạp từ bảng chunks của PostgreSQL:
+  - tự động khi khởi động nếu index đang rỗng (lần đầu bật KEYWORD_BACKEND, hoặc backend 'memory' sau restart)
+  - thủ công: python reconciler.py --reindex-keywords
+"""
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+try:
+    from elasticsearch import Elasticsearch, helpers
+    HAS_ELASTICSEARCH = True
+except ImportError:
+    HAS_ELASTICSEARCH = False
+
+
+def _analysis(icu: bool) -> Dict[str, Any]:
+    """Analyzer tiếng Việt: 'content' giữ dấu, 'content.folded' bỏ dấu (gõ không dấu vẫn tìm được)"""
+    if icu:
+        # Cần plugin analysis-icu (xem docker-compose.yml)
+        return {"analyzer": {
+            "vi_text": {"type": "custom", "tokenizer": "icu_tokenizer", "filter": ["icu_normalizer", "lowercase"]},
+            "vi_folded": {"type": "custom", "tokenizer": "icu_tokenizer", "filter": ["icu_folding"]},
+        }}
+    return {"analyzer": {
+        "vi_text": {"type": "custom", "tokenizer": "standard", "filter": ["lowercase"]},
+        "vi_folded": {"type": "custom", "tokenizer": "standard", "filter": ["lowercase", "asciifolding"]},
+    }}
+
+
+INDEX_MAPPINGS = {
+    "properties": {
+        "chunk_id": {"type": "keyword"},
+        "document_id": {"type": "keyword"},
+        "workspace": {"type": "keyword"},
+        "chunk_index": {"type": "integer"},
+        "content": {"type": "text", "analyzer": "vi_text",
+                    "fields": {"folded": {"type": "text", "analyzer": "vi_folded"}}},
+    }
+}
+
+
+class ElasticKeywordIndex:
+    """BM25 trên Elasticsearch 7.x: bulk index theo lô, xoá theo document_id"""
+
+    def __init__(self, url: str = "http://localhost:9200", index_name: str = "chunks_vn", batch_size: int = 500):
+        self.url = url
+        self.index_name = index_name
+        self.batch_size = batch_size
+        self.client = None
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def connect(self) -> bool:
+        if not HAS_ELASTICSEARCH:
+            print("❌ Thiếu elasticsearch. Chạy: pip install 'elasticsearch>=7.17,<8'")
+            return False
+        self.client = Elasticsearch(self.url)
+        if not self.client.ping():
+            print(f"❌ Không kết nối được Elasticsearch: {self.url}")
+            return False
+        if not self.client.indices.exists(index=self.index_name):
+            try:
+                self.client.indices.create(index=self.index_name, body={
+                    "settings": {"analysis": _analysis(icu=True)}, "mappings": INDEX_MAPPINGS})
+            except Exception as e:
+                print(f"⚠️ Không dùng được analyzer ICU ({e}), chuyển sang standard + asciifolding")
+                self.client.indices.create(index=self.index_name, body={
+                    "settings": {"analysis": _analysis(icu=False)}, "mappings": INDEX_MAPPINGS})
+        return True
+
+    def ping(self) -> bool:
+        try:
+            return bool(self.client and self.client.ping())
+        except Exception:
+            return False
+
+    def count(self) -> int:
+        return self.client.count(index=self.index_name)["count"]
+
+    def add(self, chunk: Dict[str, Any]) -> List[str]:
+        """Đưa chunk vào hàng đợi; tự flush khi đủ batch. Trả về các workspace vừa được flush"""
+        with self._lock:
+            self._buffer.append(chunk)
+            if len(self._buffer) < self.batch_size:
+                return []
+        return self.flush()
+
+    def flush(self) -> List[str]:
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return []
+        actions = [{
+            "_index": self.index_name, "_id": c["chunk_id"],
+            "_source": {k: c[k] for k in ("chunk_id", "document_id", "workspace", "chunk_index", "content")},
+        } for c in batch]
+        helpers.bulk(self.client, actions, refresh="wait_for")
+        return sorted({c["workspace"] for c in batch})
+
+    def delete_documents(self, document_ids: Iterable[str]) -> int:
+        res = self.client.delete_by_query(index=self.index_name, conflicts="proceed", refresh=True,
+                                          body={"query": {"terms": {"document_id": list(document_ids)}}})
+        return res.get("deleted", 0)
+
+    def delete_ids(self, ids: Iterable[str]) -> int:
+        res = self.client.delete_by_query(index=self.index_name, conflicts="proceed", refresh=True,
+                                          body={"query": {"ids": {"values": list(ids)}}})
+        return res.get("deleted", 0)
+
+    def move_document(self, document_id: str, workspace: str):
+        self.client.update_by_query(index=self.index_name, conflicts="proceed", refresh=True, body={
+            "query": {"term": {"document_id": document_id}},
+            "script": {"source": "ctx._source.workspace = params.ws", "params": {"ws": workspace}},
+        })
+
+    def _query(self, query: str, workspace: str, limit: int, document_ids=None) -> Dict[str, Any]:
+        filters = [{"term": {"workspace": workspace}}]
+        if document_ids is not None:
+            filters.append({"terms": {"document_id": list(document_ids)}})
+        return {
+            "size": limit,
+            "query": {"bool": {
+                "must": {"multi_match": {"query": query, "fields": ["content^2", "content.folded"],
+                                         "type": "most_fields"}},
+                "filter": filters,
+            }},
+        }
+
+    def _hits(self, response) -> List[Dict[str, Any]]:
+        return [{
+            "id": hit["_id"],
+            "document_id": hit["_source"]["document_id"],
+            "chunk_index": hit["_source"]["chunk_index"],
+            "content": hit["_source"]["content"],
+            "score": hit["_score"],
+        } for hit in response["hits"]["hits"]]
+
+    def search(self, query: str, workspace: str, limit: int, document_ids=None) -> List[Dict[str, Any]]:
+        return self._hits(self.client.search(index=self.index_name,
+                                             body=self._query(query, workspace, limit, document_ids)))
+
+    def search_many(self, queries: List[str], workspace: str, limit: int) -> List[List[Dict[str, Any]]]:
+        body = []
+        for q in queries:
+            body += [{"index": self.index_name}, self._query(q, workspace, limit)]
+        responses = self.client.msearch(body=body)["responses"]
+        return [self._hits(r) if "hits" in r else [] for r in responses]
+
+
+def _fold(text: str) -> List[str]:
+    """Tách từ + bỏ dấu tiếng Việt (tương đương content.folded)"""
+    text = unicodedata.normalize("NFD", (text or "").lower().replace("đ", "d"))
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return re.findall(r"\w+", text)
+
+
+class InMemoryKeywordIndex:
+    """Bản giả lập BM25 trong RAM, cùng interface với ElasticKeywordIndex (dùng cho test/benchmark)"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = {}
+        self.postings = {}
+        self._lock = threading.Lock()
+
+    def connect(self) -> bool:
+        return True
+
+    def ping(self) -> bool:
+        return True
+
+    def count(self) -> int:
+        return len(self.docs)
+
+    def add(self, chunk: Dict[str, Any]) -> List[str]:
+        tokens = _fold(chunk["content"])
+        with self._lock:
+            self._remove(chunk["chunk_id"])
+            self.docs[chunk["chunk_id"]] = dict(chunk, tf=Counter(tokens), length=len(tokens))
+            for term in set(tokens):
+                self.postings.setdefault(term, set()).add(chunk["chunk_id"])
+        return []
+
+    def flush(self) -> List[str]:
+        return []
+
+    def _remove(self, chunk_id: str):
+        doc = self.docs.pop(chunk_id, None)
+        if doc:
+            for term in doc["tf"]:
+                self.postings.get(term, set()).discard(chunk_id)
+
+    def delete_ids(self, ids: Iterable[str]) -> int:
+        with self._lock:
+            ids = [i for i in ids if i in self.docs]
+            for chunk_id in ids:
+                self._remove(chunk_id)
+            return len(ids)
+
+    def delete_documents(self, document_ids: Iterable[str]) -> int:
+        document_ids = set(document_ids)
+        return self.delete_ids([cid for cid, d in list(self.docs.items()) if d["document_id"] in document_ids])
+
+    def move_document(self, document_id: str, workspace: str):
+        with self._lock:
+            for doc in self.docs.values():
+                if doc["document_id"] == document_id:
+                    doc["workspace"] = workspace
+
+    def search(self, query: str, workspace: str, limit: int, document_ids=None) -> List[Dict[str, Any]]:
+        with self._lock:
+            pool = [d for d in self.docs.values() if d["workspace"] == workspace]
+            if not pool:
+                return []
+            avg_len = sum(d["length"] for d in pool) / len(pool)
+            allowed = set(document_ids) if document_ids is not None else None
+            scores = Counter()
+            for term in set(_fold(query)):
+                matches = [self.docs[cid] for cid in self.postings.get(term, ())
+                           if self.docs[cid]["workspace"] == workspace]
+                if not matches:
+                    continue
+                idf = math.log(1 + (len(pool) - len(matches) + 0.5) / (len(matches) + 0.5))
+                for d in matches:
+                    if allowed is not None and d["document_id"] not in allowed:
+                        continue
+                    tf = d["tf"][term]
+                    scores[d["chunk_id"]] += idf * tf * (self.k1 + 1) / (
+                        tf + self.k1 * (1 - self.b + self.b * d["length"] / max(avg_len, 1)))
+            return [{
+                "id": cid,
+                "document_id": self.docs[cid]["document_id"],
+                "chunk_index": self.docs[cid]["chunk_index"],
+                "content": self.docs[cid]["content"],
+                "score": score,
+            } for cid, score in scores.most_common(limit)]
+
+    def search_many(self, queries: List[str], workspace: str, limit: int) -> List[List[Dict[str, Any]]]:
+        return [self.search(q, workspace, limit) for q in queries]
@@ -0,0 +1,196 @@
+# embedding_snapshot.py - Xuất / khôi phục toàn bộ embedding Milvus (không cần chạy lại model)
+"""
+Snapshot = thư mục gồm các shard:
+    shard_00000.npy     vector (float32 hoặc float16)
+    shard_00000.jsonl   id, document_id, chunk_index, content (cùng thứ tự với vector)
+    manifest.json       collection, dim, model, index, số dòng + sha256 từng shard
+
+    python embedding_snapshot.py export --out snapshots/20260101
+    python embedding_snapshot.py restore --src snapshots/20260101 --collection document_embeddings_vn_v1 --drop
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+
+try:
+    from pymilvus import connections, Collection, utility
+except ImportError:
+    print("❌ Thiếu pymilvus")
+
+from milvus_index import MilvusIndexManager, collection_schema
+
+FORMAT_VERSION = 1
+META_FIELDS = ["id", "document_id", "chunk_index", "content"]
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _iter_rows(collection, batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    iterator = collection.query_iterator(batch_size=batch_size, expr="chunk_index >= 0",
+                                         output_fields=META_FIELDS[1:] + ["embedding"])
+    try:
+        while True:
+            rows = iterator.next()
+            if not rows:
+                return
+            yield rows
+    finally:
+        iterator.close()
+
+
+def _embedding_dim(collection) -> int:
+    """dim lấy từ schema (không phụ thuộc collection có dữ liệu hay không)"""
+    for field in collection.schema.fields:
+        if field.name == "embedding":
+            return int(field.params["dim"])
+    raise ValueError(f"Collection '{collection.name}' không có trường embedding")
+
+
+def export_snapshot(collection, out_dir: str, shard_size: int = 50000, batch_size: int = 2000,
+                    dtype: str = "float32", model: str = "keepitreal/vietnamese-sbert") -> Dict[str, Any]:
+    """Đọc collection theo lô và ghi ra shard; ghi vào thư mục tạm rồi đổi tên khi xong"""
+    # Chỉ ghi đè thư mục snapshot cũ, không xoá nhầm thư mục khác do gõ sai --out
+    if os.path.isdir(out_dir) and os.listdir(out_dir) and not os.path.exists(os.path.join(out_dir, "manifest.json")):
+        raise ValueError(f"'{out_dir}' không phải snapshot (thiếu manifest.json), không ghi đè")
+    dim = _embedding_dim(collection)
+    tmp_dir = out_dir.rstrip("/") + ".partial"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    started = time.time()
+    shards, vectors, meta = [], [], []
+
+    def write_shard():
+        name = f"shard_{len(shards):05d}"
+        matrix = np.asarray(vectors, dtype=dtype)
+        np.save(os.path.join(tmp_dir, name + ".npy"), matrix)
+        with open(os.path.join(tmp_dir, name + ".jsonl"), "w", encoding="utf-8") as f:
+            for row in meta:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        shards.append({"vectors": name + ".npy", "rows": name + ".jsonl", "count": len(meta),
+                       "sha256": {ext: _sha256(os.path.join(tmp_dir, name + ext)) for ext in (".npy", ".jsonl")}})
+        vectors.clear()
+        meta.clear()
+
+    for rows in _iter_rows(collection, batch_size):
+        for row in rows:
+            vectors.append(row["embedding"])
+            meta.append({k: row[k] for k in META_FIELDS})
+            if len(meta) >= shard_size:
+                write_shard()
+    if meta:
+        write_shard()
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "collection": collection.name,
+        "dim": dim,
+        "dtype": dtype,
+        "model": model,
+        "count": sum(s["count"] for s in shards),
+        "index": MilvusIndexManager().current_index(collection),
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "shards": shards,
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    print(f"💾 Đã xuất {manifest['count']} vectors ({len(shards)} shard) -> {out_dir} "
+          f"trong {time.time() - started:.1f}s")
+    return manifest
+
+
+def restore_snapshot(src_dir: str, collection_name: str, drop: bool = False, batch_size: int = 5000,
+                     verify: bool = True):
+    """Nạp snapshot vào collection mới: insert hàng loạt trước, build index sau cùng"""
+    with open(os.path.join(src_dir, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT_VERSION:
+        raise ValueError(f"Không hỗ trợ snapshot format {manifest.get('format')}")
+    if not manifest.get("dim"):
+        raise ValueError("Manifest thiếu dim (snapshot xuất từ collection rỗng bằng bản cũ)")
+
+    if utility.has_collection(collection_name):
+        if not drop:
+            raise ValueError(f"Collection '{collection_name}' đã tồn tại (dùng --drop để ghi đè)")
+        utility.drop_collection(collection_name)
+    collection = Collection(collection_name, collection_schema(manifest["dim"]))
+    print(f"📦 Khôi phục {manifest['count']} vectors (model {manifest['model']}, dim {manifest['dim']})")
+
+    started = time.time()
+    restored = 0
+    for shard in manifest["shards"]:
+        vectors_path = os.path.join(src_dir, shard["vectors"])
+        rows_path = os.path.join(src_dir, shard["rows"])
+        if verify:
+            for ext, path in ((".npy", vectors_path), (".jsonl", rows_path)):
+                if _sha256(path) != shard["sha256"][ext]:
+                    raise ValueError(f"Sai checksum: {path}")
+        matrix = np.load(vectors_path, mmap_mode="r")
+        with open(rows_path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        if len(rows) != len(matrix) or len(rows) != shard["count"]:
+            raise ValueError(f"Shard {shard['vectors']} lệch số dòng")
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            collection.insert([
+                [r["id"] for r in batch], [r["document_id"] for r in batch],
+                [r["chunk_index"] for r in batch],
+                np.asarray(matrix[start:start + batch_size], dtype=np.float32).tolist(),
+                [r["content"] for r in batch],
+            ])
+        restored += len(rows)
+        print(f"   ↳ {shard['vectors']}: {restored}/{manifest['count']}")
+
+    collection.flush()
+    manager = MilvusIndexManager()
+    index = manager.choose_index(collection.num_entities)
+    collection.create_index("embedding", index)
+    collection.load()
+    print(f"✅ Đã khôi phục {restored} vectors vào '{collection_name}' ({index['index_type']}) "
+          f"trong {time.time() - started:.1f}s")
+    return collection
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xuất / khôi phục snapshot embedding Milvus")
+    parser.add_argument("command", choices=["export", "restore"])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="19530")
+    parser.add_argument("--collection", default="document_embeddings_vn_v1")
+    parser.add_argument("--out", help="Thư mục snapshot (export)")
+    parser.add_argument("--src", help="Thư mục snapshot (restore)")
+    parser.add_argument("--shard-size", type=int, default=50000)
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32",
+                        help="float16: snapshot nhỏ bằng nửa, sai số không đáng kể với COSINE")
+    parser.add_argument("--model", default="keepitreal/vietnamese-sbert", help="Model đã tạo embedding (ghi vào manifest)")
+    parser.add_argument("--drop", action="store_true", help="Xoá collection cũ trước khi khôi phục")
+    parser.add_argument("--no-verify", action="store_true", help="Bỏ qua kiểm tra sha256")
+    args = parser.parse_args()
+
+    connections.connect("default", host=args.host, port=args.port)
+    if args.command == "export":
+        collection = Collection(args.collection)
+        collection.load()
+        export_snapshot(collection, args.out or f"snapshots/{time.strftime('%Y%m%d_%H%M%S')}",
+                        shard_size=args.shard_size, dtype=args.dtype, model=args.model)
+    else:
+        if not args.src:
+            parser.error("restore cần --src")
+        restore_snapshot(args.src, args.collection, drop=args.drop, verify=not args.no_verify)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# image_pipeline.py - Chuẩn bị ảnh cho model vision: thu nhỏ + nén lại + hash (bỏ qua xử lý lặp lại)
+import base64
+import hashlib
+import io
+from typing import Any, Dict
+
+try:
+    from PIL import Image, ImageOps
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+    print("⚠️ Pillow not available. Install: pip install Pillow")
+
+from retrieval_cache import LRUCache
+
+
+class ImagePipeline:
+    """
+    llama3.2-vision chỉ xử lý ảnh tối đa ~1120px mỗi cạnh, gửi ảnh gốc vài MB chỉ tốn băng thông
+    và thời gian encode. Ảnh được thu nhỏ về max_side, nén JPEG, kết quả cache theo hash ảnh gốc.
+    """
+
+    def __init__(self, max_side: int = 1120, quality: int = 85, cache_size: int = 64):
+        self.max_side = max_side
+        self.quality = quality
+        self.cache = LRUCache(max_size=cache_size)
+
+    def prepare(self, raw: bytes) -> Dict[str, Any]:
+        """
+        Trả về {"b64", "sha256", "width", "height", "bytes_in", "bytes_out"}.
+        sha256 là hash ảnh đã xử lý: cùng ảnh -> cùng hash -> dùng lại câu trả lời đã cache
+        """
+        raw_hash = hashlib.sha256(raw).hexdigest()
+        cached = self.cache.get(raw_hash)
+        if cached:
+            return cached
+
+        data, width, height = raw, None, None
+        if HAS_PIL:
+            try:
+                img = ImageOps.exif_transpose(Image.open(io.BytesIO(raw)))
+                if img.mode not in ("RGB", "L"):
+                    # Ảnh có nền trong suốt (PNG bản vẽ) -> nền trắng thay vì đen
+                    background = Image.new("RGB", img.size, "white")
+                    background.paste(img, mask=img.convert("RGBA").split()[-1])
+                    img = background
+                img.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+                buf = io.BytesIO()
+                img.save(buf, format="JPEG", quality=self.quality, optimize=True)
+                # Ảnh gốc đã nhỏ hơn bản nén lại -> giữ nguyên
+                if buf.tell() < len(raw):
+                    data = buf.getvalue()
+                    width, height = img.size
+            except Exception as e:
+                print(f"⚠️ Không xử lý được ảnh, gửi ảnh gốc: {e}")
+
+        result = {
+            "b64": base64.b64encode(data).decode("utf-8"),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "width": width,
+            "height": height,
+            "bytes_in": len(raw),
+            "bytes_out": len(data),
+        }
+        self.cache.set(raw_hash, result)
+        return result
+
+
+# Khởi tạo instance global
+image_pipeline = ImagePipeline()
@@ -0,0 +1,128 @@
+# llm_cache.py - Cache câu trả lời LLM (SQLite, còn sau khi khởi động lại)
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+def cache_key(provider: str, model: str, messages, options: Dict[str, Any], scope: Optional[str] = None) -> str:
+    """
+    Hash của (provider, model, messages, options, scope); ảnh được thay bằng hash của ảnh.
+    scope: vd "<workspace>:<thế hệ>" -> tài liệu trong workspace thay đổi thì khoá cũ không còn khớp
+    """
+    payload = {
+        "provider": provider,
+        "model": model,
+        "scope": scope,
+        "messages": [{
+            "role": m.role,
+            "content": m.content,
+            "image": hashlib.sha256(m.image_data.encode("utf-8")).hexdigest() if m.image_data else None,
+        } for m in messages],
+        "options": options,
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """Cache có TTL + giới hạn số bản ghi (bỏ bản ghi lâu không dùng nhất khi đầy)"""
+
+    def __init__(self, path: str = "llm_cache.sqlite3", ttl: float = 7 * 24 * 3600, max_entries: int = 5000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                content TEXT,
+                tokens_used INTEGER,
+                created_at REAL,
+                last_access REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        self._conn.commit()
+        self.prune()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT model, content, tokens_used, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[3] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return {"model": row[0], "content": row[1], "tokens_used": row[2]}
+
+    def set(self, key: str, model: str, content: str, tokens_used: int = 0):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                               (key, model, content, tokens_used, now, now))
+            self._conn.commit()
+            self._evict()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_entries:
+            # Bỏ thêm 10% để không phải xoá sau mỗi lần ghi
+            excess = count - int(self.max_entries * 0.9)
+            self._conn.execute("""
+                DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access LIMIT ?)
+            """, (excess,))
+            self._conn.commit()
+
+    def prune(self):
+        """Xoá bản ghi hết hạn + bản ghi vượt giới hạn"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+            self._conn.commit()
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        total = self.hits + self.misses
+        return {"size": size, "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+
+_shared = {}
+
+
+def cacheable(use_cache: bool, temperature: float) -> bool:
+    """Chỉ cache câu trả lời tất định (temperature 0); temperature > 0 phát lại y nguyên 1 câu ngẫu nhiên là sai"""
+    return bool(use_cache) and temperature == 0
+
+
+def get_response_cache() -> Optional[LLMResponseCache]:
+    """Cache dùng chung cho các client LLM; tắt bằng LLM_CACHE=0"""
+    if os.getenv("LLM_CACHE", "1") == "0":
+        return None
+    path = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+    if path not in _shared:
+        _shared[path] = LLMResponseCache(path)
+    return _shared[path]
@@ -0,0 +1,114 @@
+# llm_router.py - Chọn backend LLM cho từng request (ưu tiên local, hàng đợi, khả năng đọc ảnh, tình trạng)
+import time
+from typing import Any, Dict, List
+
+from llm_types import LLMProvider, LLMResponse, LLMStreamError
+
+
+class LLMRouter(LLMProvider):
+    """
+    Backend theo thứ tự ưu tiên (local trước): dùng backend đầu tiên chưa quá tải
+    (số request đang chạy + đang chờ < max_queue), lỗi thì chuyển sang backend kế tiếp.
+    Khi mọi backend đều quá tải -> chọn theo thời gian chờ ước lượng = độ trễ EWMA x (1 + hàng đợi).
+    Độ trễ lâu không được đo lại sẽ trôi dần về default_latency (nửa chu kỳ stale_after giây):
+    1 lần trả lời chậm không khiến backend bị bỏ rơi mãi mãi.
+    """
+    name = "router"
+    supports_vision = True
+
+    def __init__(self, providers: List[LLMProvider], max_queue: Dict[str, int] = None, default_max_queue: int = 2,
+                 alpha: float = 0.3, default_latency: float = 10.0, stale_after: float = 300.0):
+        self.providers = providers
+        self.max_queue = max_queue or {}
+        self.default_max_queue = default_max_queue
+        self.alpha = alpha                      # hệ số EWMA
+        self.default_latency = default_latency  # giây, khi backend chưa có số đo
+        self.stale_after = stale_after
+        self.latency = {}
+        self.measured_at = {}
+        self.requests = {p.name: 0 for p in providers}
+        self.failures = {p.name: 0 for p in providers}
+
+    def available(self):
+        return any(p.available() for p in self.providers)
+
+    def queue_depth(self, has_image=False):
+        return sum(p.queue_depth(has_image) for p in self.providers)
+
+    def _latency(self, name: str) -> float:
+        if name not in self.latency:
+            return self.default_latency
+        weight = 0.5 ** ((time.time() - self.measured_at[name]) / self.stale_after)
+        return self.default_latency + (self.latency[name] - self.default_latency) * weight
+
+    def _saturated(self, provider: LLMProvider, has_image: bool) -> bool:
+        return provider.queue_depth(has_image) >= self.max_queue.get(provider.name, self.default_max_queue)
+
+    def _estimate(self, provider: LLMProvider, has_image: bool) -> float:
+        return self._latency(provider.name) * (1 + provider.queue_depth(has_image))
+
+    def rank(self, messages) -> List[LLMProvider]:
+        """Các backend dùng được cho request này, tốt nhất trước"""
+        has_image = any(m.image_data for m in messages)
+        candidates = [p for p in self.providers if p.available() and (p.supports_vision or not has_image)]
+        free = [p for p in candidates if not self._saturated(p, has_image)]
+        busy = sorted((p for p in candidates if p not in free), key=lambda p: self._estimate(p, has_image))
+        return free + busy
+
+    def _record(self, provider: LLMProvider, elapsed: float = None):
+        self.requests[provider.name] += 1
+        if elapsed is None:
+            self.failures[provider.name] += 1
+            return
+        old = self._latency(provider.name) if provider.name in self.latency else None
+        self.latency[provider.name] = elapsed if old is None else self.alpha * elapsed + (1 - self.alpha) * old
+        self.measured_at[provider.name] = time.time()
+
+    async def chat_completion(self, messages, model=None, temperature=0.7, use_cache=True, priority=None,
+                              cache_scope=None):
+        res = None
+        for provider in self.rank(messages):
+            started = time.time()
+            res = await provider.chat_completion(messages, model=model, temperature=temperature,
+                                                 use_cache=use_cache, priority=priority, cache_scope=cache_scope)
+            if res.model != "error":
+                self._record(provider, time.time() - started)
+                return res
+            self._record(provider)
+            print(f"⚠️ {provider.name} lỗi ({res.content[:80]}), chuyển backend khác")
+        return res or LLMResponse("❌ Không có backend LLM nào sẵn sàng.", "error", 0, 0)
+
+    async def chat_completion_stream(self, messages, model=None, temperature=0.7, use_cache=True,
+                                     priority=None, raise_errors=False, cache_scope=None):
+        """Chỉ chuyển backend khi lỗi trước token đầu tiên (đã hiện chữ cho người dùng thì không đổi nữa)"""
+        error = "❌ Không có backend LLM nào sẵn sàng."
+        for provider in self.rank(messages):
+            started, streamed = time.time(), False
+            try:
+                async for delta in provider.chat_completion_stream(
+                        messages, model=model, temperature=temperature, use_cache=use_cache,
+                        priority=priority, raise_errors=True, cache_scope=cache_scope):
+                    streamed = True
+                    yield delta
+                self._record(provider, time.time() - started)
+                return
+            except LLMStreamError as e:
+                self._record(provider)
+                error = str(e)
+                if streamed:
+                    break
+                print(f"⚠️ {provider.name} lỗi ({error[:80]}), chuyển backend khác")
+        if raise_errors:
+            raise LLMStreamError(error)
+        yield error
+
+    def stats(self) -> Dict[str, Any]:
+        return {p.name: {"available": p.available(),
+                         "latency_s": round(self._latency(p.name), 2) if p.name in self.latency else None,
+                         "queue_depth": p.queue_depth(), "saturated": self._saturated(p, False),
+                         "requests": self.requests[p.name], "failures": self.failures[p.name]}
+                for p in self.providers}
+
+    async def close(self):
+        for provider in self.providers:
+            await provider.close()
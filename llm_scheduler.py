@@ -0,0 +1,116 @@
+# llm_scheduler.py - Điều phối lời gọi LLM local: giới hạn song song theo model + hàng đợi ưu tiên
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+# Số nhỏ = ưu tiên cao: lượt chat ngắn đi trước câu trả lời dài dựa trên tài liệu
+PRIORITY_CHAT = 0
+PRIORITY_DOC = 1
+PRIORITY_BACKGROUND = 2
+
+
+class SchedulerOverloaded(Exception):
+    """Hàng đợi đầy -> từ chối ngay thay vì để request chờ tới timeout"""
+
+
+class SchedulerTimeout(Exception):
+    """Chờ trong hàng đợi quá lâu"""
+
+
+class _ModelState:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.queue = []  # heap (priority, seq, future)
+
+
+class LLMScheduler:
+    def __init__(self, limits: Optional[Dict[str, int]] = None, default_limit: int = 1,
+                 max_queue: int = 16, queue_timeout: float = 90.0):
+        self.limits = limits or {}
+        self.default_limit = default_limit
+        self.max_queue = max_queue            # số request chờ tối đa mỗi model
+        self.queue_timeout = queue_timeout    # giây chờ tối đa trong hàng đợi
+        self._models = {}
+        self._seq = itertools.count()
+        self.submitted = 0
+        self.shed = 0
+        self.timeouts = 0
+        self.wait_times = deque(maxlen=1000)
+
+    def _state(self, model: str) -> _ModelState:
+        if model not in self._models:
+            self._models[model] = _ModelState(self.limits.get(model, self.default_limit))
+        return self._models[model]
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: int = PRIORITY_CHAT):
+        """Giữ 1 chỗ chạy của model trong suốt khối with (kể cả khi stream)"""
+        await self._acquire(model, priority)
+        try:
+            yield
+        finally:
+            self._release(model)
+
+    async def _acquire(self, model: str, priority: int):
+        state = self._state(model)
+        self.submitted += 1
+        started = time.monotonic()
+        if state.in_flight < state.limit and not state.queue:
+            state.in_flight += 1
+            self.wait_times.append(0.0)
+            return
+        if len(state.queue) >= self.max_queue:
+            self.shed += 1
+            raise SchedulerOverloaded(f"{model}: {len(state.queue)} request đang chờ")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(state.queue, (priority, next(self._seq), future))
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                self._release(model)  # đã được cấp chỗ đúng lúc bị huỷ -> trả lại
+            else:
+                state.queue = [item for item in state.queue if item[2] is not future]
+                heapq.heapify(state.queue)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+                raise SchedulerTimeout(f"{model}: chờ quá {self.queue_timeout:.0f}s") from None
+            raise
+        self.wait_times.append(time.monotonic() - started)
+
+    def _release(self, model: str):
+        state = self._state(model)
+        # Chuyển thẳng chỗ chạy cho request ưu tiên cao nhất còn đang chờ
+        while state.queue:
+            _, _, future = heapq.heappop(state.queue)
+            if not future.done():
+                future.set_result(True)
+                return
+        state.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        waits = np.asarray(self.wait_times) * 1000 if self.wait_times else None
+        return {
+            "models": {name: {"in_flight": s.in_flight, "limit": s.limit,
+                              "queue_depth": len(s.queue)}
+                       for name, s in self._models.items()},
+            "submitted": self.submitted,
+            "shed": self.shed,
+            "timeouts": self.timeouts,
+            "wait_ms": {"p50": round(float(np.percentile(waits, 50)), 1),
+                        "p95": round(float(np.percentile(waits, 95)), 1),
+                        "max": round(float(waits.max()), 1)} if waits is not None else None,
+        }
+
+
+# Ollama mặc định sinh tuần tự mỗi model (OLLAMA_NUM_PARALLEL=1)
+llm_scheduler = LLMScheduler(default_limit=int(os.getenv("OLLAMA_NUM_PARALLEL", "1")))
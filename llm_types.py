@@ -0,0 +1,56 @@
+# llm_types.py - Kiểu dữ liệu + interface chung cho các backend LLM (Ollama, OpenRouter)
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+
+@dataclass
+class ChatMessage:
+    role: str
+    content: str
+    image_data: str = None
+
+
+@dataclass
+class LLMResponse:
+    content: str
+    model: str
+    tokens_used: int
+    response_time: float
+    load_time: float = 0.0         # thời gian Ollama nạp model (> 0 đáng kể = cold start)
+    prompt_eval_time: float = 0.0  # thời gian đọc prompt
+    generation_time: float = 0.0   # thời gian sinh câu trả lời
+
+
+class LLMStreamError(Exception):
+    """Stream lỗi trước/giữa chừng (chỉ dùng khi gọi với raise_errors=True, vd từ LLMRouter)"""
+
+
+class LLMProvider(ABC):
+    """Interface chung; LLMRouter chọn backend dựa trên các hàm này"""
+    name = "base"
+    supports_vision = False
+
+    def available(self) -> bool:
+        """Backend có thể nhận request lúc này không (cấu hình đủ, không bị ngắt mạch...)"""
+        return True
+
+    def queue_depth(self, has_image: bool = False) -> int:
+        """Số request đang chạy + đang chờ ở phía client cho model sẽ được dùng"""
+        return 0
+
+    @abstractmethod
+    async def chat_completion(self, messages, model=None, temperature=0.7, use_cache=True, priority=None,
+                              cache_scope=None):
+        """Trả về LLMResponse; lỗi được trả thành LLMResponse(model="error") thay vì raise"""
+
+    async def chat_completion_stream(self, messages, model=None, temperature=0.7, use_cache=True,
+                                     priority=None, raise_errors=False, cache_scope=None):
+        """Mặc định: backend không stream -> trả cả câu trả lời trong 1 lần"""
+        res = await self.chat_completion(messages, model=model, temperature=temperature,
+                                         use_cache=use_cache, priority=priority, cache_scope=cache_scope)
+        if raise_errors and res.model == "error":
+            raise LLMStreamError(res.content)
+        yield res.content
+
+    async def close(self):
+        pass
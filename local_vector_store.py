@@ -0,0 +1,339 @@
+# local_vector_store.py - Vector store nội bộ (không cần Milvus) cho cài đặt 1 máy
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+import numpy as np
+
+BLOCK_ROWS = 65536  # số dòng float16 đổi sang float32 mỗi lần tính điểm
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class _WorkspaceIndex:
+    """Dữ liệu vector của 1 workspace: vectors.f16 (memory-map) + rows.jsonl + tombstones"""
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self.lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self.vectors_path = os.path.join(path, "vectors.f16")
+        self.rows_path = os.path.join(path, "rows.jsonl")
+        self.deleted_path = os.path.join(path, "deleted.jsonl")
+        self.centroids_path = os.path.join(path, "ivf_centroids.npy")
+        self.assign_path = os.path.join(path, "ivf_assign.i32")
+        self._matrix = None
+        self.epoch = 0  # tăng mỗi lần nạp lại file (compact) -> số thứ tự dòng cũ không còn đúng
+        self._load()
+
+    @staticmethod
+    def _truncate(path: str, size: int):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+    def _load(self):
+        rows, ends = [], [0]  # ends[i]: vị trí byte kết thúc dòng thứ i trong rows.jsonl
+        if os.path.exists(self.rows_path):
+            with open(self.rows_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"): break  # dòng ghi dở do crash
+                    try: rows.append(json.loads(line))
+                    except ValueError: break
+                    ends.append(ends[-1] + len(line))
+        n_vectors = os.path.getsize(self.vectors_path) // (2 * self.dim) if os.path.exists(self.vectors_path) else 0
+        # Hai file ghi riêng -> lệch độ dài thì cắt cả hai (và ivf_assign) về phần chung,
+        # nếu không lần append sau sẽ ghép dòng mới với vector mồ côi ở cuối vectors.f16
+        n = min(len(rows), n_vectors)
+        self.epoch += 1
+        self._truncate(self.rows_path, ends[n])
+        self._truncate(self.vectors_path, n * 2 * self.dim)
+        self._truncate(self.assign_path, n * 4)
+        self.rows = rows[:n]
+        self.alive = np.ones(len(self.rows), dtype=bool)
+        self.doc_rows = {}
+        for i, row in enumerate(self.rows):
+            self.doc_rows.setdefault(row["document_id"], []).append(i)
+
+        if os.path.exists(self.deleted_path):
+            with open(self.deleted_path, encoding="utf-8") as f:
+                deleted = {line.strip() for line in f if line.strip()}
+            for i, row in enumerate(self.rows):
+                if row["id"] in deleted: self.alive[i] = False
+
+        self.centroids, self.assignments = None, np.zeros(0, dtype=np.int32)
+        if os.path.exists(self.centroids_path) and os.path.exists(self.assign_path):
+            assignments = np.fromfile(self.assign_path, dtype=np.int32)
+            if len(assignments) >= len(self.rows):
+                self.centroids = np.load(self.centroids_path)
+                self.assignments = assignments[:len(self.rows)]
+
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None or self._matrix.shape[0] != len(self.rows):
+            if not self.rows:
+                return np.zeros((0, self.dim), dtype=np.float16)
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float16, mode="r", shape=(len(self.rows), self.dim))
+        return self._matrix
+
+    @property
+    def live_count(self) -> int:
+        return int(self.alive.sum())
+
+    def append(self, rows: List[Dict[str, Any]], vectors) -> int:
+        vectors = _normalize(vectors)
+        if len(vectors) != len(rows):
+            raise ValueError(f"Số vector ({len(vectors)}) khác số dòng ({len(rows)})")
+        with self.lock:
+            start = len(self.rows)
+            rows_size = os.path.getsize(self.rows_path) if os.path.exists(self.rows_path) else 0
+            assign = None
+            if self.centroids is not None:
+                assign = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+            try:
+                with open(self.vectors_path, "ab") as f:
+                    f.write(vectors.astype(np.float16).tobytes())
+                with open(self.rows_path, "a", encoding="utf-8") as f:
+                    for row in rows:
+                        f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                if assign is not None:
+                    with open(self.assign_path, "ab") as f:
+                        f.write(assign.tobytes())
+            except Exception:
+                # Ghi dở -> trả các file về như trước để dòng i luôn khớp vector i
+                self._truncate(self.vectors_path, start * 2 * self.dim)
+                self._truncate(self.rows_path, rows_size)
+                self._truncate(self.assign_path, start * 4)
+                raise
+            self.rows.extend(rows)
+            self.alive = np.concatenate([self.alive, np.ones(len(rows), dtype=bool)])
+            for i, row in enumerate(rows, start):
+                self.doc_rows.setdefault(row["document_id"], []).append(i)
+            if assign is not None:
+                self.assignments = np.concatenate([self.assignments, assign])
+            self._matrix = None
+            return len(rows)
+
+    def delete(self, ids: Iterable[str] = (), document_ids: Iterable[str] = ()) -> int:
+        ids = set(ids)
+        with self.lock:
+            targets = [i for doc_id in document_ids for i in self.doc_rows.get(doc_id, [])]
+            if ids:
+                targets += [i for i, row in enumerate(self.rows) if row["id"] in ids]
+            targets = [i for i in set(targets) if self.alive[i]]
+            if not targets: return 0
+            with open(self.deleted_path, "a", encoding="utf-8") as f:
+                for i in targets:
+                    f.write(self.rows[i]["id"] + "\n")
+            self.alive[targets] = False
+            # Nhiều tombstone -> ghi lại file cho gọn
+            if len(self.rows) > 1000 and self.live_count < 0.7 * len(self.rows):
+                self.compact()
+            return len(targets)
+
+    def compact(self):
+        """Ghi lại file, bỏ các dòng đã xoá"""
+        with self.lock:
+            keep = np.flatnonzero(self.alive)
+            matrix = np.array(self.matrix()[keep]) if len(keep) else np.zeros((0, self.dim), dtype=np.float16)
+            rows = [self.rows[i] for i in keep]
+            self._matrix = None
+            matrix.tofile(self.vectors_path + ".tmp")
+            with open(self.rows_path + ".tmp", "w", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            os.replace(self.vectors_path + ".tmp", self.vectors_path)
+            os.replace(self.rows_path + ".tmp", self.rows_path)
+            if self.centroids is not None:
+                self.assignments[keep].tofile(self.assign_path)
+            if os.path.exists(self.deleted_path):
+                os.remove(self.deleted_path)
+            self._load()
+
+    def build_partitions(self, n_lists: int, iterations: int = 10, sample_size: int = 50000):
+        """Phân cụm kiểu IVF (k-means cầu) để chỉ quét các cụm gần câu hỏi.
+        k-means chạy ngoài lock trên ảnh chụp các dòng hiện có (file chỉ ghi nối) -> tìm kiếm/ghi không phải chờ"""
+        with self.lock:
+            live = np.flatnonzero(self.alive)
+            if len(live) < n_lists: return False
+            epoch, n_rows, matrix = self.epoch, len(self.rows), self.matrix()
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(live, size=min(sample_size, len(live)), replace=False))
+        data = matrix[sample].astype(np.float32)
+        centroids = data[rng.choice(len(data), size=n_lists, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(data @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = data[labels == c]
+                if len(members): centroids[c] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+
+        assignments = np.empty(n_rows, dtype=np.int32)
+        for start in range(0, n_rows, BLOCK_ROWS):
+            block = matrix[start:start + BLOCK_ROWS].astype(np.float32)
+            assignments[start:start + BLOCK_ROWS] = np.argmax(block @ centroids.T, axis=1)
+
+        with self.lock:
+            if self.epoch != epoch:
+                return False  # compact chạy xen giữa, lần sau phân cụm lại
+            # Dòng ghi thêm trong lúc phân cụm -> gán cụm nốt
+            if len(self.rows) > n_rows:
+                tail = self.matrix()[n_rows:].astype(np.float32)
+                assignments = np.concatenate([assignments, np.argmax(tail @ centroids.T, axis=1).astype(np.int32)])
+            np.save(self.centroids_path, centroids)
+            assignments.tofile(self.assign_path)
+            self.centroids, self.assignments = centroids, assignments
+            return True
+
+    def search(self, queries: np.ndarray, limit: int, document_ids: Optional[Iterable[str]] = None,
+               nprobe: int = 8) -> List[List[Dict[str, Any]]]:
+        with self.lock:
+            if not self.rows or not self.alive.any():
+                return [[] for _ in queries]
+            if document_ids is not None:
+                rows = np.asarray(sorted({i for d in document_ids for i in self.doc_rows.get(d, [])}), dtype=np.int64)
+                idx = rows[self.alive[rows]] if len(rows) else rows
+            else:
+                mask = self.alive.copy()
+                if self.centroids is not None:
+                    probe = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+                    mask &= np.isin(self.assignments, np.unique(probe))
+                idx = np.flatnonzero(mask)
+            if not len(idx):
+                return [[] for _ in queries]
+
+            matrix = self.matrix()
+            full = len(idx) == len(self.rows)
+            scores = np.empty((len(queries), len(idx)), dtype=np.float32)
+            for start in range(0, len(idx), BLOCK_ROWS):
+                block = matrix[start:start + BLOCK_ROWS] if full else matrix[idx[start:start + BLOCK_ROWS]]
+                scores[:, start:start + BLOCK_ROWS] = queries @ block.astype(np.float32).T
+
+            k = min(limit, len(idx))
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            results = []
+            for qi in range(len(queries)):
+                order = top[qi][np.argsort(-scores[qi, top[qi]])]
+                results.append([dict(self.rows[idx[j]], score=float(scores[qi, j])) for j in order])
+            return results
+
+
+class LocalVectorStore:
+    """Vector store trong tiến trình: mỗi workspace 1 thư mục, tìm top-k bằng NumPy"""
+
+    def __init__(self, root_dir: str = "vector_store", dim: int = 768, n_lists: int = 0, nprobe: int = 8):
+        self.root_dir = root_dir
+        self.dim = dim
+        self.n_lists = n_lists  # > 0: bật phân cụm IVF khi workspace đủ lớn
+        self.nprobe = nprobe
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._partitioning = set()  # workspace đang phân cụm IVF ở luồng nền
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _dir_name(self, workspace: str) -> str:
+        return re.sub(r"[^\w\-]", "_", workspace)
+
+    def _get(self, workspace: str) -> _WorkspaceIndex:
+        name = self._dir_name(workspace)
+        with self._lock:
+            if name not in self._indexes:
+                self._indexes[name] = _WorkspaceIndex(os.path.join(self.root_dir, name), self.dim)
+            return self._indexes[name]
+
+    def _all(self) -> List[_WorkspaceIndex]:
+        for name in os.listdir(self.root_dir):
+            if os.path.isdir(os.path.join(self.root_dir, name)):
+                self._get(name)
+        return list(self._indexes.values())
+
+    def insert(self, workspace: str, rows: List[Dict[str, Any]], vectors) -> int:
+        """rows: [{id, document_id, chunk_index, content}], vectors: cùng thứ tự"""
+        index = self._get(workspace)
+        added = index.append(rows, vectors)
+        self._maybe_partition(workspace, index)
+        return added
+
+    def search(self, workspace: str, vector, limit: int, document_ids=None) -> List[Dict[str, Any]]:
+        return self.search_many(workspace, [vector], limit, document_ids)[0]
+
+    def search_many(self, workspace: str, vectors, limit: int, document_ids=None) -> List[List[Dict[str, Any]]]:
+        index = self._get(workspace)
+        # Workspace đã đủ lớn từ trước (vd. vừa khởi động) -> phân cụm nền, lượt này vẫn quét toàn bộ
+        self._maybe_partition(workspace, index)
+        return index.search(_normalize(vectors), limit, document_ids, self.nprobe)
+
+    def _maybe_partition(self, workspace: str, index: _WorkspaceIndex):
+        """Workspace đủ lớn mà chưa phân cụm -> chạy k-means ở luồng nền (không chặn câu hỏi/ghi)"""
+        if not self.n_lists or index.centroids is not None or index.live_count < 40 * self.n_lists:
+            return
+        with self._lock:
+            if workspace in self._partitioning: return
+            self._partitioning.add(workspace)
+
+        def run():
+            try:
+                print(f"🔧 Phân cụm IVF cho workspace '{workspace}' ({self.n_lists} cụm)")
+                index.build_partitions(self.n_lists)
+            except Exception as e:
+                print(f"⚠️ Lỗi phân cụm IVF '{workspace}': {e}")
+            finally:
+                with self._lock:
+                    self._partitioning.discard(workspace)
+
+        threading.Thread(target=run, name="ivf_partition", daemon=True).start()
+
+    def delete_documents(self, document_ids: Iterable[str]) -> int:
+        document_ids = list(document_ids)
+        return sum(index.delete(document_ids=document_ids) for index in self._all())
+
+    def delete_ids(self, ids: Iterable[str]) -> int:
+        ids = list(ids)
+        return sum(index.delete(ids=ids) for index in self._all())
+
+    def move_document(self, document_id: str, workspace: str) -> int:
+        """Chuyển vector của 1 tài liệu sang workspace khác"""
+        target = self._get(workspace)
+        moved = 0
+        for index in self._all():
+            if index is target: continue
+            with index.lock:
+                rows = [i for i in index.doc_rows.get(document_id, []) if index.alive[i]]
+                if not rows: continue
+                vectors = np.array(index.matrix()[rows], dtype=np.float32)
+                target.append([index.rows[i] for i in rows], vectors)
+                moved += index.delete(document_ids=[document_id])
+        return moved
+
+    def iter_ids(self, batch_size: int = 1000) -> Iterator[List[str]]:
+        """Duyệt id các vector còn sống theo lô"""
+        batch = []
+        for index in self._all():
+            with index.lock:
+                ids = [row["id"] for row, alive in zip(index.rows, index.alive) if alive]
+            for chunk_id in ids:
+                batch.append(chunk_id)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def existing_ids(self, ids: Iterable[str]) -> Set[str]:
+        ids = set(ids)
+        found = set()
+        for index in self._all():
+            with index.lock:
+                found.update(row["id"] for row, alive in zip(index.rows, index.alive) if alive and row["id"] in ids)
+        return found
+
+    def count(self, workspace: Optional[str] = None) -> int:
+        if workspace:
+            return self._get(workspace).live_count
+        return sum(index.live_count for index in self._all())
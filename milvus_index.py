@@ -0,0 +1,394 @@
+# milvus_index.py - Chọn index Milvus theo kích thước collection + benchmark recall/latency
+import argparse
+import json
+import math
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+try:
+    from pymilvus import connections, utility, Collection, CollectionSchema, DataType, FieldSchema
+except ImportError:
+    print("❌ Thiếu pymilvus")
+
+
+# Ngưỡng số vector để đổi loại index
+FLAT_MAX = 10_000
+IVF_FLAT_MAX = 300_000
+HNSW_MAX = 2_000_000
+
+# Tỉ lệ nprobe/nlist (IVF) và ef (HNSW) ước lượng để đạt recall mục tiêu
+IVF_PROBE_RATIO = {0.90: 0.02, 0.95: 0.05, 0.98: 0.10, 0.99: 0.15}
+HNSW_EF = {0.90: 64, 0.95: 128, 0.98: 200, 0.99: 256}
+
+
+def collection_schema(dim: int = 768):
+    """Schema collection chunk (dùng chung cho database.py và embedding_snapshot.py)"""
+    fields = [
+        FieldSchema(name="id", dtype=DataType.VARCHAR, max_length=100, is_primary=True),
+        FieldSchema(name="document_id", dtype=DataType.VARCHAR, max_length=100),
+        FieldSchema(name="chunk_index", dtype=DataType.INT64),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
+        FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=6000)
+    ]
+    return CollectionSchema(fields, "Vietnamese Embeddings")
+
+
+def _lookup(table: Dict[float, Any], target: float) -> Any:
+    """Lấy giá trị của mốc recall nhỏ nhất >= target (hoặc mốc cao nhất)"""
+    for level in sorted(table):
+        if target <= level:
+            return table[level]
+    return table[max(table)]
+
+
+class MilvusIndexManager:
+    """Chọn loại index (FLAT / IVF_FLAT / IVF_SQ8 / HNSW) và tham số search theo số vector"""
+
+    def __init__(self, metric_type: str = "COSINE", target_recall: float = 0.95):
+        self.metric_type = metric_type
+        self.target_recall = target_recall
+
+    def choose_index(self, num_entities: int) -> Dict[str, Any]:
+        n = max(int(num_entities), 0)
+        if n < FLAT_MAX:
+            index_type, params = "FLAT", {}
+        elif n < IVF_FLAT_MAX:
+            index_type, params = "IVF_FLAT", {"nlist": self._nlist(n)}
+        elif n < HNSW_MAX:
+            index_type, params = "HNSW", {"M": 16, "efConstruction": 200}
+        else:
+            # Rất lớn: nén SQ8 để giữ RAM ~1/4 so với float32
+            index_type, params = "IVF_SQ8", {"nlist": self._nlist(n)}
+        return {"metric_type": self.metric_type, "index_type": index_type, "params": params}
+
+    def _nlist(self, n: int) -> int:
+        # Quy tắc kinh nghiệm nlist ~ 4*sqrt(n), làm tròn lũy thừa 2
+        nlist = 2 ** round(math.log2(max(4 * math.sqrt(n), 1)))
+        return int(min(max(nlist, 128), 16384))
+
+    def search_params(self, index: Optional[Dict[str, Any]], top_k: int = 10,
+                      target_recall: Optional[float] = None) -> Dict[str, Any]:
+        """Tham số search (phần "params") cho index hiện tại"""
+        target = target_recall or self.target_recall
+        index_type = (index or {}).get("index_type", "IVF_FLAT")
+        params = (index or {}).get("params") or {}
+        if index_type == "FLAT":
+            return {}
+        if index_type == "HNSW":
+            return {"ef": max(int(_lookup(HNSW_EF, target)), top_k)}
+        nlist = int(params.get("nlist", 128))
+        nprobe = math.ceil(nlist * _lookup(IVF_PROBE_RATIO, target))
+        return {"nprobe": int(min(max(nprobe, 8), nlist))}
+
+    def current_index(self, collection, field: str = "embedding") -> Optional[Dict[str, Any]]:
+        for index in collection.indexes:
+            if index.field_name != field:
+                continue
+            params = dict(index.params)
+            inner = params.get("params") or {}
+            if isinstance(inner, str):
+                inner = json.loads(inner)
+            return {"metric_type": params.get("metric_type", self.metric_type),
+                    "index_type": params.get("index_type"),
+                    "params": {k: int(v) for k, v in inner.items()}}
+        return None
+
+    def needs_rebuild(self, current: Optional[Dict[str, Any]], wanted: Dict[str, Any]) -> bool:
+        if not current or current["index_type"] != wanted["index_type"]:
+            return True
+        # Cùng loại IVF: chỉ build lại khi nlist lệch > 2 lần (tránh build liên tục)
+        old, new = current["params"].get("nlist"), wanted["params"].get("nlist")
+        return bool(old and new and (new > 2 * old or old > 2 * new))
+
+    def build_index(self, collection, index: Dict[str, Any], field: str = "embedding"):
+        """Build lại index tại chỗ: collection bị release cho tới khi xong -> chỉ dùng cho collection
+        chưa phục vụ search (mới tạo / shadow / bản sao benchmark)"""
+        collection.release()
+        if collection.has_index():
+            collection.drop_index()
+        collection.create_index(field, index)
+        collection.load()
+
+    @staticmethod
+    def physical_name(collection) -> str:
+        """Tên collection thật (collection có thể đang được mở qua alias)"""
+        try:
+            return collection.describe().get("collection_name") or collection.name
+        except Exception:
+            return collection.name
+
+    def create_shadow(self, collection, suffix: Optional[str] = None):
+        """Collection rỗng cùng schema tên <tên gốc>__<hậu tố>; dọn các shadow còn sót từ lần build lỗi trước"""
+        current = self.physical_name(collection)
+        base = current.split("__")[0]
+        for name in utility.list_collections():
+            if name.startswith(f"{base}__") and name != current:
+                utility.drop_collection(name)
+        return Collection(f"{base}__{suffix or time.strftime('%Y%m%d%H%M%S')}", collection.schema)
+
+    def build_shadow(self, collection, index: Dict[str, Any], shadow, field: str = "embedding",
+                     batch_size: int = 2000):
+        """Chép dữ liệu sang shadow rồi build index + load trên shadow; collection đang phục vụ không bị release"""
+        started = time.time()
+        copied = copy_collection(collection, shadow, batch_size)
+        shadow.flush()
+        shadow.create_index(field, index)
+        shadow.load()
+        print(f"🔧 Shadow {self.physical_name(shadow)}: {copied} vectors, {index['index_type']} {index['params']} "
+              f"trong {time.time() - started:.1f}s")
+        return shadow
+
+    def swap_alias(self, alias: str, old, new):
+        """Trỏ alias sang collection mới rồi xoá collection cũ. Trả về Collection mở qua alias"""
+        old_name, new_name = self.physical_name(old), self.physical_name(new)
+        if old_name == alias:
+            # Lần đầu: collection gốc mang đúng tên alias -> phải xoá nó trước khi tạo alias cùng tên
+            Collection(old_name).release()
+            utility.drop_collection(old_name)
+            utility.create_alias(new_name, alias)
+        else:
+            utility.alter_alias(new_name, alias)
+            Collection(old_name).release()
+            utility.drop_collection(old_name)
+        return Collection(alias)
+
+    def ensure_index(self, collection, field: str = "embedding", force: bool = False,
+                     alias: Optional[str] = None):
+        """
+        Kiểm tra index hiện tại, không còn phù hợp với số vector thì build vào shadow rồi đổi alias
+        (search vẫn chạy trên index cũ trong lúc build). Ghi vào collection trong lúc build KHÔNG được chép sang:
+        app tự rebuild nền kèm ghi song song (DatabaseManager.tune_milvus_index), lệnh này dùng khi app không ghi.
+        Trả về (index, collection đang phục vụ)
+        """
+        collection.flush()
+        wanted = self.choose_index(collection.num_entities)
+        current = self.current_index(collection, field)
+        if force or self.needs_rebuild(current, wanted):
+            print(f"🔧 Build lại index Milvus: {current and current['index_type']} -> "
+                  f"{wanted['index_type']} {wanted['params']} ({collection.num_entities} vectors)")
+            shadow = self.build_shadow(collection, wanted, self.create_shadow(collection), field)
+            return wanted, self.swap_alias(alias or collection.name, collection, shadow)
+        return current, collection
+
+
+class MilvusMaintenance:
+    """Flush trễ sau khi xoá (gom nhiều lần xoá vào 1 flush) + compaction định kỳ, chạy nền"""
+
+    def __init__(self, get_collection, flush_delay: float = 5.0, compact_interval: float = 3600.0,
+                 compact_min_deletes: int = 1000):
+        self.get_collection = get_collection  # hàm trả về Collection hiện tại (hoặc None)
+        self.flush_delay = flush_delay
+        self.compact_interval = compact_interval
+        self.compact_min_deletes = compact_min_deletes
+        self.pending_deletes = 0        # số entity đã xoá từ lần compaction trước
+        self.last_flush = None
+        self.last_compact = time.time()
+        self._flush_due = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def schedule_flush(self, deleted: int = 0):
+        """Gọi sau mỗi lần delete: flush sẽ chạy sau flush_delay giây (không chặn UI)"""
+        with self._lock:
+            self.pending_deletes += deleted
+            if self._flush_due is None:
+                self._flush_due = time.time() + self.flush_delay
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="milvus_maintenance", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=1.0)
+            self._wake.clear()
+            collection = self.get_collection()
+            if collection is None:
+                continue
+            now = time.time()
+            with self._lock:
+                flush_now = self._flush_due is not None and now >= self._flush_due
+                if flush_now:
+                    self._flush_due = None
+                compact_now = (self.pending_deletes >= self.compact_min_deletes
+                               or (self.pending_deletes and now - self.last_compact >= self.compact_interval))
+            try:
+                if flush_now:
+                    collection.flush()
+                    self.last_flush = time.time()
+                if compact_now:
+                    # Dọn tombstone của các entity đã xoá để search không phải lọc chúng
+                    collection.compact()
+                    with self._lock:
+                        self.pending_deletes = 0
+                        self.last_compact = time.time()
+                    print("🧹 Đã chạy compaction Milvus")
+            except Exception as e:
+                print(f"⚠️ Lỗi bảo trì Milvus: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pending_deletes": self.pending_deletes, "flush_pending": self._flush_due is not None,
+                "last_flush": self.last_flush, "last_compact": self.last_compact}
+
+
+def copy_collection(src, dst, batch_size: int = 2000) -> int:
+    """Chép toàn bộ entity sang collection khác cùng schema (upsert -> chạy trùng với ghi song song không nhân đôi)"""
+    fields = [f.name for f in src.schema.fields]
+    iterator = src.query_iterator(batch_size=batch_size, expr="chunk_index >= 0", output_fields=fields)
+    copied = 0
+    try:
+        while True:
+            rows = iterator.next()
+            if not rows:
+                break
+            dst.upsert([[r[name] for r in rows] for name in fields])
+            copied += len(rows)
+    finally:
+        iterator.close()
+    return copied
+
+
+# --- BENCHMARK ---
+def _load_vectors(collection, batch_size: int = 2000):
+    """Đọc toàn bộ embedding theo lô (không giữ cả collection trong RAM)"""
+    iterator = collection.query_iterator(batch_size=batch_size, expr="chunk_index >= 0",
+                                         output_fields=["embedding"])
+    try:
+        while True:
+            rows = iterator.next()
+            if not rows:
+                break
+            yield [r["id"] for r in rows], np.asarray([r["embedding"] for r in rows], dtype=np.float32)
+    finally:
+        iterator.close()
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def exact_neighbors(collection, queries: np.ndarray, k: int) -> List[List[str]]:
+    """Top-k chính xác (brute force cosine), duyệt collection theo lô"""
+    queries = _normalize(queries)
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.empty((len(queries), k), dtype=object)
+    for ids, vectors in _load_vectors(collection):
+        scores = queries @ _normalize(vectors).T
+        all_scores = np.concatenate([best_scores, scores], axis=1)
+        all_ids = np.concatenate([best_ids, np.tile(np.asarray(ids, dtype=object), (len(queries), 1))], axis=1)
+        top = np.argsort(-all_scores, axis=1)[:, :k]
+        best_scores = np.take_along_axis(all_scores, top, axis=1)
+        best_ids = np.take_along_axis(all_ids, top, axis=1)
+    return [[i for i in row if i is not None] for row in best_ids.tolist()]
+
+
+def benchmark(source, queries: np.ndarray, k: int = 10, configs: Optional[List[Dict[str, Any]]] = None,
+              manager: Optional[MilvusIndexManager] = None) -> List[Dict[str, Any]]:
+    """Đo recall@k và p50/p99 latency cho từng cấu hình index trên bản sao dữ liệu thật
+    (build index trên bản sao, collection production không bị release)"""
+    manager = manager or MilvusIndexManager()
+    source.flush()
+    n = source.num_entities
+    if configs is None:
+        nlist = manager._nlist(n)
+        configs = [
+            {"metric_type": manager.metric_type, "index_type": "FLAT", "params": {}},
+            {"metric_type": manager.metric_type, "index_type": "IVF_FLAT", "params": {"nlist": nlist}},
+            {"metric_type": manager.metric_type, "index_type": "IVF_SQ8", "params": {"nlist": nlist}},
+            {"metric_type": manager.metric_type, "index_type": "HNSW", "params": {"M": 16, "efConstruction": 200}},
+        ]
+
+    print(f"📐 Tính ground truth cho {len(queries)} câu hỏi trên {n} vectors...")
+    truth = exact_neighbors(source, queries, k)
+    collection = Collection(f"{manager.physical_name(source)}__bench", source.schema)
+    print(f"📋 Chép {n} vectors sang bản sao {collection.name}...")
+    copy_collection(source, collection)
+    collection.flush()
+    report = []
+    try:
+        for index in configs:
+            build_start = time.time()
+            manager.build_index(collection, index)
+            build_time = time.time() - build_start
+            for target in sorted(IVF_PROBE_RATIO):
+                search_params = manager.search_params(index, top_k=k, target_recall=target)
+                latencies, recalls = [], []
+                for q, expected in zip(queries, truth):
+                    start = time.perf_counter()
+                    res = collection.search(data=[q.tolist()], anns_field="embedding",
+                                            param={"metric_type": manager.metric_type, "params": search_params},
+                                            limit=k)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    got = {hit.id for hit in res[0]}
+                    recalls.append(len(got & set(expected)) / max(len(expected), 1))
+                report.append({
+                    "index_type": index["index_type"], "index_params": index["params"],
+                    "target_recall": target, "search_params": search_params,
+                    f"recall@{k}": round(float(np.mean(recalls)), 4),
+                    "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+                    "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+                    "build_s": round(build_time, 1),
+                })
+                if index["index_type"] == "FLAT":
+                    break  # FLAT không có tham số search
+    finally:
+        utility.drop_collection(collection.name)
+    return report
+
+
+def _sample_queries(collection, args) -> np.ndarray:
+    if args.questions:
+        from sentence_transformers import SentenceTransformer
+        with open(args.questions, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+        return np.asarray(SentenceTransformer(args.model).encode(questions), dtype=np.float32)
+    rows = collection.query(expr="chunk_index >= 0", output_fields=["embedding"], limit=args.queries)
+    return np.asarray([r["embedding"] for r in rows], dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quản lý / benchmark index Milvus")
+    parser.add_argument("command", choices=["status", "tune", "benchmark"])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="19530")
+    parser.add_argument("--collection", default="document_embeddings_vn_v1")
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100, help="Số vector mẫu dùng làm câu hỏi")
+    parser.add_argument("--questions", help="File câu hỏi thật (mỗi dòng 1 câu), thay cho vector mẫu")
+    parser.add_argument("--model", default="keepitreal/vietnamese-sbert")
+    parser.add_argument("--output", help="Ghi kết quả benchmark ra file JSON")
+    args = parser.parse_args()
+
+    connections.connect("default", host=args.host, port=args.port)
+    collection = Collection(args.collection)
+    manager = MilvusIndexManager(target_recall=args.target_recall)
+
+    if args.command == "status":
+        current = manager.current_index(collection)
+        print(json.dumps({"num_entities": collection.num_entities, "current": current,
+                          "recommended": manager.choose_index(collection.num_entities),
+                          "search_params": manager.search_params(current)}, indent=2, ensure_ascii=False))
+    elif args.command == "tune":
+        collection.load()
+        index, _ = manager.ensure_index(collection, alias=args.collection)
+        print(json.dumps(index, ensure_ascii=False))
+    else:
+        collection.load()
+        report = benchmark(collection, _sample_queries(collection, args), k=args.k, manager=manager)
+        print(f"{'index':10} {'params':28} {'target':>6} {'search':18} {'recall':>7} {'p50ms':>8} {'p99ms':>8}")
+        for r in report:
+            print(f"{r['index_type']:10} {json.dumps(r['index_params']):28} {r['target_recall']:>6} "
+                  f"{json.dumps(r['search_params']):18} {r[f'recall@{args.k}']:>7} {r['p50_ms']:>8} {r['p99_ms']:>8}")
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,55 @@
+import asyncio
 import httpx
+import json
+import os
 import time
-from dataclasses import dataclass
-
-@dataclass
-class ChatMessage:
-    role: str
-    content: str
-    image_data: str = None
-
-@dataclass
-class LLMResponse:
-    content: str
-    model: str
-    tokens_used: int
-    response_time: float
-
-class OllamaClient:
+
+from async_runtime import LoopBoundClient
+from llm_cache import cache_key, cacheable, get_response_cache
+from llm_scheduler import llm_scheduler, PRIORITY_CHAT, SchedulerOverloaded, SchedulerTimeout
+from llm_types import ChatMessage, LLMResponse, LLMProvider, LLMStreamError
+
+def _timings(result):
+    """Đổi các trường *_duration (nano giây) của Ollama sang giây"""
+    ns = 1e9
+    return {
+        "load_time": result.get('load_duration', 0) / ns,
+        "prompt_eval_time": result.get('prompt_eval_duration', 0) / ns,
+        "generation_time": result.get('eval_duration', 0) / ns,
+    }
+
+class OllamaClient(LLMProvider):
+    name = "ollama"
+    supports_vision = True
+
     def __init__(self):
         self.base_url = "http://localhost:11434/api/chat"
         self.text_model = "llama3.2" 
         self.vision_model = "llama3.2-vision"
-        self.client = httpx.AsyncClient(timeout=120.0)
+        # Giữ model trong RAM sau request cuối (mặc định của Ollama chỉ 5 phút)
+        self.keep_alive = "30m"
+        # Tuỳ chọn riêng từng model; phải giống nhau giữa các request, đổi num_ctx sẽ làm Ollama nạp lại model
+        self.model_options = {
+            self.text_model: {"num_ctx": 4096, "num_thread": os.cpu_count()},
+            self.vision_model: {"num_ctx": 4096, "num_thread": os.cpu_count()},
+        }
+        # Ping giữ model "nóng" trong giờ làm việc (giờ bắt đầu, giờ kết thúc), mỗi keep_warm_interval giây
+        self.warm_hours = (7, 19)
+        self.keep_warm_interval = 600
+        # Client dùng lại giữa các request (pool + keep-alive), tạo trên event loop sẽ dùng nó
+        self.http = LoopBoundClient(httpx.Timeout(120.0, connect=5.0),
+                                    httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=300.0))
+        # Cache câu trả lời (SQLite), None nếu tắt bằng LLM_CACHE=0
+        self.response_cache = get_response_cache()
+        # Giới hạn số request chạy song song mỗi model + hàng đợi ưu tiên (Ollama sinh tuần tự)
+        self.scheduler = llm_scheduler
     
-    async def chat_completion(self, messages, model=None, temperature=0.7):
-        start_time = time.time()
+    def queue_depth(self, has_image=False):
+        model = self.vision_model if has_image else self.text_model
+        state = self.scheduler.stats()["models"].get(model)
+        return state["in_flight"] + state["queue_depth"] if state else 0
+
+    def _build_payload(self, messages, temperature, stream):
         has_image = any(msg.image_data for msg in messages)
         selected_model = self.vision_model if has_image else self.text_model
         
@@ -33,27 +59,137 @@ class OllamaClient:
             if msg.image_data: payload["images"] = [msg.image_data]
             ollama_messages.append(payload)
         
-        json_payload = {
+        return selected_model, {
             "model": selected_model,
             "messages": ollama_messages,
-            "stream": False,
-            "options": {"temperature": temperature}
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": {**self.model_options.get(selected_model, {}), "temperature": temperature}
         }
+
+    async def warm_up(self, models=None):
+        """Nạp sẵn model vào RAM (gửi messages rỗng). Trả về {model: thời gian nạp (giây)}"""
+        load_times = {}
+        for model in models or [self.text_model, self.vision_model]:
+            try:
+                response = await self.http.get().post(self.base_url, json={
+                    "model": model, "messages": [], "stream": False, "keep_alive": self.keep_alive,
+                    "options": self.model_options.get(model, {}),
+                })
+                load_times[model] = _timings(response.json())["load_time"] if response.status_code == 200 else None
+            except Exception as e:
+                print(f"⚠️ Không warm-up được {model}: {e}")
+                load_times[model] = None
+        print(f"🔥 Warm-up Ollama: {load_times}")
+        return load_times
+
+    async def keep_warm(self, models=None):
+        """Warm-up ngay, sau đó ping định kỳ trong giờ làm việc (chạy nền, không bao giờ kết thúc)"""
+        await self.warm_up(models)
+        while True:
+            await asyncio.sleep(self.keep_warm_interval)
+            start_hour, end_hour = self.warm_hours
+            if start_hour <= time.localtime().tm_hour < end_hour:
+                await self.warm_up(models)
+
+    def _cache_key(self, selected_model, messages, json_payload, use_cache, temperature, cache_scope):
+        if not (self.response_cache and cacheable(use_cache, temperature)):
+            return None
+        return cache_key("ollama", selected_model, messages, json_payload["options"], cache_scope)
+
+    async def chat_completion(self, messages, model=None, temperature=0.7, use_cache=True, priority=None,
+                              cache_scope=None):
+        priority = PRIORITY_CHAT if priority is None else priority
+        start_time = time.time()
+        selected_model, json_payload = self._build_payload(messages, temperature, stream=False)
+        key = self._cache_key(selected_model, messages, json_payload, use_cache, temperature, cache_scope)
+        if key:
+            cached = self.response_cache.get(key)
+            if cached:
+                return LLMResponse(cached["content"], cached["model"], cached["tokens_used"], time.time() - start_time)
         
         try:
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(self.base_url, json=json_payload)
-                if response.status_code != 200:
-                    return LLMResponse(f"Lỗi: {response.text}", "error", 0, 0)
-                result = response.json()
-                return LLMResponse(
-                    content=result.get('message', {}).get('content', ''),
-                    model=selected_model,
-                    tokens_used=result.get('eval_count', 0),
-                    response_time=time.time() - start_time
-                )
+            async with self.scheduler.slot(selected_model, priority):
+                response = await self.http.get().post(self.base_url, json=json_payload)
+            if response.status_code != 200:
+                return LLMResponse(f"Lỗi: {response.text}", "error", 0, 0)
+            result = response.json()
+            content = result.get('message', {}).get('content', '')
+            if key and content:
+                self.response_cache.set(key, selected_model, content, result.get('eval_count', 0))
+            timings = _timings(result)
+            print(f"⏱️ {selected_model}: nạp {timings['load_time']:.2f}s, đọc prompt {timings['prompt_eval_time']:.2f}s, "
+                  f"sinh {timings['generation_time']:.2f}s")
+            return LLMResponse(
+                content=content,
+                model=selected_model,
+                tokens_used=result.get('eval_count', 0),
+                response_time=time.time() - start_time,
+                **timings
+            )
+        except SchedulerOverloaded:
+            return LLMResponse("⏳ Hệ thống đang quá tải, vui lòng thử lại sau ít phút.", "error", 0, 0)
+        except SchedulerTimeout:
+            return LLMResponse("⏳ Chờ quá lâu trong hàng đợi, vui lòng thử lại.", "error", 0, 0)
         except Exception as e:
             return LLMResponse(f"Lỗi kết nối: {e}", "error", 0, 0)
 
+    async def chat_completion_stream(self, messages, model=None, temperature=0.7, use_cache=True, priority=None,
+                                     raise_errors=False, cache_scope=None):
+        """
+        Trả về từng đoạn text ngay khi Ollama sinh ra (NDJSON, mỗi dòng 1 delta).
+        Lỗi được trả thành 1 đoạn text, hoặc raise LLMStreamError nếu raise_errors=True
+        """
+        priority = PRIORITY_CHAT if priority is None else priority
+        start_time = time.time()
+        selected_model, json_payload = self._build_payload(messages, temperature, stream=True)
+        key = self._cache_key(selected_model, messages, json_payload, use_cache, temperature, cache_scope)
+        if key:
+            cached = self.response_cache.get(key)
+            if cached:
+                yield cached["content"]
+                return
+        parts = []
+        error = None
+        
+        try:
+            async with self.scheduler.slot(selected_model, priority):
+                async with self.http.get().stream("POST", self.base_url, json=json_payload) as response:
+                    if response.status_code != 200:
+                        error = f"Lỗi: {(await response.aread()).decode('utf-8', 'replace')}"
+                    else:
+                        first_token = None
+                        async for line in response.aiter_lines():
+                            if not line.strip(): continue
+                            chunk = json.loads(line)
+                            if chunk.get('error'):
+                                error = f"Lỗi: {chunk['error']}"
+                                break
+                            delta = chunk.get('message', {}).get('content', '')
+                            if delta:
+                                if first_token is None: first_token = time.time() - start_time
+                                parts.append(delta)
+                                yield delta
+                            if chunk.get('done'):
+                                # Chỉ lưu cache khi stream chạy hết (không lưu câu trả lời dở dang)
+                                if key and parts:
+                                    self.response_cache.set(key, selected_model, "".join(parts), chunk.get('eval_count', 0))
+                                timings = _timings(chunk)
+                                print(f"⚡ {selected_model}: token đầu sau {first_token or 0:.2f}s "
+                                      f"(nạp {timings['load_time']:.2f}s, đọc prompt {timings['prompt_eval_time']:.2f}s), "
+                                      f"sinh {chunk.get('eval_count', 0)} tokens trong {timings['generation_time']:.2f}s")
+                                return
+        except SchedulerOverloaded:
+            error = "⏳ Hệ thống đang quá tải, vui lòng thử lại sau ít phút."
+        except SchedulerTimeout:
+            error = "⏳ Chờ quá lâu trong hàng đợi, vui lòng thử lại."
+        except Exception as e:
+            error = f"Lỗi kết nối: {e}"
+        
+        if error:
+            if raise_errors:
+                raise LLMStreamError(error)
+            yield error
+
     async def close(self):
-        pass
\ No newline at end of file
+        await self.http.aclose()
\ No newline at end of file
@@ -3,28 +3,66 @@ import os
 import httpx
 import time
 import asyncio
-from dataclasses import dataclass
 from dotenv import load_dotenv
 
+from async_runtime import LoopBoundClient
+from llm_cache import cache_key, cacheable, get_response_cache
+from llm_types import ChatMessage, LLMResponse, LLMProvider
+
 load_dotenv()
 
-@dataclass
-class ChatMessage:
-    role: str
-    content: str
-    image_data: str = None  
+class CircuitBreaker:
+    """
+    Theo dõi sức khoẻ 1 model: lỗi liên tiếp >= failure_threshold -> mở (bỏ qua model) trong cooldown giây,
+    hết cooldown -> nửa mở (cho 1 request thử), thử thành công -> đóng lại
+    """
+    
+    def __init__(self, failure_threshold=3, cooldown=60.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial_in_flight = False
+    
+    def allow(self):
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.time() >= self.open_until:
+            self.state = "half_open"
+        if self.state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+    
+    def record_success(self):
+        self.state, self.failures, self.trial_in_flight = "closed", 0, False
+    
+    def record_failure(self, cooldown=None):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold or cooldown:
+            self.state = "open"
+            self.open_until = time.time() + (cooldown or self.cooldown)
+    
+    def is_open(self):
+        """Đang ngắt (chưa tới lúc thử lại) - chỉ đọc, không chiếm lượt thử"""
+        if self.state == "open":
+            return time.time() < self.open_until
+        return self.state == "half_open" and self.trial_in_flight
+    
+    def release_trial(self):
+        # Request thử bị huỷ (vd thua trong hedged) -> không tính là lỗi
+        self.trial_in_flight = False
 
-@dataclass
-class LLMResponse:
-    content: str
-    model: str
-    tokens_used: int
-    response_time: float
+class OpenRouterClient(LLMProvider):
+    name = "openrouter"
+    supports_vision = True
 
-class OpenRouterClient:
     def __init__(self):
         self.api_key = os.getenv('OPENROUTER_API_KEY')
-        self.base_url = "https://openrouter.ai/api/v1"
+        # Đổi base_url để chạy với server giả lập (vd http://127.0.0.1:8080/v1)
+        self.base_url = os.getenv('OPENROUTER_BASE_URL', "https://openrouter.ai/api/v1")
         
         # DANH SÁCH CÁC MODEL MIỄN PHÍ ĐỌC ẢNH TỐT NHẤT
         # Hệ thống sẽ thử lần lượt từ trên xuống dưới
@@ -37,13 +75,26 @@ class OpenRouterClient:
         
         self.default_model = self.fallback_models[0]
         
+        # Circuit breaker theo model: model đang lỗi / bị rate limit sẽ bị bỏ qua cho tới hết cooldown
+        self.breakers = {}
+        # Hedged: model đang thử chưa trả lời sau N giây -> gọi song song model kế tiếp, lấy kết quả tốt đầu tiên
+        # (0 = tắt, thử lần lượt như cũ)
+        self.hedge_after = float(os.getenv('OPENROUTER_HEDGE_AFTER', '0')) or None
+        
         if not self.api_key:
             print("🔴❌ CẢNH BÁO: Chưa cài đặt OpenRouter API key trong file .env!")
         
-        timeout = httpx.Timeout(60.0, read=120.0)
-        self.client = httpx.AsyncClient(timeout=timeout)
+        # Client dùng lại giữa các request (pool + keep-alive), tạo trên event loop sẽ dùng nó
+        self.http = LoopBoundClient(httpx.Timeout(60.0, read=120.0, connect=10.0),
+                                    httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=300.0))
+        # Cache câu trả lời (SQLite), None nếu tắt bằng LLM_CACHE=0
+        self.response_cache = get_response_cache()
+    
+    def available(self):
+        return bool(self.api_key) and any(not self._breaker(m).is_open() for m in self.fallback_models)
     
-    async def chat_completion(self, messages, model=None, temperature=0.7):
+    async def chat_completion(self, messages, model=None, temperature=0.7, use_cache=True, priority=None,
+                              cache_scope=None):
         if not self.api_key:
             return LLMResponse("Lỗi: Chưa có API Key. Hãy kiểm tra file .env", "error", 0, 0)
         
@@ -74,49 +125,124 @@ class OpenRouterClient:
         start_time = time.time()
         
         # --- CƠ CHẾ TỰ ĐỘNG THAY ĐỔI MODEL (FALLBACK LOOP) ---
-        last_error = ""
         models_to_try = [model] if model else self.fallback_models
         
-        for current_model in models_to_try:
-            try:
-                payload = {
-                    "model": current_model,
-                    "messages": api_messages,
-                    "temperature": temperature
-                }
+        # Khoá theo danh sách model được phép trả lời (model thật lưu kèm câu trả lời)
+        key = None
+        if self.response_cache and cacheable(use_cache, temperature):
+            key = cache_key("openrouter", ",".join(models_to_try), messages, {"temperature": temperature}, cache_scope)
+            cached = self.response_cache.get(key)
+            if cached:
+                return LLMResponse(cached["content"], cached["model"], cached["tokens_used"], time.time() - start_time)
+        
+        candidates = [m for m in models_to_try if self._breaker(m).allow()]
+        if not candidates:
+            return LLMResponse("❌ Tất cả các model đang tạm ngưng do lỗi liên tục. Hãy thử lại sau ít phút.", "error", 0, 0)
+        
+        if self.hedge_after:
+            res = await self._hedged(candidates, api_messages, temperature, headers)
+        else:
+            res = None
+            for current_model in candidates:
+                res = await self._try_model(current_model, api_messages, temperature, headers)
+                if res: break
+            # Model chưa tới lượt thử đã được allow() -> trả lại lượt thử nửa mở
+            for m in candidates[candidates.index(res.model) + 1 if res else len(candidates):]:
+                self._breaker(m).release_trial()
+        
+        if res:
+            res.response_time = time.time() - start_time
+            if key and res.content:
+                self.response_cache.set(key, res.model, res.content, res.tokens_used)
+            return res
+        return LLMResponse(f"❌ Tất cả các model đều bận. Hãy thử lại sau vài giây.", "error", 0, 0)
+    
+    def _breaker(self, model):
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker()
+        return self.breakers[model]
+    
+    def breaker_stats(self):
+        return {m: {"state": b.state, "failures": b.failures,
+                    "open_for": max(0.0, round(b.open_until - time.time(), 1)) if b.state == "open" else 0.0}
+                for m, b in self.breakers.items()}
+    
+    async def _try_model(self, current_model, api_messages, temperature, headers):
+        """Gọi 1 model; trả về LLMResponse hoặc None nếu lỗi (đồng thời cập nhật circuit breaker)"""
+        breaker = self._breaker(current_model)
+        start_time = time.time()
+        try:
+            payload = {
+                "model": current_model,
+                "messages": api_messages,
+                "temperature": temperature
+            }
+            
+            response = await self.http.get().post(
+                f"{self.base_url}/chat/completions",
+                headers=headers,
+                json=payload
+            )
+            
+            if response.status_code == 200:
+                result = response.json()
+                if 'error' in result:
+                    print(f"⚠️ Model {current_model} bị lỗi: {result['error']['message']}")
+                    breaker.record_failure()
+                    return None
+                    
+                content = result['choices'][0]['message']['content']
+                usage = result.get('usage', {})
                 
-                response = await self.client.post(
-                    f"{self.base_url}/chat/completions",
-                    headers=headers,
-                    json=payload
+                print(f"✅ Thành công với model: {current_model}")
+                breaker.record_success()
+                return LLMResponse(
+                    content=content,
+                    model=current_model,
+                    tokens_used=usage.get('total_tokens', 0),
+                    response_time=time.time() - start_time
                 )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    if 'error' in result:
-                        print(f"⚠️ Model {current_model} bị lỗi: {result['error']['message']}")
-                        continue 
-                        
-                    content = result['choices'][0]['message']['content']
-                    usage = result.get('usage', {})
-                    
-                    print(f"✅ Thành công với model: {current_model}")
-                    return LLMResponse(
-                        content=content,
-                        model=current_model,
-                        tokens_used=usage.get('total_tokens', 0),
-                        response_time=time.time() - start_time
-                    )
-                else:
-                    print(f"⚠️ Model {current_model} gặp lỗi {response.status_code}. Đang đổi model khác...")
-                    continue
-
-            except Exception as e:
-                print(f"⚠️ Lỗi kết nối với {current_model}: {e}")
-                last_error = str(e)
-                continue
+            
+            print(f"⚠️ Model {current_model} gặp lỗi {response.status_code}. Đang đổi model khác...")
+            if response.status_code == 429:
+                # Bị rate limit: mở breaker ngay, theo Retry-After nếu có
+                retry_after = response.headers.get('retry-after', '')
+                breaker.record_failure(cooldown=float(retry_after) if retry_after.isdigit() else None)
+            elif response.status_code >= 500 or response.status_code in (402, 408):
+                breaker.record_failure()
+            else:
+                breaker.release_trial()  # lỗi do request (vd model không đọc được ảnh), không phải do model
+            return None
         
-        return LLMResponse(f"❌ Tất cả các model đều bận. Hãy thử lại sau vài giây.", "error", 0, 0)
+        except asyncio.CancelledError:
+            breaker.release_trial()
+            raise
+        except Exception as e:
+            print(f"⚠️ Lỗi kết nối với {current_model}: {e}")
+            breaker.record_failure()
+            return None
+    
+    async def _hedged(self, candidates, api_messages, temperature, headers):
+        """Gọi model đầu tiên; chưa xong sau hedge_after giây (hoặc lỗi) -> gọi thêm model kế tiếp song song"""
+        pending = set()
+        queue = list(candidates)
+        try:
+            while queue or pending:
+                if queue:
+                    pending.add(asyncio.ensure_future(self._try_model(queue.pop(0), api_messages, temperature, headers)))
+                done, pending = await asyncio.wait(pending, timeout=self.hedge_after if queue else None,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    res = task.result()
+                    if res: return res
+                if not done and queue:
+                    print(f"⏱️ Chưa có trả lời sau {self.hedge_after}s, gọi song song {queue[0]}")
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+            for m in queue:
+                self._breaker(m).release_trial()
     
     async def close(self):
-        await self.client.aclose()
\ No newline at end of file
+        await self.http.aclose()
\ No newline at end of file
@@ -0,0 +1,83 @@
+# prompt_builder.py - Dựng prompt theo ngân sách token (thay cho cắt cứng 200/500 ký tự)
+from typing import Any, Dict, List, Optional
+
+from context_selection import count_tokens, truncate_around, truncate_tokens
+
+
+class PromptBuilder:
+    """
+    Lấp ngân sách token theo thứ tự ưu tiên:
+      1. chỉ dẫn + câu hỏi (luôn có)
+      2. lịch sử hội thoại trong phần ngân sách riêng (mỗi tin tối đa message_max_tokens)
+      3. đoạn tài liệu theo thứ hạng tìm kiếm (mỗi đoạn tối đa passage_max_tokens)
+    Ngân sách lịch sử cố định (budget x history_share, không phụ thuộc câu hỏi / số tài liệu tìm được).
+    Hội thoại được chia khối cố định từ đầu (mỗi khối ~history_block x ngân sách lịch sử token),
+    điểm cắt chỉ nằm ở ranh giới khối: lịch sử bị bỏ theo cả khối thay vì từng tin một
+    -> đầu hội thoại giữ nguyên qua nhiều lượt, Ollama dùng lại được KV cache của phần prompt chung.
+    Khối bằng nửa ngân sách -> sau khi cắt vẫn còn khoảng nửa ngân sách lịch sử; luôn giữ ít nhất
+    min_history tin gần nhất (cặp hỏi/đáp cuối).
+    Token đếm bằng cl100k (xấp xỉ tokenizer của model local).
+    """
+
+    def __init__(self, budget: int = 3000, passage_max_tokens: int = 600, message_max_tokens: int = 300,
+                 min_passage_tokens: int = 50, history_share: float = 0.4, history_block: float = 0.5,
+                 min_history: int = 2):
+        self.budget = budget
+        self.passage_max_tokens = passage_max_tokens
+        self.message_max_tokens = message_max_tokens
+        self.min_passage_tokens = min_passage_tokens  # phần còn lại ít hơn mức này -> không cắt vụn đoạn nữa
+        self.history_share = history_share            # phần ngân sách tối đa cho lịch sử
+        self.history_block = history_block            # kích thước khối, tính theo phần của ngân sách lịch sử
+        self.min_history = min_history                # cặp hỏi/đáp gần nhất luôn được giữ
+
+    def build(self, instructions: str, question: str, passages: Optional[List[Dict[str, Any]]] = None,
+              history: Optional[List[Dict[str, Any]]] = None, history_share: Optional[float] = None) -> Dict[str, Any]:
+        """
+        passages: [{"source": ..., "content": ..., "hit_span": (đầu, cuối) tuỳ chọn}] đã sắp theo độ liên quan;
+                  có hit_span (chunk trúng trong đoạn đã ghép chunk liền kề) thì cắt quanh đoạn đó thay vì từ đầu
+        history: [{"role": "user"|"assistant", "content": ...}] toàn bộ hội thoại, cũ -> mới
+        history_share: ghi đè self.history_share (vd chế độ tán gẫu không có tài liệu)
+        Trả về {"passages", "history", "usage"}; passages/history là phần được giữ lại
+        """
+        passages, history = passages or [], history or []
+        usage = {"instructions": count_tokens(instructions), "question": count_tokens(question)}
+        remaining = self.budget - usage["instructions"] - usage["question"]
+
+        # Lịch sử: ngân sách cố định để điểm cắt ổn định giữa các lượt
+        # (chỉ bị thu lại khi câu hỏi quá dài, không thì vượt tổng ngân sách)
+        share = self.history_share if history_share is None else history_share
+        history_budget = min(int(self.budget * share), remaining)
+        sizes = [min(count_tokens(msg.get("content", "")), self.message_max_tokens) for msg in history]
+        # Ranh giới khối chỉ phụ thuộc các tin cũ (không đổi) -> cùng ranh giới ở mọi lượt sau
+        block_tokens = max(int(self.budget * share * self.history_block), 1)
+        anchors, acc = [0], 0
+        for i, size in enumerate(sizes):
+            acc += size
+            if acc >= block_tokens:
+                anchors.append(i + 1)
+                acc = 0
+        # Ranh giới sớm nhất mà phần lịch sử từ đó tới cuối vừa ngân sách
+        start = next((anchor for anchor in anchors if sum(sizes[anchor:]) <= history_budget), len(history))
+        # Không bao giờ bỏ cặp hỏi/đáp gần nhất
+        start = min(start, max(len(history) - self.min_history, 0))
+        kept_history = [dict(msg, content=truncate_tokens(msg.get("content", ""), size))
+                        for msg, size in zip(history[start:], sizes[start:])]
+        usage["history"] = sum(sizes[start:])
+        remaining -= usage["history"]
+
+        kept_passages, used = [], 0
+        for passage in passages:
+            room = min(self.passage_max_tokens, remaining - used)
+            if room < self.min_passage_tokens:
+                break
+            content = truncate_around(passage.get("content", ""), passage.get("hit_span"), room)
+            tokens = count_tokens(content)
+            kept_passages.append(dict(passage, content=content, tokens=tokens))
+            used += tokens
+        usage["passages"] = used
+
+        usage["total"] = sum(usage.values())
+        usage["budget"] = self.budget
+        usage["dropped_passages"] = len(passages) - len(kept_passages)
+        usage["dropped_history"] = len(history) - len(kept_history)
+        return {"passages": kept_passages, "history": kept_history, "usage": usage}
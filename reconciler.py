@@ -0,0 +1,228 @@
+# reconciler.py - Đối soát chunk giữa PostgreSQL và vector store (Milvus / nội bộ)
+"""
+Duyệt theo lô (không nạp toàn bộ id vào RAM):
+  1. Xoá chunk mồ côi trong PostgreSQL (tài liệu đã bị xoá)
+  2. Chunk có trong PostgreSQL nhưng thiếu vector -> embed lại
+  3. Vector không còn chunk tương ứng -> xoá
+  4. Tài liệu kẹt ở 'processing' quá lâu -> 'completed' (có chunk) / 'failed' (không có chunk)
+
+    python reconciler.py               # chạy 1 lần
+    python reconciler.py --dry-run     # chỉ báo cáo độ lệch
+    python reconciler.py --every 3600  # chạy định kỳ
+    python reconciler.py --reindex-keywords  # nạp lại toàn bộ chunk vào keyword index (Elasticsearch)
+    python reconciler.py --backfill-codes    # trích mã TCVN/QCVN... cho tài liệu upload trước khi có document_codes
+"""
+import argparse
+import json
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Set
+
+
+class Reconciler:
+    def __init__(self, db, batch_size: int = 1000, stuck_after: int = 3600):
+        self.db = db
+        self.batch_size = batch_size
+        self.stuck_after = stuck_after  # giây: tài liệu 'processing' lâu hơn mới coi là kẹt
+        self._thread = None
+        self._stop = threading.Event()
+
+    # --- Truy vấn PostgreSQL ---
+    def _query(self, sql, params=()):
+        conn = self.db._safe_get_connection()
+        if not conn:
+            raise RuntimeError("Không kết nối được PostgreSQL")
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                rows = cur.fetchall()
+                conn.commit()
+                return rows
+        finally:
+            self.db._safe_put_connection(conn)
+
+    def _pg_id_batches(self) -> Iterator[List[str]]:
+        """Id chunk trong PostgreSQL, phân trang theo khoá (bỏ qua tài liệu đang được xử lý)"""
+        last = ""
+        while True:
+            rows = self._query("""
+                SELECT c.chunk_id FROM chunks c JOIN documents d ON d.id = c.document_id
+                WHERE c.chunk_id > %s
+                  AND NOT (d.status = 'processing' AND d.upload_date > NOW() - make_interval(secs => %s))
+                ORDER BY c.chunk_id LIMIT %s
+            """, (last, self.stuck_after, self.batch_size))
+            if not rows:
+                return
+            yield [r['chunk_id'] for r in rows]
+            last = rows[-1]['chunk_id']
+
+    def _pg_existing(self, ids: List[str]) -> Set[str]:
+        rows = self._query("SELECT chunk_id FROM chunks WHERE chunk_id = ANY(%s)", (ids,))
+        return {r['chunk_id'] for r in rows}
+
+    # --- Truy vấn vector store ---
+    def _vector_id_batches(self) -> Iterator[List[str]]:
+        if self.db.local_vector_store:
+            yield from self.db.local_vector_store.iter_ids(self.batch_size)
+            return
+        iterator = self.db.milvus_collection.query_iterator(batch_size=self.batch_size, expr='id != ""',
+                                                            output_fields=["id"])
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    return
+                yield [r["id"] for r in rows]
+        finally:
+            iterator.close()
+
+    def _vector_existing(self, ids: List[str]) -> Set[str]:
+        if self.db.local_vector_store:
+            return self.db.local_vector_store.existing_ids(ids)
+        rows = self.db.milvus_collection.query(expr=f"id in {json.dumps(ids)}", output_fields=["id"])
+        return {r["id"] for r in rows}
+
+    def _delete_vectors(self, ids: List[str]):
+        if self.db.local_vector_store:
+            self.db.local_vector_store.delete_ids(ids)
+        else:
+            self.db.milvus_delete(f"id in {json.dumps(ids)}")
+
+    def _reembed(self, ids: List[str]) -> Set[str]:
+        rows = self._query("""
+            SELECT chunk_id, document_id, content, chunk_index, workspace FROM chunks WHERE chunk_id = ANY(%s)
+        """, (ids,))
+        if not rows:
+            return set()
+        chunks = [dict(r) for r in rows]
+        self.db._insert_vectors(chunks, self.db.embedder.encode([c['content'] for c in chunks]))
+        return {c['workspace'] for c in chunks}
+
+    # --- Đối soát ---
+    def run(self, dry_run: bool = False) -> Dict[str, Any]:
+        if not self.db._has_vector_backend():
+            raise RuntimeError("Chưa kết nối vector store")
+        started = time.time()
+        report = {"dry_run": dry_run, "pg_chunks": 0, "vectors": 0, "orphan_chunks": 0,
+                  "missing_vectors": 0, "reembedded": 0, "orphan_vectors": 0, "deleted_vectors": 0,
+                  "stuck_documents": 0}
+        touched = set()
+
+        # 1. Chunk không còn tài liệu
+        if dry_run:
+            report["orphan_chunks"] = self._query("""
+                SELECT COUNT(*) AS n FROM chunks c WHERE NOT EXISTS (SELECT 1 FROM documents d WHERE d.id = c.document_id)
+            """)[0]['n']
+        else:
+            rows = self._query("""
+                DELETE FROM chunks c WHERE NOT EXISTS (SELECT 1 FROM documents d WHERE d.id = c.document_id)
+                RETURNING c.chunk_id, c.workspace
+            """)
+            report["orphan_chunks"] = len(rows)
+            touched.update(r['workspace'] for r in rows)
+            if rows and self.db.keyword_index:
+                self.db.keyword_index.delete_ids([r['chunk_id'] for r in rows])
+
+        # 2. Chunk thiếu vector
+        for ids in self._pg_id_batches():
+            report["pg_chunks"] += len(ids)
+            existing = self._vector_existing(ids)
+            missing = [i for i in ids if i not in existing]
+            report["missing_vectors"] += len(missing)
+            if missing and not dry_run:
+                try:
+                    touched |= self._reembed(missing)
+                    report["reembedded"] += len(missing)
+                except Exception as e:
+                    print(f"⚠️ Lỗi embed lại {len(missing)} chunk: {e}")
+
+        # 3. Vector mồ côi (chạy sau bước 2 nên không tính các vector vừa embed lại)
+        for ids in self._vector_id_batches():
+            report["vectors"] += len(ids)
+            existing = self._pg_existing(ids)
+            orphans = [i for i in ids if i not in existing]
+            report["orphan_vectors"] += len(orphans)
+            if orphans and not dry_run:
+                self._delete_vectors(orphans)
+                report["deleted_vectors"] += len(orphans)
+
+        # 4. Tài liệu kẹt ở 'processing'
+        if dry_run:
+            report["stuck_documents"] = self._query("""
+                SELECT COUNT(*) AS n FROM documents
+                WHERE status = 'processing' AND upload_date < NOW() - make_interval(secs => %s)
+            """, (self.stuck_after,))[0]['n']
+        else:
+            rows = self._query("""
+                UPDATE documents d SET status = CASE
+                    WHEN EXISTS (SELECT 1 FROM chunks c WHERE c.document_id = d.id) THEN 'completed' ELSE 'failed' END
+                WHERE d.status = 'processing' AND d.upload_date < NOW() - make_interval(secs => %s)
+                RETURNING d.id
+            """, (self.stuck_after,))
+            report["stuck_documents"] = len(rows)
+
+        if touched:
+            self.db.invalidate_workspace(*touched)
+        if report["reembedded"]:
+            self.db.maybe_tune_milvus_index()
+        report["drift"] = round((report["missing_vectors"] + report["orphan_vectors"])
+                                / max(report["pg_chunks"], 1), 4)
+        report["elapsed_s"] = round(time.time() - started, 2)
+        report["finished_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.db.last_reconcile = report
+        print(f"🔁 Đối soát: thiếu {report['missing_vectors']} vector, mồ côi {report['orphan_vectors']} vector, "
+              f"{report['orphan_chunks']} chunk, kẹt {report['stuck_documents']} tài liệu (drift={report['drift']})")
+        return report
+
+    def start_schedule(self, interval: float = 3600.0):
+        """Chạy đối soát định kỳ trên luồng nền"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.run()
+                except Exception as e:
+                    print(f"⚠️ Lỗi đối soát: {e}")
+
+        self._thread = threading.Thread(target=loop, name="reconciler", daemon=True)
+        self._thread.start()
+
+    def stop_schedule(self):
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đối soát PostgreSQL <-> vector store")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ báo cáo, không sửa")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--stuck-after", type=int, default=3600, help="Số giây trước khi coi 'processing' là kẹt")
+    parser.add_argument("--every", type=float, help="Chạy lặp lại sau mỗi N giây")
+    parser.add_argument("--reindex-keywords", action="store_true",
+                        help="Nạp lại toàn bộ chunk từ PostgreSQL vào keyword index (KEYWORD_BACKEND) rồi thoát")
+    parser.add_argument("--backfill-codes", action="store_true",
+                        help="Trích mã tài liệu cho các tài liệu chưa có trong document_codes rồi thoát")
+    args = parser.parse_args()
+
+    from database import db_manager
+    if args.backfill_codes:
+        print(json.dumps({"documents_with_codes": db_manager.backfill_document_codes()}))
+        return
+    if args.reindex_keywords:
+        if not db_manager.keyword_index:
+            print("⚠️ Chưa bật keyword index (KEYWORD_BACKEND=elasticsearch)")
+            return
+        print(json.dumps({"reindexed": db_manager.reindex_keyword_index(batch_size=args.batch_size)}))
+        return
+    reconciler = Reconciler(db_manager, batch_size=args.batch_size, stuck_after=args.stuck_after)
+    while True:
+        print(json.dumps(reconciler.run(dry_run=args.dry_run), indent=2, ensure_ascii=False))
+        if not args.every:
+            break
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
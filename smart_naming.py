@@ -26,6 +26,14 @@ class SmartDocumentNamer:
             'huong_dan': r'HƯỚNG\s+DẪN\s+(?:SỐ\s+)?\d+[\/\-][A-Z\-]+',
         }
         
+        # Patterns mã tài liệu dùng để tra cứu (dễ dãi hơn document_patterns: năm/phần là tuỳ chọn,
+        # chấp nhận "TCVN 5574:2018", "TCVN 5574-2018", "QCVN 06:2022/BXD", "NĐ 15/2021/NĐ-CP")
+        self.code_patterns = {
+            'standard': r'\b(TCVN|QCVN|TCCS|TCXDVN)\s*(\d+(?:-\d{1,2}(?!\d))?)(?:\s*[:\-]\s*(\d{4}))?(?:\s*/\s*([A-ZĐ]+))?',
+            'legal': r'\b(NGHỊ\s+ĐỊNH|THÔNG\s+TƯ|QUYẾT\s+ĐỊNH|NĐ|TT|QĐ)\s*(?:SỐ\s*)?(\d+)\s*/\s*(\d{4})(?:\s*/\s*([A-ZĐ\-]+))?',
+        }
+        self.legal_kinds = {'NGHỊ ĐỊNH': 'NĐ', 'THÔNG TƯ': 'TT', 'QUYẾT ĐỊNH': 'QĐ'}
+        
         # Patterns cho tiêu đề chính
         self.title_patterns = [
             r'TIÊU\s+CHUẨN\s+QUỐC\s+GIA\s*([A-ZÀÁÂÃÈÉÊÌÍÒÓÔÕÙÚĂĐĨŨƠƯĂÂÊÔƠƯ\s\-:\/\d]+)',
@@ -88,6 +96,27 @@ class SmartDocumentNamer:
                 return match.group(0).strip()
         return None
     
+    def extract_document_codes(self, text):
+        """
+        Tìm và chuẩn hoá mọi mã tài liệu trong text.
+        Trả về list (code, base_code), vd ("TCVN 5574:2018", "TCVN 5574"), ("NĐ 15/2021/NĐ-CP", "NĐ 15/2021")
+        """
+        text = re.sub(r'\s+', ' ', (text or '').upper())
+        codes = []
+        for kind, pattern in self.code_patterns.items():
+            for match in re.finditer(pattern, text):
+                prefix, number, year, suffix = match.groups()
+                if kind == 'standard':
+                    base = f"{prefix} {number}"
+                    code = base + (f":{year}" if year else "") + (f"/{suffix}" if suffix else "")
+                else:
+                    prefix = self.legal_kinds.get(re.sub(r'\s+', ' ', prefix), prefix)
+                    base = f"{prefix} {number}/{year}"
+                    code = base + (f"/{suffix}" if suffix else "")
+                if (code, base) not in codes:
+                    codes.append((code, base))
+        return codes
+
     def _find_main_title(self, text):
         """Tìm tiêu đề chính của tài liệu"""
         # Thử các patterns tiêu đề
@@ -0,0 +1,5 @@
+# conftest.py - Cho phép import các module ở thư mục gốc (repo không đóng gói)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,69 @@
+# test_keyword_index.py - Nhánh Keyword BM25 trên bản giả lập trong RAM
+import pytest
+
+from elasticsearch_store import InMemoryKeywordIndex
+
+
+def _chunk(chunk_id, document_id, content, workspace="main", chunk_index=0):
+    return {"chunk_id": chunk_id, "document_id": document_id, "workspace": workspace,
+            "chunk_index": chunk_index, "content": content}
+
+
+@pytest.fixture
+def index():
+    idx = InMemoryKeywordIndex()
+    assert idx.connect()
+    idx.add(_chunk("a#0", "a", "Chiều dày lớp bê tông bảo vệ cốt thép tối thiểu 20 mm"))
+    idx.add(_chunk("a#1", "a", "Cường độ chịu nén của bê tông cấp B25", chunk_index=1))
+    idx.add(_chunk("b#0", "b", "Yêu cầu về lối thoát nạn trong nhà chung cư"))
+    idx.add(_chunk("c#0", "c", "Lớp bê tông bảo vệ cho dầm", workspace="other"))
+    idx.flush()
+    return idx
+
+
+def test_index_and_count(index):
+    assert index.count() == 4
+    # Thêm lại cùng chunk_id -> ghi đè, không nhân đôi
+    index.add(_chunk("b#0", "b", "Lối thoát nạn nhà cao tầng"))
+    assert index.count() == 4
+    assert [h["id"] for h in index.search("cao tầng", "main", 5)] == ["b#0"]
+
+
+def test_search_ranks_and_filters_workspace(index):
+    hits = index.search("lớp bê tông bảo vệ", "main", 5)
+    assert [h["id"] for h in hits][:2] == ["a#0", "a#1"]
+    assert all(h["document_id"] != "c" for h in hits)
+    assert hits[0]["score"] > hits[1]["score"]
+    assert set(hits[0]) == {"id", "document_id", "chunk_index", "content", "score"}
+
+
+def test_search_without_diacritics(index):
+    assert [h["id"] for h in index.search("loi thoat nan", "main", 5)] == ["b#0"]
+
+
+def test_search_restricted_to_documents(index):
+    assert [h["id"] for h in index.search("bê tông", "main", 5, document_ids=["b"])] == []
+    assert {h["id"] for h in index.search("bê tông", "main", 5, document_ids=["a"])} == {"a#0", "a#1"}
+
+
+def test_search_many_keeps_query_order(index):
+    results = index.search_many(["thoát nạn", "cấp B25", "không có từ này"], "main", 5)
+    assert [[h["id"] for h in hits] for hits in results] == [["b#0"], ["a#1"], []]
+
+
+def test_delete_documents(index):
+    assert index.delete_documents(["a"]) == 2
+    assert index.count() == 2
+    assert index.search("bê tông", "main", 5) == []
+    assert index.delete_documents(["a"]) == 0
+
+
+def test_delete_ids(index):
+    assert index.delete_ids(["a#1", "missing"]) == 1
+    assert [h["id"] for h in index.search("bê tông", "main", 5)] == ["a#0"]
+
+
+def test_move_document(index):
+    index.move_document("a", "other")
+    assert index.search("bê tông", "main", 5) == []
+    assert {h["id"] for h in index.search("bê tông", "other", 5)} == {"a#0", "a#1", "c#0"}
@@ -0,0 +1,86 @@
+# test_llm_router.py - Ưu tiên local, chỉ đẩy ra ngoài khi local quá tải / lỗi
+import asyncio
+import time
+
+from llm_router import LLMRouter
+from llm_types import ChatMessage, LLMProvider, LLMResponse
+
+TEXT = [ChatMessage(role="user", content="Xin chào")]
+IMAGE = [ChatMessage(role="user", content="Ảnh này là gì?", image_data="aGVsbG8=")]
+
+
+class FakeProvider(LLMProvider):
+    def __init__(self, name, supports_vision=True, fail=False):
+        self.name = name
+        self.supports_vision = supports_vision
+        self.fail = fail
+        self.depth = 0
+        self.calls = 0
+
+    def queue_depth(self, has_image=False):
+        return self.depth
+
+    async def chat_completion(self, messages, model=None, temperature=0.7, use_cache=True, priority=None,
+                              cache_scope=None):
+        self.calls += 1
+        if self.fail:
+            return LLMResponse("Lỗi kết nối", "error", 0, 0)
+        return LLMResponse(f"trả lời từ {self.name}", self.name, 1, 0)
+
+
+def _ask(router, messages=TEXT):
+    return asyncio.run(router.chat_completion(messages))
+
+
+def test_prefers_local_when_idle_even_after_slow_answer():
+    local, remote = FakeProvider("ollama"), FakeProvider("openrouter")
+    router = LLMRouter([local, remote], max_queue={"ollama": 2})
+    # 1 câu trả lời local rất chậm, remote nhanh
+    router._record(local, 25.0)
+    router._record(remote, 6.0)
+    for _ in range(10):
+        assert _ask(router).model == "ollama"
+    assert (local.calls, remote.calls) == (10, 0)
+
+
+def test_offloads_only_when_local_saturated():
+    local, remote = FakeProvider("ollama"), FakeProvider("openrouter")
+    router = LLMRouter([local, remote], max_queue={"ollama": 2})
+    local.depth = 1
+    assert _ask(router).model == "ollama"
+    local.depth = 2
+    assert _ask(router).model == "openrouter"
+
+
+def test_all_saturated_picks_shortest_estimated_wait():
+    local, remote = FakeProvider("ollama"), FakeProvider("openrouter")
+    router = LLMRouter([local, remote], max_queue={"ollama": 1, "openrouter": 1})
+    local.depth, remote.depth = 3, 1
+    router._record(local, 5.0)
+    router._record(remote, 5.0)
+    assert [p.name for p in router.rank(TEXT)] == ["openrouter", "ollama"]
+
+
+def test_falls_back_on_error():
+    local, remote = FakeProvider("ollama", fail=True), FakeProvider("openrouter")
+    router = LLMRouter([local, remote])
+    assert _ask(router).model == "openrouter"
+    assert router.stats()["ollama"]["failures"] == 1
+
+
+def test_image_skips_text_only_backends():
+    text_only, vision = FakeProvider("text", supports_vision=False), FakeProvider("vision")
+    router = LLMRouter([text_only, vision])
+    assert _ask(router, IMAGE).model == "vision"
+    assert text_only.calls == 0
+
+
+def test_stale_latency_decays_to_default():
+    local = FakeProvider("ollama")
+    router = LLMRouter([local], default_latency=10.0, stale_after=60.0)
+    router._record(local, 40.0)
+    assert abs(router._latency("ollama") - 40.0) < 0.1
+    router.measured_at["ollama"] = time.time() - 60.0
+    assert abs(router._latency("ollama") - 25.0) < 0.1
+    router.measured_at["ollama"] = time.time() - 3600.0
+    assert abs(router._latency("ollama") - 10.0) < 0.1
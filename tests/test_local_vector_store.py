@@ -0,0 +1,83 @@
+# test_local_vector_store.py - Vector store nội bộ: file lệch độ dài sau crash, phân cụm IVF nền
+import json
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from local_vector_store import LocalVectorStore
+
+DIM = 8
+
+
+def _rows(*ids):
+    return [{"id": i, "document_id": i.split("#")[0], "chunk_index": 0, "content": i} for i in ids]
+
+
+def _unit(k):
+    v = np.zeros(DIM, dtype=np.float32)
+    v[k] = 1.0
+    return v
+
+
+def _ws_dir(tmp_path):
+    return os.path.join(str(tmp_path), "main")
+
+
+def test_orphan_vector_is_truncated_on_load(tmp_path):
+    store = LocalVectorStore(str(tmp_path), dim=DIM)
+    store.insert("main", _rows("a#0"), [_unit(0)])
+    # Crash giữa 2 lần ghi: vector đã ghi, dòng metadata chưa
+    with open(os.path.join(_ws_dir(tmp_path), "vectors.f16"), "ab") as f:
+        f.write(_unit(1).astype(np.float16).tobytes())
+
+    store = LocalVectorStore(str(tmp_path), dim=DIM)
+    store.insert("main", _rows("b#0"), [_unit(2)])
+    hit = store.search("main", _unit(2), 1)[0]
+    assert hit["id"] == "b#0" and hit["score"] > 0.99
+    assert os.path.getsize(os.path.join(_ws_dir(tmp_path), "vectors.f16")) == 2 * 2 * DIM
+
+
+def test_partial_json_line_is_dropped(tmp_path):
+    store = LocalVectorStore(str(tmp_path), dim=DIM)
+    store.insert("main", _rows("a#0"), [_unit(0)])
+    rows_path = os.path.join(_ws_dir(tmp_path), "rows.jsonl")
+    with open(rows_path, "a", encoding="utf-8") as f:
+        f.write('{"id": "b#0", "docum')
+
+    store = LocalVectorStore(str(tmp_path), dim=DIM)
+    assert store.count("main") == 1
+    store.insert("main", _rows("c#0"), [_unit(3)])
+    with open(rows_path, encoding="utf-8") as f:
+        assert [json.loads(line)["id"] for line in f] == ["a#0", "c#0"]
+    assert store.search("main", _unit(3), 1)[0]["id"] == "c#0"
+
+
+def test_failed_append_leaves_files_aligned(tmp_path, monkeypatch):
+    store = LocalVectorStore(str(tmp_path), dim=DIM)
+    store.insert("main", _rows("a#0"), [_unit(0)])
+
+    def broken_dumps(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(json, "dumps", broken_dumps)
+    with pytest.raises(OSError):
+        store.insert("main", _rows("b#0"), [_unit(1)])
+    monkeypatch.undo()
+
+    store.insert("main", _rows("c#0"), [_unit(2)])
+    assert store.search("main", _unit(2), 1)[0]["id"] == "c#0"
+    assert store.count("main") == 2
+
+
+def test_partitions_built_in_background(tmp_path):
+    store = LocalVectorStore(str(tmp_path), dim=DIM, n_lists=2, nprobe=2)
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(80, DIM)).astype(np.float32)
+    store.insert("main", _rows(*[f"d{i}#0" for i in range(80)]), vectors)
+    for thread in [t for t in threading.enumerate() if t.name == "ivf_partition"]:
+        thread.join(timeout=10)
+    index = store._get("main")
+    assert index.centroids is not None and len(index.assignments) == 80
+    # nprobe = số cụm -> vẫn tìm đúng như quét toàn bộ
+    assert store.search("main", vectors[5], 1)[0]["id"] == "d5#0"
@@ -0,0 +1,168 @@
+# test_openrouter_client.py - Fallback, circuit breaker (429 Retry-After, nửa mở) và hedged request với server giả lập
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from async_runtime import LoopBoundClient
+from llm_types import ChatMessage
+
+MESSAGES = [ChatMessage(role="user", content="Xin chào")]
+
+
+def _ok(model):
+    return httpx.Response(200, json={"choices": [{"message": {"content": f"trả lời từ {model}"}}],
+                                     "usage": {"total_tokens": 7}})
+
+
+@pytest.fixture
+def make_client(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+    monkeypatch.setenv("OPENROUTER_BASE_URL", "http://mock/v1")
+    monkeypatch.setenv("LLM_CACHE", "0")
+    from openrouter_client import OpenRouterClient
+
+    def make(responses, hedge_after=None):
+        """responses: model -> hàm (request) trả về httpx.Response (có thể là coroutine)"""
+        calls = []
+
+        async def handler(request):
+            model = json.loads(request.content)["model"]
+            calls.append(model)
+            result = responses[model](request)
+            return await result if asyncio.iscoroutine(result) else result
+
+        client = OpenRouterClient()
+        client.fallback_models = list(responses)
+        client.hedge_after = hedge_after
+        client.http = LoopBoundClient(httpx.Timeout(5.0), httpx.Limits(), transport=httpx.MockTransport(handler))
+        return client, calls
+
+    return make
+
+
+def _ask(client, **kwargs):
+    async def run():
+        try:
+            return await client.chat_completion(MESSAGES, **kwargs)
+        finally:
+            await client.close()
+    return asyncio.run(run())
+
+
+def test_uses_base_url_and_first_model(make_client):
+    seen = []
+
+    def first(request):
+        seen.append(str(request.url))
+        return _ok("a")
+
+    client, calls = make_client({"a": first, "b": lambda r: _ok("b")})
+    res = _ask(client)
+    assert (res.model, res.content, res.tokens_used) == ("a", "trả lời từ a", 7)
+    assert calls == ["a"]
+    assert seen == ["http://mock/v1/chat/completions"]
+
+
+def test_falls_back_on_server_error(make_client):
+    client, calls = make_client({"a": lambda r: httpx.Response(503), "b": lambda r: _ok("b")})
+    res = _ask(client)
+    assert res.model == "b"
+    assert calls == ["a", "b"]
+    assert client.breakers["a"].failures == 1
+    assert client.breakers["a"].state == "closed"  # 1 lỗi chưa đủ ngưỡng mở
+
+
+def test_client_error_does_not_count_against_model(make_client):
+    client, calls = make_client({"a": lambda r: httpx.Response(400), "b": lambda r: _ok("b")})
+    assert _ask(client).model == "b"
+    assert client.breakers["a"].failures == 0
+
+
+def test_all_models_failing_returns_error(make_client):
+    client, calls = make_client({"a": lambda r: httpx.Response(500), "b": lambda r: httpx.Response(502)})
+    res = _ask(client)
+    assert res.model == "error"
+    assert calls == ["a", "b"]
+
+
+def test_rate_limit_opens_breaker_for_retry_after(make_client):
+    client, calls = make_client({"a": lambda r: httpx.Response(429, headers={"Retry-After": "30"}),
+                                 "b": lambda r: _ok("b")})
+    assert _ask(client).model == "b"
+    breaker = client.breakers["a"]
+    assert breaker.state == "open"
+    assert 25 < breaker.open_until - time.time() <= 30
+    # Lượt sau bỏ qua model đang bị rate limit
+    calls.clear()
+    assert _ask(client).model == "b"
+    assert calls == ["b"]
+
+
+def test_breaker_opens_after_consecutive_failures(make_client):
+    client, calls = make_client({"a": lambda r: httpx.Response(500), "b": lambda r: _ok("b")})
+    for _ in range(3):
+        _ask(client)
+    assert client.breakers["a"].state == "open"
+    calls.clear()
+    _ask(client)
+    assert calls == ["b"]
+
+
+def test_half_open_trial_recovers(make_client):
+    responses = {"a": lambda r: httpx.Response(429, headers={"Retry-After": "30"}), "b": lambda r: _ok("b")}
+    client, calls = make_client(responses)
+    _ask(client)
+    breaker = client.breakers["a"]
+    # Hết cooldown -> nửa mở: đúng 1 request thử, thành công thì đóng lại
+    breaker.open_until = time.time() - 1
+    responses["a"] = lambda r: _ok("a")
+    calls.clear()
+    assert _ask(client).model == "a"
+    assert calls == ["a"]
+    assert (breaker.state, breaker.failures) == ("closed", 0)
+
+
+def test_half_open_trial_failure_reopens(make_client):
+    responses = {"a": lambda r: httpx.Response(429, headers={"Retry-After": "30"}), "b": lambda r: _ok("b")}
+    client, calls = make_client(responses)
+    _ask(client)
+    breaker = client.breakers["a"]
+    breaker.open_until = time.time() - 1
+    responses["a"] = lambda r: httpx.Response(500)
+    assert _ask(client).model == "b"
+    assert breaker.state == "open"
+    assert breaker.open_until > time.time()
+    assert not breaker.trial_in_flight
+
+
+def test_hedged_request_takes_faster_model(make_client):
+    async def slow(request):
+        await asyncio.sleep(2.0)
+        return _ok("a")
+
+    client, calls = make_client({"a": slow, "b": lambda r: _ok("b")}, hedge_after=0.05)
+    started = time.time()
+    res = _ask(client)
+    assert res.model == "b"
+    assert time.time() - started < 1.0
+    assert calls == ["a", "b"]
+    # Request chậm bị huỷ không tính là lỗi
+    assert client.breakers["a"].failures == 0
+    assert not client.breakers["a"].trial_in_flight
+
+
+def test_hedged_request_moves_on_after_failure(make_client):
+    client, calls = make_client({"a": lambda r: httpx.Response(503), "b": lambda r: _ok("b")}, hedge_after=5.0)
+    started = time.time()
+    assert _ask(client).model == "b"
+    assert time.time() - started < 1.0  # lỗi thì gọi model kế tiếp ngay, không chờ hết hedge_after
+
+
+def test_available_reflects_breakers(make_client):
+    client, _ = make_client({"a": lambda r: httpx.Response(429, headers={"Retry-After": "30"})})
+    assert client.available()
+    _ask(client)
+    assert not client.available()
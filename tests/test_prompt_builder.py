@@ -0,0 +1,65 @@
+# test_prompt_builder.py - Cắt lịch sử theo khối: luôn giữ tin gần nhất, điểm cắt ổn định giữa các lượt
+from prompt_builder import PromptBuilder
+
+PASSAGES = [{"source": "tcvn.pdf", "content": "nội dung " * 400}] * 5
+
+
+def _history(n, words=None):
+    """n tin đầu của cùng 1 hội thoại (độ dài mỗi tin chỉ phụ thuộc vị trí của nó)"""
+    return [{"role": "user" if i % 2 == 0 else "assistant",
+             "content": f"lời {i} " * (words or 40 + 30 * (i % 5))} for i in range(n)]
+
+
+def _start(built, history):
+    return len(history) - len(built["history"])
+
+
+def test_keeps_latest_messages_when_history_overflows():
+    builder = PromptBuilder(budget=3000)
+    for n in (2, 6, 12, 13, 24):
+        history = _history(n, words=200)
+        built = builder.build("Bạn là trợ lý.", "Câu hỏi?", PASSAGES, history)
+        assert len(built["history"]) >= 2
+        assert built["history"][-1]["content"] == history[-1]["content"][:len(built["history"][-1]["content"])]
+
+
+def test_cut_point_ignores_question_and_passages():
+    builder = PromptBuilder(budget=3000)
+    for n in range(1, 30):
+        history = _history(n)
+        short = builder.build("Bạn là trợ lý.", "Ngắn?", PASSAGES, history)
+        long_no_docs = builder.build("Bạn là trợ lý.", "câu hỏi dài " * 60, [], history)
+        assert _start(short, history) == _start(long_no_docs, history)
+
+
+def test_prefix_stable_between_cuts():
+    builder = PromptBuilder(budget=3000)
+    starts = []
+    for n in range(1, 40):
+        history = _history(n)
+        starts.append(_start(builder.build("Bạn là trợ lý.", "Câu hỏi?", PASSAGES, history), history))
+    # Điểm cắt không lùi lại và chỉ dịch ít lần (theo khối), không phải mỗi lượt
+    assert starts == sorted(starts)
+    assert len(set(starts)) <= len(starts) // 3
+
+
+def test_history_stays_within_budget():
+    builder = PromptBuilder(budget=3000)
+    for n in range(1, 30):
+        built = builder.build("Bạn là trợ lý.", "Câu hỏi?", PASSAGES, _history(n, words=200))
+        assert built["usage"]["history"] <= int(3000 * builder.history_share)
+        assert built["usage"]["total"] <= 3000
+
+
+def test_passage_cut_keeps_matched_chunk():
+    before, hit, after = "trước " * 600, "ĐOẠN TRÚNG tìm kiếm", " sau" * 600
+    passage = {"source": "a.pdf", "content": before + hit + after,
+               "hit_span": (len(before), len(before) + len(hit))}
+    builder = PromptBuilder(budget=3000, passage_max_tokens=200)
+    content = builder.build("Bạn là trợ lý.", "Câu hỏi?", [passage])["passages"][0]["content"]
+    assert hit in content
+    # Ngữ cảnh liền kề được giữ ở cả hai bên đoạn trúng
+    assert "trước" in content[:content.index(hit)] and "sau" in content[content.index(hit) + len(hit):]
+    # Không có hit_span -> cắt từ đầu như trước
+    plain = builder.build("Bạn là trợ lý.", "Câu hỏi?", [dict(passage, hit_span=None)])["passages"][0]["content"]
+    assert hit not in plain
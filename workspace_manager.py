@@ -130,6 +130,7 @@ class WorkspaceManager:
             with conn.cursor() as cur:
                 cur.execute("UPDATE documents SET workspace = 'main' WHERE workspace IS NULL")
                 conn.commit()
+            self.db.invalidate_workspace('main')
         finally:
             self.db._safe_put_connection(conn)
             
@@ -138,7 +139,18 @@ class WorkspaceManager:
         if not conn: return
         try:
             with conn.cursor() as cur:
+                cur.execute("SELECT workspace FROM documents WHERE id = %s", (doc_id,))
+                row = cur.fetchone()
+                old_ws = row['workspace'] if row else None
                 cur.execute("UPDATE documents SET workspace = %s WHERE id = %s", (ws_id, doc_id))
+                # Chunks mang workspace riêng (dùng cho tìm Keyword) -> chuyển theo
+                cur.execute("UPDATE chunks SET workspace = %s WHERE document_id = %s", (ws_id, doc_id))
+                cur.execute("UPDATE document_codes SET workspace = %s WHERE document_id = %s", (ws_id, doc_id))
                 conn.commit()
+            if self.db.local_vector_store:
+                self.db.local_vector_store.move_document(doc_id, ws_id)
+            if self.db.keyword_index:
+                self.db.keyword_index.move_document(doc_id, ws_id)
+            self.db.invalidate_workspace(old_ws, ws_id)
         finally:
             self.db._safe_put_connection(conn)
\ No newline at end of file